@@ -0,0 +1,327 @@
+"""
+可复现的性能基准：合成贴纸语料 → 每种索引类型分别建库 → 单张/批量查询延迟。
+
+    python benchmark.py run --images 2000 --queries 200 --index-types flat hnsw --batch-sizes 1 8 32 --out base.json
+    python benchmark.py compare base.json new.json
+
+每种索引类型在独立的子进程里跑，峰值 RSS 互不影响，模块级的模型/索引缓存也不会串。
+结果写成 JSON：建库 img/s、单张和批量查询的 p50/p95/p99、峰值 RSS、索引文件大小。
+compare 按指标方向（越大越好/越小越好）比较两次结果，超过阈值的退化返回非零退出码。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from paths import get_project_root
+
+DB_PREFIX = "_bench_"
+RESULT_VERSION = 1
+# compare 时每个指标的方向：True 表示越大越好
+METRIC_DIRECTIONS = {"build_img_per_s": True, "query_qps": True, "p50_ms": False, "p95_ms": False,
+                     "p99_ms": False, "peak_rss_mb": False, "index_mb": False,
+                     "recall@1": True, "recall@5": True, "recall@10": True}
+
+
+def make_corpus(out_dir: Path, n: int, seed: int = 0) -> List[Path]:
+    """
+    生成 n 张确定性的合成贴纸（随机底色、几何图形和线条，128~512 像素，约 1/3 为 JPG）。
+    目录里已经有同样参数生成的语料时直接复用
+    """
+    marker = out_dir / "corpus.json"
+    spec = {"images": n, "seed": seed}
+    if marker.exists():
+        with open(marker, "r", encoding="utf-8") as f:
+            if json.load(f) == spec:
+                return sorted(p for p in out_dir.iterdir() if p.suffix in (".png", ".jpg"))
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n):
+        w, h = rng.randint(128, 512), rng.randint(128, 512)
+        img = Image.new("RGB", (w, h), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(3, 12)):
+            x0, x1 = sorted(rng.randrange(w) for _ in range(2))
+            y0, y1 = sorted(rng.randrange(h) for _ in range(2))
+            xy = (x0, y0, x1, y1)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            shape = rng.randrange(3)
+            if shape == 0:
+                draw.ellipse(xy, fill=color)
+            elif shape == 1:
+                draw.rectangle(xy, fill=color)
+            else:
+                draw.line(xy, fill=color, width=rng.randint(1, 8))
+        path = out_dir / (f"syn{i:06d}.jpg" if i % 3 == 2 else f"syn{i:06d}.png")
+        if path.suffix == ".jpg":
+            img.save(path, quality=90)
+        else:
+            img.save(path)
+        paths.append(path)
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    return paths
+
+
+def make_queries(paths: List[Path], n: int, seed: int = 0) -> List[Image.Image]:
+    """从语料里抽 n 张，缩放到 90% 模拟剪贴板里的截图，全部解码到内存，不计入查询时间"""
+    rng = random.Random(seed + 1)
+    queries = []
+    for p in (rng.choice(paths) for _ in range(n)):
+        with Image.open(p) as img:
+            queries.append(img.convert("RGB").resize((max(1, img.width * 9 // 10), max(1, img.height * 9 // 10))))
+    return queries
+
+
+def percentiles(seconds: List[float]) -> dict:
+    ms = np.asarray(seconds) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)), "mean_ms": float(ms.mean())}
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位是 KB，macOS 是字节
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def _dir_mb(db_dir: Path, names) -> float:
+    return sum((db_dir / fn).stat().st_size for fn in names if (db_dir / fn).exists()) / 2**20
+
+
+def run_one(corpus_dir: Path, index_type: str, n_queries: int, batch_sizes: List[int], topk: int,
+            device: str, backend: str, int8: bool, seed: int) -> dict:
+    """子进程里执行：建一个库并测查询，返回这一种索引类型的结果"""
+    import build_index
+    import search
+    import stickers_db
+
+    search.DEVICE = device
+    db_name = DB_PREFIX + index_type
+    db_dir = get_project_root() / "databases" / db_name
+    shutil.rmtree(db_dir, ignore_errors=True)
+    n_images = len(build_index.list_images(corpus_dir))
+
+    t0 = time.perf_counter()
+    build_index.build_index_gui(corpus_dir, db_name, device=device, incremental=False,
+                                index_type=index_type, backend=backend, int8=int8)
+    build_s = time.perf_counter() - t0
+    build_rss = peak_rss_mb()
+
+    queries = make_queries(build_index.list_images(db_dir / "stickers"), n_queries, seed)
+    search.set_backend(backend, int8)
+    search.switch_database(db_dir)
+    for img in queries[:5]:
+        search.find_sticker(img, db_dir, topk=topk, use_cache=False)
+
+    single = []
+    for img in queries:
+        t = time.perf_counter()
+        search.find_sticker(img, db_dir, topk=topk, use_cache=False)
+        single.append(time.perf_counter() - t)
+    result = {
+        "index_type": search.INDEX_META.get("index_type", index_type),
+        "images": n_images,
+        "build_s": build_s,
+        "build_img_per_s": n_images / build_s,
+        "index_mb": stickers_db.DatabaseFile(db_dir / stickers_db.DB_NAME).index_len / (1 << 20),
+        "db_mb": _dir_mb(db_dir, [stickers_db.DB_NAME, "stickers.emb", "stickers.manifest.json",
+                                  "stickers.meta.json"]),
+        "peak_rss_mb_build": build_rss,
+        # 建库时和精确搜索比较的 recall@k（flat 没有）
+        "recall": (search.INDEX_META.get("recall") or {}).get("recall"),
+        "single": {**percentiles(single), "query_qps": len(single) / sum(single)},
+        "batch": {},
+    }
+    for bs in batch_sizes:
+        latencies = []
+        for i in range(0, len(queries) - bs + 1, bs):
+            t = time.perf_counter()
+            search.find_stickers_batch(queries[i:i + bs], db_dir, topk=topk, batch_size=bs)
+            latencies.append(time.perf_counter() - t)
+        if latencies:
+            # p50/p95/p99 是整批的延迟，query_qps 按每张图计
+            result["batch"][str(bs)] = {**percentiles(latencies), "query_qps": bs * len(latencies) / sum(latencies)}
+    result["peak_rss_mb"] = peak_rss_mb()
+    search.release_resources(db_dir)
+    return result
+
+
+def environment(device: str, backend: str, int8: bool) -> dict:
+    import faiss
+    import torch
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "faiss": faiss.__version__,
+        "device": device,
+        "backend": f"{backend}-int8" if int8 else backend,
+    }
+
+
+def run(args) -> dict:
+    root = get_project_root()
+    corpus_dir = Path(args.corpus or root / "bench" / f"corpus_{args.images}_{args.seed}")
+    t0 = time.perf_counter()
+    paths = make_corpus(corpus_dir, args.images, args.seed)
+    print(f"[benchmark] Corpus: {len(paths)} images in {corpus_dir} ({time.perf_counter() - t0:.1f}s)")
+
+    os.makedirs(root / "bench", exist_ok=True)
+    result_path = root / "bench" / "result.tmp.json"
+    results = []
+    for index_type in args.index_types:
+        print(f"[benchmark] {index_type} ...")
+        cmd = [sys.executable, str(Path(__file__).resolve()), "_one", str(corpus_dir), index_type,
+               "--queries", str(args.queries), "--topk", str(args.topk), "--device", args.device,
+               "--backend", args.backend, "--seed", str(args.seed),
+               "--result", str(result_path), "--batch-sizes", *map(str, args.batch_sizes)]
+        if args.int8:
+            cmd.append("--int8")
+        subprocess.run(cmd, check=True, stdout=None if args.verbose else subprocess.DEVNULL)
+        with open(result_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+        results.append(result)
+        # 没有 resource 模块的平台（Windows）测不到峰值 RSS
+        rss = result["peak_rss_mb"]
+        print(f"[benchmark] {index_type}: build {result['build_img_per_s']:.1f} img/s, "
+              f"single p50 {result['single']['p50_ms']:.1f} ms / p99 {result['single']['p99_ms']:.1f} ms, "
+              f"peak RSS {'n/a' if rss is None else f'{rss:.0f} MB'}, index {result['index_mb']:.2f} MB")
+        if not args.keep:
+            shutil.rmtree(root / "databases" / (DB_PREFIX + index_type), ignore_errors=True)
+    os.remove(result_path)
+
+    return {
+        "version": RESULT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "env": environment(args.device, args.backend, args.int8),
+        "config": {"images": args.images, "queries": args.queries, "topk": args.topk, "seed": args.seed,
+                   "batch_sizes": args.batch_sizes},
+        "results": results,
+    }
+
+
+def flatten(report: dict) -> Dict[str, float]:
+    """把结果展开成 "hnsw/batch8/p95_ms" 这样的键，方便两次结果逐项比较"""
+    flat = {}
+    for r in report["results"]:
+        t = r["index_type"]
+        for key in ("build_img_per_s", "peak_rss_mb", "index_mb"):
+            if r.get(key) is not None:
+                flat[f"{t}/{key}"] = r[key]
+        for k, value in (r.get("recall") or {}).items():
+            flat[f"{t}/recall{k}"] = value
+        for key, value in r["single"].items():
+            flat[f"{t}/single/{key}"] = value
+        for bs, stats in r["batch"].items():
+            for key, value in stats.items():
+                flat[f"{t}/batch{bs}/{key}"] = value
+    return flat
+
+
+def compare(base: dict, new: dict, threshold: float) -> List[str]:
+    """打印两次结果的对比表，返回超过阈值（百分比）的退化指标"""
+    if base.get("config") != new.get("config"):
+        print(f"[benchmark] Warning: configs differ\n  base: {base.get('config')}\n  new:  {new.get('config')}")
+    if base.get("env") != new.get("env"):
+        print(f"[benchmark] Warning: environments differ\n  base: {base.get('env')}\n  new:  {new.get('env')}")
+    a, b = flatten(base), flatten(new)
+    regressions = []
+    print(f"{'metric':<36}{'base':>12}{'new':>12}{'change':>10}")
+    for key in sorted(a.keys() & b.keys()):
+        higher_better = METRIC_DIRECTIONS.get(key.rsplit("/", 1)[-1])
+        if higher_better is None or not a[key]:
+            continue
+        change = (b[key] - a[key]) / a[key] * 100
+        worse = -change if higher_better else change
+        flag = ""
+        if worse > threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif -worse > threshold:
+            flag = "  improved"
+        print(f"{key:<36}{a[key]:>12.2f}{b[key]:>12.2f}{change:>+9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    # 索引类型以建库端为准；build_index 会导入 torch，只在解析命令行时才导入
+    from build_index import INDEX_TYPES
+
+    parser = argparse.ArgumentParser(description="建库吞吐和查询延迟基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="生成合成语料并跑基准")
+    p_run.add_argument("--images", type=int, default=1000, help="合成语料的图片数")
+    p_run.add_argument("--queries", type=int, default=200)
+    p_run.add_argument("--index-types", nargs="+", default=["flat", "hnsw"], choices=INDEX_TYPES)
+    p_run.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    p_run.add_argument("--topk", type=int, default=5)
+    p_run.add_argument("--device", default="cpu", choices=["cpu", "cuda"])
+    p_run.add_argument("--backend", default="eager", choices=["eager", "torchscript", "onnx"])
+    p_run.add_argument("--int8", action="store_true")
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--corpus", help="语料目录，默认 bench/corpus_<images>_<seed>")
+    p_run.add_argument("--out", default="benchmark.json")
+    p_run.add_argument("--keep", action="store_true", help="保留 databases/_bench_* 测试库")
+    p_run.add_argument("--verbose", action="store_true", help="显示建库日志")
+
+    p_cmp = sub.add_parser("compare", help="比较两次结果")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=10.0, help="判定退化的百分比阈值")
+
+    # 内部使用：在独立进程里跑一种索引类型
+    p_one = sub.add_parser("_one")
+    p_one.add_argument("corpus_dir")
+    p_one.add_argument("index_type")
+    p_one.add_argument("--queries", type=int)
+    p_one.add_argument("--batch-sizes", nargs="+", type=int)
+    p_one.add_argument("--topk", type=int)
+    p_one.add_argument("--device")
+    p_one.add_argument("--backend")
+    p_one.add_argument("--int8", action="store_true")
+    p_one.add_argument("--seed", type=int)
+    p_one.add_argument("--result")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run(args)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[benchmark] Results written to {args.out}")
+    elif args.command == "compare":
+        with open(args.base, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        if regressions:
+            print(f"[benchmark] {len(regressions)} metrics regressed by more than {args.threshold:.0f}%")
+            sys.exit(1)
+    else:
+        result = run_one(Path(args.corpus_dir), args.index_type, args.queries, args.batch_sizes, args.topk,
+                         args.device, args.backend, args.int8, args.seed)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,956 @@
 import os
 import json
+import math
 import time
+import queue
 import shutil
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
-import sys
+import numpy as np
 import torch
 import faiss
 from PIL import Image
-import clip
 from tqdm import tqdm  # 命令行进度条
 
+import fast_preprocess
+import inference
+import stickers_db
+from embeddings import EmbeddingStore, open_embeddings, read_header
+from encoders import BACKENDS, backend_label, load_encoder
+from groups import write_groups
+from paths import IMAGE_EXTS, get_project_root
+from thumbs import ThumbSpill, make_thumbnail, open_pack, write_thumbs
+
 BATCH_SIZE = 32
+# 解码/预处理线程数和预取批次数：编码器消费一个批次时，后面的批次已经在解码
+DECODE_WORKERS = max(1, min(8, (os.cpu_count() or 2) - 1))
+PREFETCH_BATCHES = 4
+
+# 每个文件的内容清单：sha1 + mtime + size + 向量 ID，和 stickers.db 放在一起
+MANIFEST_NAME = "stickers.manifest.json"
+MANIFEST_VERSION = 1
+# 库级元数据：模型、索引类型、训练参数和搜索参数（nprobe/efSearch）
+META_NAME = "stickers.meta.json"
+# 结果窗口用的缩略图包（thumbs.py），弹窗时不再打开原图
+THUMBS_NAME = "stickers.thumbs"
+# 建库中新生成的缩略图先追加到这里，建完再并入 stickers.thumbs
+THUMBS_SPILL_NAME = "stickers.thumbs.pending"
+# 建库进度：每编码完一轮追加一行，中断后下次建库从这里续上，建完删除
+CHECKPOINT_NAME = "stickers.checkpoint.jsonl"
+
+# 流式建库：每扫描 SCAN_CHUNK 个文件编码一轮并写检查点，内存里只有这一轮的数据；
+# 建索引时每次从 stickers.emb 读 ADD_CHUNK 行，IVF 最多抽 TRAIN_SAMPLE 个向量训练
+SCAN_CHUNK = 2048
+ADD_CHUNK = 16384
+TRAIN_SAMPLE = 100000
+# 近似重复合并时每次拿这么多向量和已有代表比较
+COLLAPSE_CHUNK = 1024
+# 建完近似索引后抽这么多个库内向量做查询，和精确扫描比较 recall@k
+RECALL_QUERIES = 200
+RECALL_KS = (1, 5, 10)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "pca_refine")
+# 贴纸文件进库的方式：link 硬链接到库目录（不占额外空间，跨盘等失败时退回复制），
+# copy 复制到库目录，inplace 不进库、直接引用源文件夹（路径记在 stickers.meta.json 的 sticker_dir）
+INGEST_MODES = ("link", "copy", "inplace")
+
+def iter_images(sticker_dir: Path) -> Iterator[Path]:
+    """逐个目录遍历（目录内按名称排序），不会一次性列出全部文件"""
+    for root, dirs, fns in os.walk(sticker_dir):
+        dirs.sort()
+        for fn in sorted(fns):
+            if Path(fn).suffix.lower() in IMAGE_EXTS:
+                yield Path(root)/fn
 
 def list_images(sticker_dir: Path) -> List[Path]:
-    exts = {".png", ".jpg", ".jpeg"}
-    files = [Path(root)/fn for root, _, fns in os.walk(sticker_dir)
-             for fn in fns if Path(fn).suffix.lower() in exts]
-    files.sort()
-    return files
+    return sorted(iter_images(sticker_dir))
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(db_dir: Path) -> Optional[dict]:
+    path = db_dir / MANIFEST_NAME
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def save_manifest(db_dir: Path, manifest: dict):
+    with open(db_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+def _new_manifest(model_name: str) -> dict:
+    return {"version": MANIFEST_VERSION, "model_name": model_name, "next_id": 0, "files": {}}
+
+def _load_existing_index(db_dir: Path, manifest: Optional[dict], model_name: str,
+                         expected: Optional[int] = None):
+    """
+    读取上一次的索引（stickers.db，旧库为 stickers.faiss）；模型不同、旧版非 ID 映射索引
+    或与清单对不上时返回 None（全量重建）。合并过近似重复的索引只含代表，条数由调用方通过 expected 给出
+    """
+    if manifest is None or manifest.get("model_name") != model_name:
+        return None
+    try:
+        index = stickers_db.load_index(db_dir)
+    except ValueError as e:
+        print(f"[build_index] {e}, rebuilding")
+        return None
+    if index is None or not isinstance(index, (faiss.IndexIDMap2, faiss.IndexIVF)):
+        return None
+    if expected is None:
+        expected = len({entry["id"] for entry in manifest["files"].values()})
+    if index.ntotal != expected:
+        print(f"[build_index] Manifest out of sync ({expected} ids vs {index.ntotal} vectors), rebuilding")
+        return None
+    return index
+
+def choose_index_type(n: int) -> str:
+    """
+    按库大小自动选择索引类型：小库暴力搜索最准也够快，
+    中等规模用 IVF-Flat（支持按 ID 删除，适合增量建库），百万级用 IVF-PQ 压缩内存。
+    HNSW 查询最快但不支持删除，需要显式指定。
+    pca_refine 两阶段检索：PCA 降维后的粗排取 rerank 个候选，再用原始向量精确重排，
+    适合 ViT-L/14 这类高维库，同样需要显式指定。
+    """
+    if n < 20000:
+        return "flat"
+    if n < 1000000:
+        return "ivf_flat"
+    return "ivf_pq"
+
+def default_index_params(index_type: str, n: int, dim: int) -> dict:
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = int(min(65536, max(16, 4 * math.sqrt(n))))
+        params = {"nlist": nlist, "nprobe": min(nlist, max(8, nlist // 16))}
+        if index_type == "ivf_pq":
+            # 每个子量化器 16 维左右，8 bit 编码
+            m = max(d for d in range(1, 65) if dim % d == 0 and d <= max(1, dim // 16))
+            params.update({"pq_m": m, "pq_nbits": 8})
+        return params
+    if index_type == "hnsw":
+        return {"M": 32, "efConstruction": 80, "efSearch": 64}
+    if index_type == "pca_refine":
+        return {"pca_dim": max(32, dim // 4), "rerank": 100}
+    return {}
+
+def _min_train_size(index_type: str, params: dict) -> int:
+    # faiss 训练的硬性下限（每个聚类中心至少一个点），不足 39 倍时 faiss 自己会给出警告
+    if index_type == "ivf_flat":
+        return params["nlist"]
+    if index_type == "ivf_pq":
+        return max(params["nlist"], 1 << params["pq_nbits"])
+    if index_type == "pca_refine":
+        return params["pca_dim"]
+    return 0
+
+def make_index(index_type: str, dim: int, params: dict):
+    """创建空索引；所有类型都支持 add_with_ids，IVF 自带 ID，其余用 IndexIDMap2 包一层"""
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    if index_type == "ivf_flat":
+        return faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, params["nlist"])
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, params["nlist"], params["pq_m"], params["pq_nbits"])
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, params["M"])
+        hnsw.hnsw.efConstruction = params["efConstruction"]
+        return faiss.IndexIDMap2(hnsw)
+    if index_type == "pca_refine":
+        # 粗排在 pca_dim 维上暴力搜索，IndexRefineFlat 另存一份原始向量用于精排
+        coarse = faiss.IndexPreTransform(faiss.PCAMatrix(dim, params["pca_dim"]), faiss.IndexFlatL2(params["pca_dim"]))
+        return faiss.IndexIDMap2(faiss.IndexRefineFlat(coarse))
+    raise ValueError(f"Unknown index type: {index_type}")
+
+def _supports_remove(index) -> bool:
+    if isinstance(index, faiss.IndexIDMap2):
+        return not isinstance(faiss.downcast_index(index.index), (faiss.IndexHNSW, faiss.IndexRefine))
+    return True
+
+def _reconstruct_all(index) -> Tuple[np.ndarray, np.ndarray]:
+    """取回索引中全部 (ID, 向量)；IVF-PQ 取回的是量化后的近似值"""
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        return faiss.vector_to_array(index.id_map), inner.reconstruct_n(0, inner.ntotal)
+    invlists = index.invlists
+    ids = np.concatenate([faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+                          for l in range(index.nlist)] + [np.zeros(0, dtype=np.int64)])
+    # ID 不连续，只能用哈希表形式的 direct map
+    index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    vectors = index.reconstruct_batch(ids) if len(ids) else np.zeros((0, index.d), "float32")
+    index.set_direct_map_type(faiss.DirectMap.NoMap)
+    return ids, vectors
+
+def _read_vectors(matrix: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    feats = np.asarray(matrix[ids], dtype=np.float32)
+    # float16 存储有舍入误差，重新归一化
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True)
+    return feats
+
+def _add_from_store(index, matrix: np.ndarray, ids: np.ndarray):
+    """按 ADD_CHUNK 分块从特征文件读向量加入索引"""
+    for i in range(0, len(ids), ADD_CHUNK):
+        chunk = ids[i:i+ADD_CHUNK]
+        index.add_with_ids(_read_vectors(matrix, chunk), chunk)
+
+def _index_from_store(matrix: np.ndarray, ids: np.ndarray, index_type: str, index_params: Optional[dict]):
+    """
+    用特征文件里的向量创建新索引，返回 (index, 实际类型, 参数)；向量太少时退回 flat。
+    IVF 只用抽样训练，之后分块加入，除索引本身外内存占用与库大小无关
+    """
+    dim = matrix.shape[1]
+    params = default_index_params(index_type, len(ids), dim)
+    params.update(index_params or {})
+    if "nlist" in params:
+        params["nprobe"] = min(params["nprobe"], params["nlist"])
+    if len(ids) < _min_train_size(index_type, params):
+        print(f"[build_index] {len(ids)} vectors too few to train {index_type}, using flat")
+        index_type, params = "flat", {}
+    index = make_index(index_type, dim, params)
+    if not index.is_trained:
+        t0 = time.time()
+        # faiss 建议每个聚类中心 39 个以上的训练点
+        n_train = min(len(ids), max(TRAIN_SAMPLE, 39 * params.get("nlist", 0)))
+        sample = ids if n_train == len(ids) else np.sort(np.random.default_rng(0).choice(ids, n_train, replace=False))
+        index.train(_read_vectors(matrix, sample))
+        print(f"[build_index] Trained {index_type} {params} on {n_train} vectors in {time.time()-t0:.2f}s")
+    _add_from_store(index, matrix, ids)
+    return index, index_type, params
+
+def _embeddings_complete(emb_path: Path, model_name: str, dim: int, count: int) -> bool:
+    """特征文件存在、模型和维度对得上、并且覆盖清单里全部 count 个 ID"""
+    header = read_header(emb_path)
+    return header is not None and header["model_name"] == model_name and header["dim"] == dim \
+        and header["count"] >= count
+
+def _open_embedding_store(emb_path: Path, model_name: str, index, count: int) -> EmbeddingStore:
+    """增量建库时打开已有特征文件；旧库没有特征文件（或不完整）时先从索引里取回已有向量补齐"""
+    complete = _embeddings_complete(emb_path, model_name, index.d, count)
+    store = EmbeddingStore(emb_path, model_name, index.d, count)
+    if not complete:
+        print("[build_index] Backfilling embeddings file from the existing index")
+        ids, vectors = _reconstruct_all(index)
+        store.write(ids, vectors)
+    return store
+
+def set_runtime_params(index, index_type: str, params: dict, k: int):
+    """按建库参数设置搜索期参数（nprobe / efSearch / 精排倍数），和 search.py 的默认行为一致"""
+    space = faiss.ParameterSpace()
+    if index_type in ("ivf_flat", "ivf_pq"):
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    elif index_type == "hnsw":
+        space.set_index_parameter(index, "efSearch", params["efSearch"])
+    elif index_type == "pca_refine":
+        # 粗排候选数 = k * k_factor
+        space.set_index_parameter(index, "k_factor_rf", max(1.0, params["rerank"] / k))
+
+def measure_recall(index, matrix: np.ndarray, ids: np.ndarray, index_type: str, params: dict,
+                   n_queries: int = RECALL_QUERIES, ks: Sequence[int] = RECALL_KS) -> dict:
+    """
+    抽样库内向量作为查询，和分块精确扫描 stickers.emb 的 top-k 比较，
+    返回 {"queries", "recall": {"@k": ...}, "search_ms"}，用来在延迟和准确率之间取舍
+    """
+    k = min(max(ks), len(ids))
+    rng = np.random.default_rng(0)
+    query_ids = np.sort(rng.choice(ids, min(n_queries, len(ids)), replace=False))
+    queries = _read_vectors(matrix, query_ids)
+    heap = faiss.ResultHeap(len(queries), k)
+    for i in range(0, len(ids), ADD_CHUNK):
+        chunk = ids[i:i+ADD_CHUNK]
+        distances, rows = faiss.knn(queries, _read_vectors(matrix, chunk), min(k, len(chunk)))
+        heap.add_result(distances, chunk[rows])
+    heap.finalize()
+    set_runtime_params(index, index_type, params, k)
+    t0 = time.perf_counter()
+    _, approx = index.search(queries, k)
+    search_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+    recall = {}
+    for kk in ks:
+        if kk <= k:
+            hits = sum(len(set(a[:kk].tolist()) & set(e[:kk].tolist())) for a, e in zip(approx, heap.I))
+            recall[f"@{kk}"] = hits / (kk * len(queries))
+    return {"queries": len(queries), "recall": recall, "search_ms": search_ms}
+
+def _report_recall(index, matrix: np.ndarray, ids: np.ndarray, index_type: str, params: dict) -> Optional[dict]:
+    """flat 本身就是精确搜索，不用测"""
+    if index_type == "flat" or not len(ids):
+        return None
+    t0 = time.time()
+    result = measure_recall(index, matrix, ids, index_type, params)
+    recall = " ".join(f"recall{k} {v:.3f}" for k, v in result["recall"].items())
+    print(f"[build_index] {index_type}: {recall} over {result['queries']} queries, "
+          f"{result['search_ms']:.3f} ms/query (measured in {time.time()-t0:.2f}s)")
+    return result
+
+def collapse_near_duplicates(matrix: np.ndarray, ids: np.ndarray, threshold: float) -> Dict[int, int]:
+    """
+    贪心合并近似重复（重新压缩、缩放、加水印的变体）：按 ID 顺序分块处理，
+    与已有代表的余弦相似度 >= threshold 的归入最相似的代表，否则自己成为新代表。
+    返回 成员 ID -> 代表 ID，代表本身不在里面
+    """
+    reps = faiss.IndexFlatIP(matrix.shape[1])
+    rep_ids: List[int] = []
+    rep_of: Dict[int, int] = {}
+    for i in range(0, len(ids), COLLAPSE_CHUNK):
+        chunk = ids[i:i+COLLAPSE_CHUNK]
+        feats = _read_vectors(matrix, chunk)
+        if reps.ntotal:
+            best, nearest = reps.search(feats, 1)
+            best, nearest = best[:, 0], nearest[:, 0]
+        else:
+            best, nearest = np.full(len(chunk), -np.inf, dtype=np.float32), np.zeros(len(chunk), dtype=np.int64)
+        # 同一块里的向量还没进代表索引，块内两两比较，只和前面已成为代表的比
+        sims = feats @ feats.T
+        new_rows: List[int] = []
+        for j, fid in enumerate(chunk.tolist()):
+            target = rep_ids[nearest[j]] if best[j] >= threshold else None
+            score = best[j]
+            if new_rows:
+                row_sims = sims[j, new_rows]
+                k = int(np.argmax(row_sims))
+                if row_sims[k] >= threshold and row_sims[k] > score:
+                    target = int(chunk[new_rows[k]])
+            if target is None:
+                new_rows.append(j)
+            else:
+                rep_of[fid] = target
+        reps.add(feats[new_rows])
+        rep_ids.extend(chunk[new_rows].tolist())
+    return rep_of
+
+def _group_members(files: Dict[str, dict], names: List[Optional[str]],
+                   rep_of: Dict[int, int]) -> Dict[str, List[str]]:
+    """代表名 -> 同组其它名字：共用向量 ID 的完全重复 + 合并进来的近似重复"""
+    members: Dict[str, List[str]] = {}
+    for name, entry in files.items():
+        fid = entry["id"]
+        rep_name = names[rep_of.get(fid, fid)]
+        if name != rep_name:
+            members.setdefault(rep_name, []).append(name)
+    return members
 
-def build_index_gui(sticker_dir: Path, db_name: str, device=None):
+def _load_checkpoint(db_dir: Path, model_name: str) -> Optional[dict]:
+    """
+    读回上次中断的建库进度 {"fresh", "next_id", "files"}；模型不同或特征文件对不上时返回 None。
+    最后一行可能只写了一半，直接丢弃
+    """
+    path = db_dir / CHECKPOINT_NAME
+    header = read_header(db_dir / "stickers.emb")
+    if not path.exists() or header is None or header["model_name"] != model_name:
+        return None
+    checkpoint = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if checkpoint is None:
+                checkpoint = {"model_name": record.get("model_name"), "fresh": record.get("fresh", True),
+                              "next_id": 0, "files": {}}
+                continue
+            checkpoint["files"].update(record["files"])
+            checkpoint["next_id"] = record["next_id"]
+    if checkpoint is None or checkpoint["model_name"] != model_name or not checkpoint["files"]:
+        return None
+    return checkpoint
+
+def _append_checkpoint(path: Path, header: Optional[dict], files: Dict[str, dict], next_id: int):
+    """header 不为 None 时新建文件并先写入头部；每轮一行，写完 fsync"""
+    with open(path, "w" if header is not None else "a", encoding="utf-8") as f:
+        if header is not None:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"next_id": next_id, "files": files}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def load_meta(db_dir: Path) -> Optional[dict]:
+    path = db_dir / META_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_meta(db_dir: Path, meta: dict):
+    with open(db_dir / META_NAME, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+def _names_by_id(files: Dict[str, dict], next_id: int) -> List[Optional[str]]:
+    # 名称表按向量 ID 存名字，已删除的 ID 留空（null）；
+    # 内容相同的文件共用一个 ID，结果里显示第一个名字，其余名字只在清单里
+    names: List[Optional[str]] = [None] * next_id
+    for name, entry in files.items():
+        if names[entry["id"]] is None:
+            names[entry["id"]] = name
+    return names
+
+def _copy_if_changed(src: Path, dst: Path):
+    if dst.exists():
+        s, d = src.stat(), dst.stat()
+        # copy2 会保留 mtime，大小和 mtime 都一致就认为没变
+        if s.st_size == d.st_size and int(s.st_mtime) == int(d.st_mtime):
+            return
+        # dst 可能是和别的重复文件共用的硬链接，直接覆盖会连带改掉另一份
+        dst.unlink()
+    shutil.copy2(src, dst)
+
+def _link_if_changed(src: Path, dst: Path):
+    if dst.exists():
+        if os.path.samefile(src, dst):
+            return
+        dst.unlink()
+    os.link(src, dst)
+
+def _link_duplicate(first: Path, dst: Path) -> bool:
+    """把内容重复的文件硬链接到库里已经存下的第一份；文件系统不支持时返回 False，由调用方复制"""
+    if dst.exists():
+        if os.path.samefile(first, dst):
+            return True
+        dst.unlink()
+    try:
+        os.link(first, dst)
+    except OSError:
+        return False
+    return True
+
+def ingest_stickers(src_dir: Path, dst_dir: Path, mode: str = "link"):
+    """
+    把贴纸文件夹（含子文件夹）同步到库目录，保留相对路径；硬链接失败时整批退回复制。
+    复制时内容相同的文件只存一份：大小撞车的才算 sha1，后出现的硬链接到库里的第一份。
+    源文件夹里已经删除的贴纸，库目录里的副本也删掉，扫描时才会算作删除
+    """
+    linking = mode == "link"
+    files = list(iter_images(src_dir))
+    wanted = {fp.relative_to(src_dir) for fp in files}
+    sizes = {fp: fp.stat().st_size for fp in files}
+    size_counts = Counter(sizes.values())
+    stored: Dict[str, Path] = {}
+    for fp in files:
+        dst = dst_dir / fp.relative_to(src_dir)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if linking:
+            try:
+                _link_if_changed(fp, dst)
+                continue
+            except OSError as e:
+                print(f"[build_index] Hardlink failed ({e}), copying instead")
+                linking = False
+        if size_counts[sizes[fp]] > 1:
+            first = stored.setdefault(file_digest(fp), dst)
+            if first != dst and _link_duplicate(first, dst):
+                continue
+        _copy_if_changed(fp, dst)
+    for fp in list(iter_images(dst_dir)):
+        if fp.relative_to(dst_dir) not in wanted:
+            fp.unlink()
+
+class PipelineStats:
+    """记录解码和编码两个阶段的耗时，用来判断瓶颈在哪一边"""
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self.decoded = 0
+        self.decode_time = 0.0
+        self._decode_span = [0.0, 0.0]
+        self.encoded = 0
+        self.encode_time = 0.0
+        self.wait_time = 0.0
+
+    def add_decode(self, started: float, finished: float):
+        with self._lock:
+            if not self.decoded:
+                self._decode_span[0] = started
+            self.decoded += 1
+            self.decode_time += finished - started
+            self._decode_span[1] = max(self._decode_span[1], finished)
+
+    def add_encode(self, count: int, seconds: float):
+        self.encoded += count
+        self.encode_time += seconds
+
+    def decode_rate(self) -> float:
+        # 解码阶段的实际墙钟吞吐（所有线程合计）
+        span = self._decode_span[1] - self._decode_span[0]
+        return self.decoded / span if span > 0 else 0.0
+
+    def encode_rate(self) -> float:
+        return self.encoded / self.encode_time if self.encode_time else 0.0
+
+    def report(self) -> str:
+        per_worker = self.decoded / self.decode_time if self.decode_time else 0.0
+        return (f"decode {self.decode_rate():.1f} img/s ({self.workers} workers, {per_worker:.1f} img/s each), "
+                f"encode {self.encode_rate():.1f} img/s, encoder waited {self.wait_time:.2f}s for input")
+
+def iter_preprocessed_batches(items: Sequence[Tuple[Path, int]], preprocess, batch_size: int = BATCH_SIZE,
+                              workers: int = DECODE_WORKERS, prefetch: int = PREFETCH_BATCHES,
+                              stats: Optional[PipelineStats] = None,
+                              on_decode: Optional[Callable[[int, Image.Image], None]] = None
+                              ) -> Iterator[Tuple[list, torch.Tensor]]:
+    """
+    线程池并行解码+预处理，最多预取 prefetch 个批次放在有界队列里，
+    主线程取出后直接送去 encode_image。产出 (batch, image_tensor)。
+    on_decode(向量 ID, 原图) 在解码线程里调用，用于顺便生成缩略图等。
+    preprocess 为 fast_preprocess.BatchPreprocess 时走快速路径：JPEG 缩小解码，
+    解码线程只产出 uint8 数组，整批在主线程一次归一化
+    """
+    if stats is None:
+        stats = PipelineStats(workers)
+    pending: "queue.Queue" = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    fast = isinstance(preprocess, fast_preprocess.BatchPreprocess)
+
+    def decode(fp: Path, fid: int):
+        t0 = time.perf_counter()
+        if fast:
+            img = preprocess.open(fp)
+            tensor = preprocess(img)
+        else:
+            img = Image.open(fp)
+            tensor = preprocess(img.convert("RGB"))
+        if on_decode is not None:
+            on_decode(fid, img)
+        stats.add_decode(t0, time.perf_counter())
+        return tensor
+
+    def producer(pool: ThreadPoolExecutor):
+        for i in range(0, len(items), batch_size):
+            batch = items[i:i+batch_size]
+            futures = [pool.submit(decode, fp, fid) for fp, fid in batch]
+            # 队列满时阻塞，限制在途批次数（即内存占用）
+            while not stop.is_set():
+                try:
+                    pending.put((batch, futures), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+        pending.put(None)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="decode")
+    feeder = threading.Thread(target=producer, args=(pool,), daemon=True)
+    feeder.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            batch, futures = item
+            t0 = time.perf_counter()
+            images = [f.result() for f in futures]
+            stats.wait_time += time.perf_counter() - t0
+            yield batch, preprocess.collate(images) if fast else torch.stack(images)
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _update_thumbs(db_dir: Path, wanted: Sequence[str], spill: ThumbSpill, sticker_dir: Path,
+                   refresh: Optional[set] = None):
+    """
+    新编码的文件用解码时生成的缩略图（已追加在 spill 里），未变化的从旧包复用，
+    旧库没有的和 refresh 里（内容变了但没重新编码）的补生成后也追加到 spill；最后按名称归并写出新包
+    """
+    path = db_dir / THUMBS_NAME
+    old = open_pack(path)
+    names: List[str] = []
+    sizes: List[int] = []
+    fresh = generated = 0
+    for name in sorted(wanted, key=lambda n: n.encode("utf-8")):
+        if name in spill:
+            fresh += 1
+        else:
+            i = old.find(name) if old is not None and name not in (refresh or ()) else -1
+            if i >= 0:
+                names.append(name)
+                sizes.append(old.data_size(i))
+                continue
+            try:
+                with Image.open(sticker_dir / name) as img:
+                    spill.append(name, make_thumbnail(img))
+            except OSError:
+                continue
+            generated += 1
+        names.append(name)
+        sizes.append(spill.data_size(name))
+    if old is not None and not fresh and not generated and len(names) == old.count:
+        old.close()
+        return
+
+    def read(name: str) -> bytes:
+        return spill.read(name) if name in spill else old.get_bytes(name)
+
+    write_thumbs(path, names, sizes, read, release=old.close if old is not None else None)
+    print(f"[build_index] Thumbnails: {fresh + generated} generated, {len(names) - fresh - generated} reused")
+
+def build_index_gui(sticker_dir: Path, db_name: str, device=None, incremental: bool = True,
+                    workers: int = DECODE_WORKERS, prefetch: int = PREFETCH_BATCHES,
+                    index_type: str = "auto", index_params: Optional[dict] = None,
+                    backend: str = "eager", int8: bool = False, ingest: str = "link",
+                    collapse: Optional[float] = None):
     """
     建库函数，可选择 device: "cuda" 或 "cpu"
+    incremental=True 时根据清单只编码新增/修改的文件，删除的文件按 ID 从索引中移除；
+    上次建库中途中断时从 stickers.checkpoint.jsonl 续上，已编码的文件不再重复编码
+    workers/prefetch 控制解码线程数和预取批次数
+    index_type: "auto" / "flat" / "ivf_flat" / "ivf_pq" / "hnsw"，index_params 覆盖默认参数
+    backend/int8: 图像编码器后端（eager / torchscript / onnx）和是否 int8 量化，见 encoders.py
+    ingest: "link" / "copy" / "inplace"，见 INGEST_MODES；内容相同的文件只编码一次，共用一个向量 ID
+    collapse: 近似重复合并的余弦相似度阈值（如 0.95），索引里每组只放一个代表，成员见 stickers.groups.json；
+              None 沿用上次建库的设置，0 关闭。合并是全局的，开启时索引总是从 stickers.emb 重建（不重新编码）
+
+    文件按 SCAN_CHUNK 分轮扫描、编码，特征直接写进 stickers.emb，不在内存里攒；
+    最后从 stickers.emb 分块建索引，内存占用不随库大小增长（清单和索引本身除外）
     """
+    if index_type != "auto" and index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if ingest not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode: {ingest}")
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
     model_name = "ViT-L/14" if device=="cuda" else "ViT-B/32"
 
-    print(f"[build_index] Using device: {device}, model: {model_name}")
+    print(f"[build_index] Using device: {device}, model: {model_name} ({backend_label(backend, int8)})")
 
     start = time.time()
-    if getattr(sys, "frozen", False):
-        project_root = Path(sys.executable).resolve().parent
-    else:
-        project_root = Path(__file__).resolve().parent
+    project_root = get_project_root()
     db_dir = project_root / "databases" / db_name
-    db_sticker_dir = db_dir / "stickers"
-    os.makedirs(db_sticker_dir, exist_ok=True)
+    if ingest == "inplace":
+        db_sticker_dir = sticker_dir.resolve()
+        os.makedirs(db_dir, exist_ok=True)
+    else:
+        db_sticker_dir = db_dir / "stickers"
+        os.makedirs(db_sticker_dir, exist_ok=True)
+        ingest_stickers(sticker_dir, db_sticker_dir, ingest)
 
-    for item in sticker_dir.iterdir():
-        if item.is_file() and item.suffix.lower() in {".png",".jpg",".jpeg"}:
-            shutil.copy2(item, db_sticker_dir)
+    emb_path = db_dir / "stickers.emb"
+    checkpoint_path = db_dir / CHECKPOINT_NAME
 
-    index_path = db_dir / "stickers.faiss"
-    names_path = db_dir / "stickers.json"
+    manifest = load_manifest(db_dir) if incremental else None
+    meta = load_meta(db_dir) if incremental else None
+    if collapse is None:
+        collapse = (meta or {}).get("collapse") or 0
+    expected = meta["count"] if meta and meta.get("collapse") else None
+    index = _load_existing_index(db_dir, manifest, model_name, expected)
+    retype = _index_change(meta, index_type, index_params) if index is not None and meta is not None else None
+    if index is not None and (meta is None or retype is not None
+                              and not _embeddings_complete(emb_path, model_name, index.d, manifest["next_id"])):
+        # 没有元数据，或者换索引类型/参数时特征文件不全：全量重新编码
+        index = retype = None
+    if retype is not None:
+        # 换了索引类型或参数：特征都在 stickers.emb 里，照常增量编码，最后从特征文件重建索引
+        print(f"[build_index] Index changed to {retype[0]} {retype[1]}, rebuilding it from stored embeddings")
 
-    torch.set_grad_enabled(False)
-    
-    model_dir = project_root / "models"
-    os.makedirs(model_dir, exist_ok=True)
-    model, preprocess = clip.load(model_name, device=device, download_root=str(model_dir))
-    model.eval()
+    resumed = _load_checkpoint(db_dir, model_name) if incremental else None
+    if resumed is not None:
+        if resumed["fresh"]:
+            # 中断的是一次全量重建，继续全量重建
+            index = None
+        elif index is None:
+            # 中断之后旧索引变了，进度作废
+            resumed = None
+    if resumed is not None:
+        print(f"[build_index] Resuming interrupted build: {len(resumed['files'])} files already encoded")
+    if index is None:
+        manifest = _new_manifest(model_name)
+        meta = None
+    committed = manifest["files"]
+    resumed_files = resumed["files"] if resumed is not None else {}
+    next_id = max(manifest["next_id"], resumed["next_id"] if resumed is not None else 0)
+    # 本次建库（含中断前）写入 stickers.emb、需要加入索引的向量 ID
+    encoded_ids = {entry["id"] for entry in resumed_files.values()}
+    # 内容 sha1 -> 已有向量的 ID：重复文件、改名和改回旧内容都不用重新编码
+    by_digest = {entry["sha1"]: entry["id"] for entry in committed.values()}
+    by_digest.update((entry["sha1"], entry["id"]) for entry in resumed_files.values())
 
-    files = list_images(db_sticker_dir)
-    if not files:
-        raise RuntimeError(f"No images found in {db_sticker_dir}.")
+    # 原始特征写入 stickers.emb，之后换索引类型不需要重新编码，建索引也从这里分块读
+    store = None
+    if index is not None:
+        store = _open_embedding_store(emb_path, model_name, index, next_id)
+    elif resumed is not None:
+        store = EmbeddingStore(emb_path, model_name, read_header(emb_path)["dim"], next_id)
+    spill = ThumbSpill(db_dir / THUMBS_SPILL_NAME, reset=resumed is None)
+    checkpoint_header = None if resumed is not None else {"model_name": model_name, "fresh": index is None}
 
-    names = [str(f.relative_to(db_sticker_dir)) for f in files]
+    encoder = None
+    stats = PipelineStats(workers)
+    progress = None
+    entries: Dict[str, dict] = {}
+    added = changed = unchanged = shared = 0
+    # 内容变了、但直接复用了已有向量的文件，旧缩略图不能再用
+    retouched = set()
+    files = iter_images(db_sticker_dir)
+    while True:
+        chunk = list(islice(files, SCAN_CHUNK))
+        if not chunk:
+            break
+        # 对比清单：大小和 mtime 都没变的直接跳过，否则算 sha1 判断内容是否真的变了
+        chunk_entries: Dict[str, dict] = {}
+        to_encode = []
+        encode_names: Dict[int, str] = {}
+        for fp in chunk:
+            name = str(fp.relative_to(db_sticker_dir))
+            st = fp.stat()
+            old = resumed_files.get(name) or committed.get(name)
+            if old and old["size"] == st.st_size and old["mtime"] == st.st_mtime_ns:
+                entries[name] = old
+                unchanged += 1
+                continue
+            digest = file_digest(fp)
+            if old and old["sha1"] == digest:
+                entries[name] = {**old, "mtime": st.st_mtime_ns, "size": st.st_size}
+                unchanged += 1
+                continue
+            if name in committed:
+                changed += 1
+            else:
+                added += 1
+            # 旧 ID 可能还被内容相同的其它文件引用，新内容总是用新 ID，旧 ID 没人引用时再删除
+            fid = by_digest.get(digest)
+            if fid is None:
+                fid = by_digest[digest] = next_id
+                next_id += 1
+                to_encode.append((fp, fid))
+                encode_names[fid] = name
+            else:
+                shared += 1
+                if name in committed:
+                    retouched.add(name)
+            chunk_entries[name] = {"id": fid, "sha1": digest, "mtime": st.st_mtime_ns, "size": st.st_size}
+        entries.update(chunk_entries)
+        if not to_encode:
+            continue
 
-    features_list = []
+        if encoder is None:
+            # 没有需要编码的文件时不加载模型
+            torch.set_grad_enabled(False)
+            encoder = load_encoder(model_name, device, backend, int8, project_root / "models")
+            # 大批量编码的线程数 / bf16 / channels_last，第一次在这台机器上用时跑微基准选出
+            settings = inference.tune(encoder, model_name, "build", project_root / "models")
+            inference.apply(encoder, settings)
+            print(f"Encoding on {device} using {model_name}...")
+            progress = tqdm(desc="Processing batches", unit="batch")
+        chunk_thumbs: Dict[int, bytes] = {}
 
-    print(f"Building index for {len(files)} images on {device} using {model_name}...")
-    for i in tqdm(range(0, len(files), BATCH_SIZE), desc="Processing batches"):
-        batch_files = files[i:i+BATCH_SIZE]
-        images = [preprocess(Image.open(fp).convert("RGB")) for fp in batch_files]
-        image_tensor = torch.stack(images).to(device)
-        with torch.no_grad():
-            feats = model.encode_image(image_tensor)
-        feats = feats / feats.norm(dim=1, keepdim=True)
-        features_list.append(feats.cpu())
+        def keep_thumbnail(fid: int, img: Image.Image):
+            # 解码线程里顺便生成缩略图，原图不用再读一遍
+            chunk_thumbs[fid] = make_thumbnail(img)
 
-    features = torch.cat(features_list, dim=0).numpy().astype("float32")
-    dim = features.shape[1]
+        preprocess = fast_preprocess.for_encoder(encoder) or encoder.preprocess
+        batches = iter_preprocessed_batches(to_encode, preprocess, BATCH_SIZE, workers, prefetch, stats,
+                                            on_decode=keep_thumbnail)
+        with inference.workload(encoder.inference_settings):
+            for batch, image_tensor in batches:
+                t0 = time.perf_counter()
+                feats = encoder.encode_image(image_tensor)
+                feats = feats / feats.norm(dim=1, keepdim=True)
+                feats = feats.cpu().numpy().astype("float32")
+                stats.add_encode(len(batch), time.perf_counter() - t0)
+                progress.update(1)
+                progress.set_postfix(decode=f"{stats.decode_rate():.0f}/s", encode=f"{stats.encode_rate():.0f}/s")
+                if store is None:
+                    store = EmbeddingStore(emb_path, model_name, feats.shape[1], next_id, reset=True)
+                store.resize(next_id)
+                store.write(np.array([fid for _, fid in batch], dtype=np.int64), feats)
 
-    index = faiss.IndexFlatL2(dim)
-    index.add(features)
+        # 检查点：特征和缩略图先落盘，再记进度，中断后最多重做最后一轮
+        for fid, name in encode_names.items():
+            if fid in chunk_thumbs:
+                spill.append(name, chunk_thumbs[fid])
+            encoded_ids.add(fid)
+        store.flush()
+        spill.sync()
+        _append_checkpoint(checkpoint_path, checkpoint_header, chunk_entries, next_id)
+        checkpoint_header = None
+    if progress is not None:
+        progress.close()
+        print(f"[build_index] Pipeline: {stats.report()}")
 
-    # 序列化保存
-    with open(index_path, "wb") as f:
-        f.write(faiss.serialize_index(index))
-    with open(names_path, "w", encoding="utf-8") as f:
-        json.dump(names, f, ensure_ascii=False, indent=2)
+    if not entries:
+        spill.close()
+        raise RuntimeError(f"No images found in {db_sticker_dir}.")
+    removed = sum(1 for name in committed if name not in entries)
+    print(f"[build_index] {added} added, {changed} changed, {removed} removed, {unchanged} unchanged, "
+          f"{shared} reused existing embeddings")
 
-    print(f"Indexed {len(files)} stickers @ dim={dim}")
+    live = {entry["id"] for entry in entries.values()}
+    live_ids = np.array(sorted(live), dtype=np.int64)
+    old_ids = {entry["id"] for entry in committed.values()}
+    store.resize(next_id)
+    store.clear(sorted((old_ids | encoded_ids) - live))
+    store.close()
+    _, matrix = open_embeddings(emb_path)
+
+    rep_of: Dict[int, int] = {}
+    index_ids = live_ids
+    if retype is not None or collapse or (meta or {}).get("collapse"):
+        # 换了索引类型/参数，或者近似重复的代表可能随新增/删除变化：不做增量，从特征文件重建索引
+        index = None
+    if collapse:
+        t0 = time.time()
+        rep_of = collapse_near_duplicates(matrix, live_ids, collapse)
+        index_ids = np.array([fid for fid in live_ids.tolist() if fid not in rep_of], dtype=np.int64)
+        print(f"[build_index] Collapsed {len(rep_of)} near-duplicates, {len(index_ids)} representatives "
+              f"(threshold {collapse}) in {time.time()-t0:.2f}s")
+
+    if index is not None:
+        # 不再被任何文件引用的 ID 从索引移除，再加入本次编码的向量
+        drop = sorted(old_ids - live)
+        if drop:
+            if _supports_remove(index):
+                index.remove_ids(np.array(drop, dtype=np.int64))
+            else:
+                # HNSW 不支持 remove_ids：用特征文件重新建图
+                index = None
+        if index is not None:
+            _add_from_store(index, matrix, np.array(sorted(encoded_ids & live), dtype=np.int64))
+    if index is None:
+        if meta is None:
+            built_type = choose_index_type(len(index_ids)) if index_type == "auto" else index_type
+            params = index_params
+        elif retype is not None:
+            built_type, params = retype
+        else:
+            built_type, params = meta["index_type"], meta["params"]
+        index, built_type, params = _index_from_store(matrix, index_ids, built_type, params)
+        meta = {**(meta or {}), "model_name": model_name, "index_type": built_type, "params": params}
+    if encoded_ids or removed or rep_of or retype is not None or not meta.get("recall"):
+        meta["recall"] = _report_recall(index, matrix, index_ids, meta["index_type"], meta["params"])
+    del matrix
+
+    dim = index.d
+    meta.update({"dim": dim, "count": int(index.ntotal), "ingest": ingest})
+    if collapse:
+        meta["collapse"] = collapse
+    else:
+        meta.pop("collapse", None)
+    if ingest == "inplace":
+        meta["sticker_dir"] = str(db_sticker_dir)
+    else:
+        meta.pop("sticker_dir", None)
+    if encoded_ids:
+        meta["backend"] = backend_label(backend, int8)
+    manifest["files"] = entries
+    manifest["next_id"] = next_id
+    names = _names_by_id(entries, next_id)
+
+    # 索引、名称表和元数据写进单文件的 stickers.db（原子替换），旧布局的文件随之删除
+    stickers_db.write_database(db_dir, index, names, meta)
+    stickers_db.remove_legacy(db_dir)
+    write_groups(db_dir, _group_members(entries, names, rep_of), collapse or None)
+    # 只有出现在结果里的名字（每个 ID 一个）需要缩略图
+    _update_thumbs(db_dir, [name for name in names if name], spill, db_sticker_dir, retouched)
+    save_manifest(db_dir, manifest)
+    save_meta(db_dir, meta)
+    # 清单已经写好，进度和缩略图临时文件不再需要
+    spill.close(remove=True)
+    if checkpoint_path.exists():
+        os.remove(checkpoint_path)
+
+    print(f"Indexed {index.ntotal} stickers @ dim={dim} ({meta['index_type']})")
     print(f"Database saved to {db_dir}")
     print(f"Build time: {time.time()-start:.2f}s")
     return db_dir
+
+def _index_change(meta: dict, index_type: str, index_params: Optional[dict]) -> Optional[Tuple[str, dict]]:
+    """
+    这次要求的 (索引类型, 参数) 与上次建库不同时返回它，相同时返回 None。
+    换类型时参数取新类型的默认值再用 index_params 覆盖；只改参数时沿用上次的类型和其余参数
+    """
+    if index_type not in ("auto", meta["index_type"]):
+        return index_type, dict(index_params or {})
+    if index_params and {**meta["params"], **index_params} != meta["params"]:
+        return meta["index_type"], {**meta["params"], **index_params}
+    return None
+
+def reindex_from_embeddings(db_dir: Path, index_type: str = "auto", index_params: Optional[dict] = None,
+                            collapse: Optional[float] = None):
+    """
+    用 stickers.emb 里保存的特征重新建索引（换索引类型/参数/近似重复阈值），不加载 CLIP 模型；
+    collapse 的含义同 build_index_gui
+    """
+    if index_type != "auto" and index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    start = time.time()
+    manifest = load_manifest(db_dir)
+    header, matrix = open_embeddings(db_dir / "stickers.emb")
+    if manifest is None or header["model_name"] != manifest["model_name"]:
+        raise RuntimeError(f"Embeddings in {db_dir} do not match the manifest, run a full build first.")
+
+    meta = load_meta(db_dir) or {}
+    if collapse is None:
+        collapse = meta.get("collapse") or 0
+    ids = np.array(sorted({entry["id"] for entry in manifest["files"].values()}), dtype=np.int64)
+    rep_of = collapse_near_duplicates(matrix, ids, collapse) if collapse else {}
+    if rep_of:
+        ids = np.array([fid for fid in ids.tolist() if fid not in rep_of], dtype=np.int64)
+    built_type = choose_index_type(len(ids)) if index_type == "auto" else index_type
+    index, built_type, params = _index_from_store(matrix, ids, built_type, index_params)
+    recall = _report_recall(index, matrix, ids, built_type, params)
+
+    names = _names_by_id(manifest["files"], manifest["next_id"])
+    # 保留 ingest/sticker_dir/backend 等建库时记录的信息
+    meta.update({"model_name": header["model_name"], "index_type": built_type, "params": params,
+                 "dim": index.d, "count": int(index.ntotal), "recall": recall})
+    if collapse:
+        meta["collapse"] = collapse
+    else:
+        meta.pop("collapse", None)
+    stickers_db.write_database(db_dir, index, names, meta)
+    stickers_db.remove_legacy(db_dir)
+    write_groups(db_dir, _group_members(manifest["files"], names, rep_of), collapse or None)
+    save_meta(db_dir, meta)
+    print(f"[build_index] Reindexed {index.ntotal} vectors as {built_type} in {time.time()-start:.2f}s")
+    return db_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="建库，或用已保存的特征重建索引")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="从贴纸文件夹建库（默认增量）")
+    p_build.add_argument("sticker_dir")
+    p_build.add_argument("db_name")
+    p_build.add_argument("--device", choices=["cuda", "cpu"])
+    p_build.add_argument("--index-type", default="auto", choices=("auto",) + INDEX_TYPES)
+    p_build.add_argument("--full", action="store_true", help="忽略清单全量重建")
+    p_build.add_argument("--workers", type=int, default=DECODE_WORKERS)
+    p_build.add_argument("--prefetch", type=int, default=PREFETCH_BATCHES)
+    p_build.add_argument("--backend", default="eager", choices=BACKENDS, help="图像编码器后端")
+    p_build.add_argument("--int8", action="store_true", help="动态 int8 量化（torchscript/onnx）")
+    p_build.add_argument("--ingest", default="link", choices=INGEST_MODES,
+                         help="link: 硬链接进库；copy: 复制进库；inplace: 直接引用源文件夹")
+    p_build.add_argument("--collapse", type=float, default=None,
+                         help="近似重复合并的余弦相似度阈值（如 0.95），0 关闭，默认沿用上次设置")
+
+    p_reindex = sub.add_parser("reindex", help="不加载模型，用 stickers.emb 重建索引")
+    p_reindex.add_argument("db_name")
+    p_reindex.add_argument("--index-type", default="auto", choices=("auto",) + INDEX_TYPES)
+    p_reindex.add_argument("--params", type=json.loads, default=None,
+                           help='覆盖索引参数，JSON 格式，例如 \'{"nlist": 1024}\'')
+    p_reindex.add_argument("--collapse", type=float, default=None,
+                           help="近似重复合并的余弦相似度阈值，0 关闭，默认沿用上次设置")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index_gui(Path(args.sticker_dir), args.db_name, device=args.device, incremental=not args.full,
+                        workers=args.workers, prefetch=args.prefetch, index_type=args.index_type,
+                        backend=args.backend, int8=args.int8, ingest=args.ingest, collapse=args.collapse)
+    else:
+        reindex_from_embeddings(get_project_root() / "databases" / args.db_name, args.index_type, args.params,
+                                args.collapse)
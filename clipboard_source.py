@@ -0,0 +1,212 @@
+"""
+剪贴板来源抽象：平台有剪贴板序列号时先比较序列号，没变就不去取图；
+没有序列号的平台取图后用像素指纹判断是否变化。
+另外提供内存队列/文件两种假来源，方便在无界面的 Linux 上测检测延迟和空闲 CPU。
+"""
+import os
+import sys
+import time
+import ctypes
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from PIL import Image, ImageGrab
+
+import timing
+from fingerprint import image_fingerprint
+
+
+class ClipboardSource:
+    """剪贴板来源基类。change_token() 必须很便宜，返回 None 表示平台不支持变化检测"""
+    def change_token(self):
+        return None
+
+    def grab(self) -> Optional[Image.Image]:
+        raise NotImplementedError
+
+
+class PillowClipboardSource(ClipboardSource):
+    """通用来源：每次都通过 ImageGrab 取图，靠指纹判断变化"""
+    def grab(self) -> Optional[Image.Image]:
+        img = ImageGrab.grabclipboard()
+        return img if isinstance(img, Image.Image) else None
+
+
+class WindowsClipboardSource(PillowClipboardSource):
+    """Windows：GetClipboardSequenceNumber 在剪贴板内容变化时递增"""
+    def __init__(self):
+        user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self._seq = user32.GetClipboardSequenceNumber
+        self._seq.restype = ctypes.c_uint32
+
+    def change_token(self):
+        return self._seq()
+
+
+class MacClipboardSource(PillowClipboardSource):
+    """macOS：NSPasteboard.changeCount，需要 pyobjc"""
+    def __init__(self):
+        from AppKit import NSPasteboard
+        self._pasteboard = NSPasteboard.generalPasteboard()
+
+    def change_token(self):
+        return self._pasteboard.changeCount()
+
+
+class QueueClipboardSource(ClipboardSource):
+    """内存假来源：put() 模拟一次复制，记录时间用于计算检测延迟"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._img: Optional[Image.Image] = None
+        self.put_time = 0.0
+
+    def put(self, img: Image.Image):
+        with self._lock:
+            self._seq += 1
+            self._img = img
+            self.put_time = time.perf_counter()
+
+    def change_token(self):
+        return self._seq
+
+    def grab(self) -> Optional[Image.Image]:
+        with self._lock:
+            return self._img
+
+
+class FileClipboardSource(ClipboardSource):
+    """文件假来源：监视一个图片文件，mtime/大小变化视为一次复制"""
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def change_token(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        return (st.st_mtime_ns, st.st_size)
+
+    def grab(self) -> Optional[Image.Image]:
+        if not self.path.exists():
+            return None
+        img = Image.open(self.path)
+        img.load()
+        return img
+
+
+def default_source() -> ClipboardSource:
+    """按平台选择带序列号的来源，不可用时退回 Pillow 轮询"""
+    try:
+        if sys.platform == "win32":
+            return WindowsClipboardSource()
+        if sys.platform == "darwin":
+            return MacClipboardSource()
+    except (OSError, ImportError, AttributeError):
+        pass
+    return PillowClipboardSource()
+
+
+class AdaptivePoller:
+    """自适应轮询：有新图片后用最短间隔，之后每次空闲按 backoff 倍数退避到 max_interval"""
+    def __init__(self, min_interval: float = 0.1, max_interval: float = 1.0, backoff: float = 1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+
+    def activity(self):
+        self.interval = self.min_interval
+
+    def idle(self):
+        self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def wait(self, stop_event: threading.Event):
+        stop_event.wait(self.interval)
+
+
+def watch_clipboard(source: ClipboardSource, on_image: Callable[[Image.Image, str], None],
+                    stop_event: threading.Event, pause_event: Optional[threading.Event] = None,
+                    poller: Optional[AdaptivePoller] = None):
+    """监听循环：序列号没变就跳过取图；取到的图片指纹变了才回调 on_image(img, 指纹)"""
+    poller = poller or AdaptivePoller()
+    last_token = None
+    last_fp = None
+    while not stop_event.is_set():
+        if pause_event is not None and pause_event.is_set():
+            stop_event.wait(0.2)
+            continue
+        changed = False
+        try:
+            token = source.change_token()
+            if token is None or token != last_token:
+                last_token = token
+                t0 = time.perf_counter()
+                img = source.grab()
+                if img is not None:
+                    t1 = time.perf_counter()
+                    fp = image_fingerprint(img)
+                    if fp != last_fp:
+                        last_fp = fp
+                        changed = True
+                        # 只记录真正触发识别的那次取图，空闲轮询不计入
+                        if timing.ENABLED:
+                            timing.record("grab", t1 - t0)
+                            timing.record("fingerprint", time.perf_counter() - t1)
+                        on_image(img, fp)
+        except Exception:
+            pass
+        if changed:
+            poller.activity()
+        else:
+            poller.idle()
+        poller.wait(stop_event)
+
+
+def measure(events: int = 20, gap: float = 2.0, min_interval: float = 0.1, max_interval: float = 1.0) -> dict:
+    """用假来源测检测延迟（复制到回调的时间）和空闲时的 CPU 占用"""
+    source = QueueClipboardSource()
+    stop = threading.Event()
+    latencies = []
+    detected = threading.Event()
+
+    def on_image(img, fp):
+        latencies.append(time.perf_counter() - source.put_time)
+        detected.set()
+
+    poller = AdaptivePoller(min_interval, max_interval)
+    t = threading.Thread(target=watch_clipboard, args=(source, on_image, stop, None, poller), daemon=True)
+    t.start()
+    idle_cpu = 0.0
+    idle_wall = 0.0
+    for i in range(events):
+        cpu0, wall0 = time.process_time(), time.perf_counter()
+        time.sleep(gap)
+        idle_cpu += time.process_time() - cpu0
+        idle_wall += time.perf_counter() - wall0
+        detected.clear()
+        source.put(Image.new("RGB", (64, 64), (i * 37 % 256, i * 91 % 256, i * 13 % 256)))
+        detected.wait(max_interval * 2 + 1)
+    stop.set()
+    t.join()
+    latencies.sort()
+    n = len(latencies)
+    return {
+        "events": events,
+        "detected": n,
+        "latency_p50_ms": latencies[n // 2] * 1000 if n else None,
+        "latency_max_ms": latencies[-1] * 1000 if n else None,
+        "idle_cpu_percent": idle_cpu / idle_wall * 100 if idle_wall else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="测量剪贴板检测延迟和空闲 CPU（使用内存假来源）")
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--gap", type=float, default=2.0, help="两次复制之间的空闲秒数")
+    parser.add_argument("--min-interval", type=float, default=0.1)
+    parser.add_argument("--max-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    print(measure(args.events, args.gap, args.min_interval, args.max_interval))
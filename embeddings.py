@@ -0,0 +1,98 @@
+"""
+归一化特征矩阵 stickers.emb：换索引类型/参数时不用重新跑 CLIP。
+
+    256 字节文件头：魔数 b"STKEMB01" | uint32 JSON 长度 | JSON {"model_name", "dim", "dtype", "count"}
+    之后是 count x dim 的 float16 行，第 i 行就是向量 ID 为 i 的特征，已删除的 ID 为全零行
+
+文件头定长，增量建库时可以原地扩展文件并改写条数。
+"""
+import json
+import struct
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"STKEMB01"
+HEADER_SIZE = 256
+DTYPE = np.float16
+_PREFIX = struct.Struct("<8sI")
+
+
+def _pack_header(model_name: str, dim: int, count: int) -> bytes:
+    body = json.dumps({"model_name": model_name, "dim": dim, "dtype": "float16", "count": count}).encode("utf-8")
+    header = _PREFIX.pack(MAGIC, len(body)) + body
+    if len(header) > HEADER_SIZE:
+        raise ValueError("Embedding header too long")
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+def read_header(path: Path) -> Optional[dict]:
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+    except OSError:
+        return None
+    if len(raw) < HEADER_SIZE:
+        return None
+    magic, length = _PREFIX.unpack_from(raw)
+    if magic != MAGIC:
+        return None
+    return json.loads(raw[_PREFIX.size:_PREFIX.size + length].decode("utf-8"))
+
+
+def open_embeddings(path: Path) -> Tuple[dict, np.memmap]:
+    """只读映射，返回 (文件头, count x dim 的 float16 矩阵)"""
+    header = read_header(path)
+    if header is None:
+        raise ValueError(f"Not an embeddings file: {path}")
+    shape = (header["count"], header["dim"])
+    if header["count"] == 0:
+        return header, np.zeros(shape, dtype=DTYPE)
+    return header, np.memmap(path, dtype=DTYPE, mode="r", offset=HEADER_SIZE, shape=shape)
+
+
+class EmbeddingStore:
+    """建库时按向量 ID 写入特征；模型或维度不一致、或 reset=True 时重新创建文件"""
+    def __init__(self, path: Path, model_name: str, dim: int, count: int, reset: bool = False):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.dim = dim
+        header = None if reset else read_header(self.path)
+        if header is None or header["model_name"] != model_name or header["dim"] != dim:
+            with open(self.path, "wb") as f:
+                f.write(_pack_header(model_name, dim, 0))
+            header = {"count": 0}
+        self.count = header["count"]
+        self._matrix = None
+        self.resize(count)
+
+    def resize(self, count: int):
+        """扩展到 count 行（新行为零），只增不减"""
+        if count > self.count or self._matrix is None:
+            self.count = max(count, self.count)
+            with open(self.path, "r+b") as f:
+                f.truncate(HEADER_SIZE + self.count * self.dim * np.dtype(DTYPE).itemsize)
+                f.write(_pack_header(self.model_name, self.dim, self.count))
+            self._matrix = None
+            if self.count:
+                self._matrix = np.memmap(self.path, dtype=DTYPE, mode="r+", offset=HEADER_SIZE,
+                                         shape=(self.count, self.dim))
+
+    def write(self, ids: np.ndarray, feats: np.ndarray):
+        if len(ids):
+            self._matrix[ids] = feats.astype(DTYPE)
+
+    def clear(self, ids):
+        if len(ids):
+            self._matrix[np.asarray(ids, dtype=np.int64)] = 0
+
+    def flush(self):
+        """把已写入的行刷到磁盘（建库写检查点前调用）"""
+        if self._matrix is not None:
+            self._matrix.flush()
+
+    def close(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
@@ -0,0 +1,334 @@
+"""
+CLIP 图像编码器的推理后端，建库和搜索共用：
+
+    eager        原始 PyTorch 模型（clip.load）
+    torchscript  导出的 TorchScript 模块，models/<模型>.visual[-int8].torchscript.pt
+    onnx         导出的 ONNX 模型，用 onnxruntime 推理，models/<模型>.visual[-int8].onnx
+                 （需要 pip install onnxruntime）
+
+int8=True 时做动态 int8 量化：Linear 权重离线量化，激活在运行时量化，只在 CPU 上运行。
+导出结果和旁边的 .json（输入分辨率、输出维度）缓存在 models/ 下，之后加载不需要原始模型。
+
+    python encoders.py export ViT-B/32 --backend onnx --int8
+    python encoders.py check 我的贴纸库 --backend onnx --int8 --samples 200
+"""
+import os
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+import torch
+import faiss
+from PIL import Image
+from torchvision import transforms as T
+
+import stickers_db
+from fast_preprocess import BatchPreprocess
+from paths import IMAGE_EXTS, get_project_root, sticker_dir
+
+BACKENDS = ("eager", "torchscript", "onnx")
+ONNX_OPSET = 17
+
+
+def backend_label(backend: str, int8: bool = False) -> str:
+    return f"{backend}-int8" if int8 else backend
+
+
+def make_preprocess(n_px: int):
+    """与 clip.load 返回的 preprocess 相同，导出的后端加载时不需要原始模型"""
+    return T.Compose([
+        T.Resize(n_px, interpolation=T.InterpolationMode.BICUBIC),
+        T.CenterCrop(n_px),
+        lambda image: image.convert("RGB"),
+        T.ToTensor(),
+        T.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
+    ])
+
+
+class _ImageEncoder(torch.nn.Module):
+    """只包含 model.visual，导出文件里不带文本编码器的权重"""
+    def __init__(self, visual: torch.nn.Module):
+        super().__init__()
+        self.visual = visual
+
+    def forward(self, image):
+        return self.visual(image)
+
+
+class EagerEncoder:
+    def __init__(self, model_name: str, device: str, model_dir: Path):
+        import clip
+        self.device = device
+        self.model, self.preprocess = clip.load(model_name, device=device, download_root=str(model_dir))
+        self.model.eval()
+        self.input_resolution = self.model.visual.input_resolution
+        self.batch_preprocess = BatchPreprocess(self.input_resolution)
+        self.nbytes = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        # CPU 上的推理选项，由 inference.apply 设置
+        self.bf16 = False
+        self.channels_last = False
+
+    def set_options(self, bf16: bool = False, channels_last: bool = False):
+        """bf16: CPU 上用 bfloat16 autocast；channels_last: 卷积（patch embedding）用 NHWC 布局"""
+        if self.device != "cpu":
+            return
+        self.bf16 = bf16
+        if channels_last != self.channels_last:
+            self.model.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+            self.channels_last = channels_last
+
+    def encode_image(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.to(self.device)
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.bf16):
+            return self.model.encode_image(x).float()
+
+
+class TorchScriptEncoder:
+    def __init__(self, path: Path, info: dict):
+        self.device = "cpu"
+        self.module = torch.jit.load(str(path), map_location="cpu")
+        self.module.eval()
+        self.input_resolution = info["input_resolution"]
+        self.preprocess = make_preprocess(info["input_resolution"])
+        self.batch_preprocess = BatchPreprocess(info["input_resolution"])
+        self.nbytes = path.stat().st_size
+
+    def encode_image(self, x: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.module(x.float().cpu())
+
+
+class OnnxEncoder:
+    # onnxruntime 用自己的线程池，torch.set_num_threads 对它无效
+    torch_threads = False
+
+    def __init__(self, path: Path, info: dict):
+        self.path = path
+        self.device = "cpu"
+        self.threads = 0  # 0 表示由 onnxruntime 自己决定
+        self.session = self._new_session()
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_resolution = info["input_resolution"]
+        self.preprocess = make_preprocess(info["input_resolution"])
+        self.batch_preprocess = BatchPreprocess(info["input_resolution"])
+        self.nbytes = path.stat().st_size
+
+    def _new_session(self):
+        ort = _import_onnxruntime()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.threads
+        return ort.InferenceSession(str(self.path), options, providers=["CPUExecutionProvider"])
+
+    def set_threads(self, threads: int):
+        """intra-op 线程数只能在创建会话时设置，变了就重建会话"""
+        if threads != self.threads:
+            self.threads = threads
+            self.session = self._new_session()
+
+    def encode_image(self, x: torch.Tensor) -> torch.Tensor:
+        feats = self.session.run(None, {self.input_name: x.float().cpu().numpy()})[0]
+        return torch.from_numpy(feats)
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError("The onnx backend requires onnxruntime: pip install onnxruntime")
+    return onnxruntime
+
+
+def export_path(model_name: str, backend: str, int8: bool, model_dir: Path) -> Path:
+    stem = model_name.replace("/", "-") + ".visual" + ("-int8" if int8 else "")
+    ext = ".onnx" if backend == "onnx" else ".torchscript.pt"
+    return Path(model_dir) / (stem + ext)
+
+
+def _read_info(path: Path, model_name: str) -> Optional[dict]:
+    info_path = path.with_suffix(path.suffix + ".json")
+    if not path.exists() or not info_path.exists():
+        return None
+    with open(info_path, "r", encoding="utf-8") as f:
+        info = json.load(f)
+    return info if info.get("model_name") == model_name else None
+
+
+def _write_info(path: Path, info: dict):
+    with open(path.with_suffix(path.suffix + ".json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+
+
+def export_encoder(model_name: str, backend: str, int8: bool = False, model_dir: Optional[Path] = None,
+                   force: bool = False) -> Path:
+    """
+    把 CLIP 图像编码器导出为 TorchScript / ONNX（可选 int8），已导出过则直接返回缓存路径。
+    导出固定在 CPU 上用 fp32 权重进行，batch 维是动态的
+    """
+    if backend not in ("torchscript", "onnx"):
+        raise ValueError(f"Cannot export backend: {backend}")
+    model_dir = Path(model_dir or get_project_root() / "models")
+    os.makedirs(model_dir, exist_ok=True)
+    path = export_path(model_name, backend, int8, model_dir)
+    if not force and _read_info(path, model_name) is not None:
+        return path
+    if backend == "onnx":
+        _import_onnxruntime()
+
+    import clip
+    start = time.time()
+    print(f"[encoders] Exporting {model_name} image encoder as {backend_label(backend, int8)}...")
+    model, _ = clip.load(model_name, device="cpu", download_root=str(model_dir))
+    encoder = _ImageEncoder(model.visual.float()).eval()
+    n_px = model.visual.input_resolution
+    example = torch.zeros(2, 3, n_px, n_px)
+    info = {"model_name": model_name, "backend": backend, "int8": int8, "input_resolution": n_px,
+            "output_dim": int(model.visual.output_dim), "torch": torch.__version__}
+
+    if backend == "torchscript":
+        if int8:
+            encoder = torch.ao.quantization.quantize_dynamic(encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            traced = torch.jit.trace(encoder, example)
+        traced.save(str(path))
+    else:
+        # int8 在 fp32 的 ONNX 上做量化，fp32 版本同时保留在缓存里
+        fp32_path = export_path(model_name, backend, False, model_dir)
+        if not (int8 and _read_info(fp32_path, model_name) is not None):
+            kwargs = dict(input_names=["image"], output_names=["features"], opset_version=ONNX_OPSET,
+                          dynamic_axes={"image": {0: "batch"}, "features": {0: "batch"}})
+            with torch.no_grad():
+                try:
+                    torch.onnx.export(encoder, example, str(fp32_path), dynamo=False, **kwargs)
+                except TypeError:
+                    # 老版本 torch 没有 dynamo 参数
+                    torch.onnx.export(encoder, example, str(fp32_path), **kwargs)
+            _write_info(fp32_path, {**info, "int8": False})
+        if int8:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(str(fp32_path), str(path), weight_type=QuantType.QInt8)
+
+    _write_info(path, info)
+    print(f"[encoders] Saved {path.name} ({path.stat().st_size / 2**20:.1f} MB) in {time.time() - start:.1f}s")
+    return path
+
+
+def load_encoder(model_name: str, device: str = "cpu", backend: str = "eager", int8: bool = False,
+                 model_dir: Optional[Path] = None):
+    """
+    返回带 encode_image(x) / preprocess / nbytes 的编码器。
+    x 是 CPU 上预处理好的 (n, 3, H, W) 张量，输出未归一化的 (n, dim) float32 特征
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    model_dir = Path(model_dir or get_project_root() / "models")
+    os.makedirs(model_dir, exist_ok=True)
+    if backend == "eager":
+        if int8:
+            raise ValueError("int8 quantization requires the torchscript or onnx backend")
+        return EagerEncoder(model_name, device, model_dir)
+    if device != "cpu":
+        print(f"[encoders] {backend_label(backend, int8)} runs on CPU, ignoring device {device}")
+    path = export_encoder(model_name, backend, int8, model_dir)
+    info = _read_info(path, model_name)
+    if backend == "torchscript":
+        return TorchScriptEncoder(path, info)
+    return OnnxEncoder(path, info)
+
+
+def _normalize(feats: torch.Tensor) -> np.ndarray:
+    feats = feats / feats.norm(dim=1, keepdim=True)
+    return feats.numpy().astype("float32")
+
+
+def compare_backends(model_name: str, image_paths: Sequence[Path], backend: str, int8: bool = False,
+                     index=None, topk: int = 5, batch_size: int = 32, model_dir: Optional[Path] = None) -> dict:
+    """
+    用同一批预处理结果分别跑 eager 和目标后端，报告特征的余弦漂移和 top-k 一致率。
+    index 为空时在这批样本自己的 eager 特征上建一个精确索引来比较检索结果
+    """
+    reference = load_encoder(model_name, "cpu", "eager", model_dir=model_dir)
+    candidate = load_encoder(model_name, "cpu", backend, int8, model_dir=model_dir)
+    ref_feats, cand_feats = [], []
+    ref_time = cand_time = 0.0
+    for i in range(0, len(image_paths), batch_size):
+        x = torch.stack([reference.preprocess(Image.open(p)) for p in image_paths[i:i + batch_size]])
+        t0 = time.perf_counter()
+        ref_feats.append(_normalize(reference.encode_image(x)))
+        t1 = time.perf_counter()
+        cand_feats.append(_normalize(candidate.encode_image(x)))
+        cand_time += time.perf_counter() - t1
+        ref_time += t1 - t0
+    ref = np.concatenate(ref_feats)
+    cand = np.concatenate(cand_feats)
+
+    cosine = (ref * cand).sum(axis=1)
+    if index is None:
+        index = faiss.IndexFlatL2(ref.shape[1])
+        index.add(ref)
+    k = min(topk, index.ntotal)
+    _, ref_ids = index.search(ref, k)
+    _, cand_ids = index.search(cand, k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_ids.tolist(), cand_ids.tolist())]
+    return {
+        "model_name": model_name,
+        "backend": backend_label(backend, int8),
+        "samples": len(ref),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "drift_max": float(1.0 - cosine.min()),
+        f"top{k}_agreement": float(np.mean(overlap)),
+        "top1_agreement": float(np.mean(ref_ids[:, 0] == cand_ids[:, 0])),
+        "eager_ms_per_image": ref_time / len(ref) * 1000,
+        "backend_ms_per_image": cand_time / len(ref) * 1000,
+    }
+
+
+def check_database(db_dir: Path, backend: str, int8: bool = False, samples: int = 100, topk: int = 5) -> dict:
+    """在一个已建好的库上抽样检查：检索用库里真实的索引"""
+    meta_path = db_dir / "stickers.meta.json"
+    meta = {}
+    if meta_path.exists():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    index = stickers_db.load_index(db_dir)
+    model_name = meta.get("model_name") or stickers_db.guess_model_name(index.d)
+    # 原地建库的贴纸在源文件夹里，子文件夹也算
+    folder = sticker_dir(db_dir)
+    files: List[Path] = sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMAGE_EXTS)
+    if not files:
+        raise RuntimeError(f"No images found in {folder}.")
+    random.Random(0).shuffle(files)
+    return compare_backends(model_name, files[:samples], backend, int8, index=index, topk=topk)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 CLIP 图像编码器，或检查导出后端与 eager 模型的一致性")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="导出到 models/")
+    p_export.add_argument("model_name", nargs="?", default="ViT-B/32")
+    p_export.add_argument("--backend", default="onnx", choices=BACKENDS[1:])
+    p_export.add_argument("--int8", action="store_true", help="动态 int8 量化")
+    p_export.add_argument("--force", action="store_true", help="忽略缓存重新导出")
+
+    p_check = sub.add_parser("check", help="抽样比较余弦漂移和 top-k 一致率")
+    p_check.add_argument("db_name")
+    p_check.add_argument("--backend", default="onnx", choices=BACKENDS[1:])
+    p_check.add_argument("--int8", action="store_true")
+    p_check.add_argument("--samples", type=int, default=100)
+    p_check.add_argument("--topk", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_encoder(args.model_name, args.backend, args.int8, force=args.force)
+    else:
+        report = check_database(get_project_root() / "databases" / args.db_name, args.backend, args.int8,
+                                args.samples, args.topk)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,148 @@
+"""
+CLIP 预处理的快速路径，结果与 clip.load / encoders.make_preprocess 的 preprocess 在容差内一致：
+
+    prep = BatchPreprocess(224)
+    img = prep.open(path)                   # JPEG 用 draft 直接按 1/2、1/4、1/8 解码
+    arr = prep(img)                         # 224x224x3 uint8：先 reduce 缩小，再 bicubic 缩放、中心裁剪
+    x = prep.collate([arr, ...])            # 整批一次转 float 并归一化，得到 (n, 3, 224, 224)
+
+原路径对每张图按原始分辨率完整解码、在原图上做 bicubic 缩放、逐张 ToTensor/Normalize。
+这里只保证解码后的短边不小于 DRAFT_FACTOR * n_px：JPEG 在 DCT 阶段就缩小（解码量降到 1/4~1/64），
+PNG 无法部分解码，但先用 reduce 做整数倍的盒式缩小，bicubic 只在小图上做；
+解码线程之间传的是 uint8 数组，预取队列的内存也只有 float 张量的 1/4。
+
+    python fast_preprocess.py check 我的贴纸库 --samples 200
+"""
+import os
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+from PIL import Image
+
+from paths import IMAGE_EXTS, get_project_root, sticker_dir
+
+MEAN = (0.48145466, 0.4578275, 0.40821073)
+STD = (0.26862954, 0.26130258, 0.27577711)
+# 缩小后短边至少保留 n_px 的这么多倍，最后一步 bicubic 仍然是从较大的图缩小，与原路径的差别很小
+DRAFT_FACTOR = 2
+# 与原 preprocess 结果（归一化后）的允许差异，check 用
+TOLERANCE_MEAN = 0.02
+TOLERANCE_COSINE = 0.999
+# STICKER_FAST_PREPROCESS=0 时建库和搜索都走原来的 preprocess
+ENABLED = os.environ.get("STICKER_FAST_PREPROCESS", "1") != "0"
+
+
+def resized_size(width: int, height: int, n_px: int):
+    """与 torchvision Resize(n_px) 相同：短边缩到 n_px，长边按比例取整"""
+    if width <= height:
+        return n_px, int(n_px * height / width)
+    return int(n_px * width / height), n_px
+
+
+class BatchPreprocess:
+    def __init__(self, n_px: int = 224):
+        self.n_px = n_px
+        self.min_side = DRAFT_FACTOR * n_px
+        self._scale = torch.tensor([1.0 / (255.0 * s) for s in STD]).view(1, 3, 1, 1)
+        self._shift = torch.tensor([m / s for m, s in zip(MEAN, STD)]).view(1, 3, 1, 1)
+
+    def open(self, src: Union[str, Path]) -> Image.Image:
+        """打开图片；JPEG 在解码前设置 draft，短边缩到不小于 min_side 的最小 1/2^k"""
+        img = Image.open(src)
+        if img.format == "JPEG" and min(img.size) >= 2 * self.min_side:
+            img.draft("RGB", (self.min_side, self.min_side))
+        return img
+
+    def __call__(self, img: Image.Image) -> np.ndarray:
+        """单张图 -> n_px x n_px x 3 的 uint8 数组（RGB），在解码线程里调用"""
+        img = img.convert("RGB")
+        factor = min(img.size) // self.min_side
+        if factor >= 2:
+            img = img.reduce(factor)
+        n = self.n_px
+        width, height = resized_size(img.width, img.height, n)
+        if (width, height) != img.size:
+            img = img.resize((width, height), Image.BICUBIC)
+        # 与 torchvision CenterCrop 相同的取整方式
+        left = int(round((width - n) / 2.0))
+        top = int(round((height - n) / 2.0))
+        if (left, top, width, height) != (0, 0, n, n):
+            img = img.crop((left, top, left + n, top + n))
+        return np.asarray(img)
+
+    def collate(self, arrays: Sequence[np.ndarray]) -> torch.Tensor:
+        """一批 uint8 数组一次性转成归一化的 (n, 3, n_px, n_px) float 张量"""
+        x = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).float()
+        return (x * self._scale - self._shift).contiguous()
+
+    def load(self, src: Union[str, Path]) -> np.ndarray:
+        with self.open(src) as img:
+            return self(img)
+
+
+def for_encoder(encoder) -> Optional[BatchPreprocess]:
+    """编码器对应的快速预处理；关闭时返回 None，调用方走 encoder.preprocess"""
+    if not ENABLED:
+        return None
+    return getattr(encoder, "batch_preprocess", None)
+
+
+def compare(paths: Sequence[Path], preprocess, n_px: int = 224) -> dict:
+    """逐张比较快速路径与原 preprocess 的输出（都是归一化后的张量），并统计两边的耗时"""
+    prep = BatchPreprocess(n_px)
+    mean_diffs: List[float] = []
+    max_diffs: List[float] = []
+    cosines: List[float] = []
+    fast_time = ref_time = 0.0
+    for p in paths:
+        t0 = time.perf_counter()
+        with Image.open(p) as img:
+            ref = preprocess(img.convert("RGB"))
+        t1 = time.perf_counter()
+        fast = prep.collate([prep.load(p)])[0]
+        fast_time += time.perf_counter() - t1
+        ref_time += t1 - t0
+        diff = (fast - ref).abs()
+        mean_diffs.append(float(diff.mean()))
+        max_diffs.append(float(diff.max()))
+        cosines.append(float(torch.nn.functional.cosine_similarity(fast.double().flatten(), ref.double().flatten(),
+                                                                  dim=0)))
+    worst = int(np.argmax(mean_diffs))
+    return {
+        "samples": len(paths),
+        "mean_abs_diff": float(np.mean(mean_diffs)),
+        "max_mean_abs_diff": mean_diffs[worst],
+        "worst_file": str(paths[worst]),
+        "max_abs_diff": float(np.max(max_diffs)),
+        "cosine_min": float(np.min(cosines)),
+        "within_tolerance": mean_diffs[worst] <= TOLERANCE_MEAN and float(np.min(cosines)) >= TOLERANCE_COSINE,
+        "reference_ms_per_image": ref_time / len(paths) * 1000,
+        "fast_ms_per_image": fast_time / len(paths) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="快速预处理与原 CLIP preprocess 的一致性和速度对比")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_check = sub.add_parser("check", help="在一个库（或图片文件夹）里抽样对比")
+    p_check.add_argument("target", help="databases/ 下的库名，或图片文件夹路径")
+    p_check.add_argument("--samples", type=int, default=100)
+    p_check.add_argument("--n-px", type=int, default=224)
+    args = parser.parse_args()
+
+    from encoders import make_preprocess
+    folder = Path(args.target)
+    if not folder.is_dir():
+        folder = sticker_dir(get_project_root() / "databases" / args.target)
+    files = sorted(p for p in folder.rglob("*") if p.suffix.lower() in IMAGE_EXTS)
+    if not files:
+        raise SystemExit(f"No images found in {folder}.")
+    random.Random(0).shuffle(files)
+    print(json.dumps(compare(files[:args.samples], make_preprocess(args.n_px), args.n_px),
+                     ensure_ascii=False, indent=2))
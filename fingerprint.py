@@ -0,0 +1,21 @@
+"""
+剪贴板图片的像素指纹，查询缓存和剪贴板变化检测共用；只依赖 PIL，剪贴板监听导入它不会拉进 torch / faiss。
+"""
+import hashlib
+
+from PIL import Image
+
+FINGERPRINT_SIDE = 256  # 计算指纹前先把长边缩到这个尺寸以内
+
+
+def image_fingerprint(img: Image.Image) -> str:
+    """
+    图片指纹：先用 box 缩小（保留所有像素的平均值信息）再对原始像素做哈希，
+    不经过 PNG 编码，4K 截图也只需要十几毫秒。代价是只改动个别像素时可能认为没变
+    """
+    factor = max(1, max(img.size) // FINGERPRINT_SIDE)
+    small = img.reduce(factor) if factor > 1 else img
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    h.update(small.tobytes())
+    return h.hexdigest()
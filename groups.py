@@ -0,0 +1,55 @@
+"""
+代表 -> 成员名称表 stickers.groups.json：索引里每组只有一个代表向量，
+结果窗口和服务端通过这里取回同组的其它名字。
+
+    {"threshold": 0.95, "members": {"代表名": ["成员名", ...], ...}}
+
+成员包括内容完全相同的文件（共用一个向量 ID），以及建库时按相似度阈值合并的近似重复
+（threshold 为 null 表示没有做近似合并）。
+"""
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+GROUPS_NAME = "stickers.groups.json"
+
+_lock = threading.Lock()
+_tables: Dict[Path, tuple] = {}  # db_dir -> ((mtime, size), members)
+
+
+def write_groups(db_dir: Path, members: Dict[str, List[str]], threshold: Optional[float] = None):
+    """没有任何成员时删除旧文件"""
+    path = db_dir / GROUPS_NAME
+    if not members:
+        if path.exists():
+            path.unlink()
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"threshold": threshold, "members": members}, f, ensure_ascii=False)
+
+
+def _load(db_dir: Path) -> Dict[str, List[str]]:
+    path = db_dir / GROUPS_NAME
+    try:
+        st = path.stat()
+    except OSError:
+        _tables.pop(db_dir, None)
+        return {}
+    sig = (st.st_mtime_ns, st.st_size)
+    cached = _tables.get(db_dir)
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            members = json.load(f).get("members", {})
+    except (OSError, ValueError):
+        members = {}
+    _tables[db_dir] = (sig, members)
+    return members
+
+
+def members(db_dir: Path, name: str) -> List[str]:
+    """name 所在组的其它成员（name 是代表时）；文件变化后自动重新读取"""
+    with _lock:
+        return _load(db_dir).get(name, [])
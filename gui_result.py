@@ -1,11 +1,84 @@
+import os
+import threading
 import tkinter as tk
-from typing import List, Optional, Tuple
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from PIL import Image, ImageTk
 import pyperclip
 
+import groups
+from paths import sticker_dir
+from thumbs import THUMB_SIZE, ThumbPack
+
+THUMB_CACHE_SIZE = 1024  # 解码后的小图在所有弹窗间共享，按 LRU 保留这么多张
+MAX_MEMBERS_SHOWN = 6  # 每个结果下面最多列出这么多个同组成员（重复/近似重复的贴纸）
+
+_thumb_lock = threading.RLock()
+_thumb_packs: Dict[Path, Tuple[tuple, Optional[ThumbPack]]] = {}  # 库目录 -> (文件签名, 缩略图包)
+_thumb_images: "OrderedDict[Tuple[Path, str], Optional[Image.Image]]" = OrderedDict()
+
+def _get_thumb_pack(db_dir: Path) -> Optional[ThumbPack]:
+    """打开（或复用）库里的 stickers.thumbs；文件被重建过就重新映射并丢掉这个库的缓存小图"""
+    path = db_dir / "stickers.thumbs"
+    try:
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        signature = None
+    cached = _thumb_packs.get(db_dir)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    release_thumbs(db_dir)
+    pack = None
+    if signature is not None:
+        try:
+            pack = ThumbPack(path)
+        except (OSError, ValueError):
+            pack = None
+    _thumb_packs[db_dir] = (signature, pack)
+    return pack
+
+def load_thumbnail(db_dir: Path, name: str) -> Optional[Image.Image]:
+    """
+    取一张结果缩略图：优先读缩略图包，旧库没有包时才退回打开原图。
+    解码结果放在进程内共享的 LRU 里，同一张贴纸再次出现时不再解码；
+    先核对缩略图包的签名，库在外面被重建过时这个库的旧小图已经清掉，不会再从 LRU 里取到
+    """
+    key = (db_dir, name)
+    with _thumb_lock:
+        pack = _get_thumb_pack(db_dir)
+        if key in _thumb_images:
+            _thumb_images.move_to_end(key)
+            return _thumb_images[key]
+        img = None
+        try:
+            if pack is not None:
+                img = pack.get(name)
+            if img is None:
+                img_path = sticker_dir(db_dir) / name
+                if img_path.exists():
+                    img = Image.open(img_path)
+                    img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        except Exception:
+            img = None
+        _thumb_images[key] = img
+        while len(_thumb_images) > THUMB_CACHE_SIZE:
+            _thumb_images.popitem(last=False)
+        return img
+
+def release_thumbs(db_dir: Path):
+    """关闭这个库的缩略图包（重建数据库前调用，Windows 上映射中的文件不能被替换）"""
+    with _thumb_lock:
+        _, pack = _thumb_packs.pop(db_dir, (None, None))
+        if pack is not None:
+            pack.close()
+        for key in [k for k in _thumb_images if k[0] == db_dir]:
+            del _thumb_images[key]
+
 class ModernResultUI:
-    def __init__(self, results: List[Tuple[str, float]], db_dir: Optional[Path] = None, show_thumb: bool = False, master: Optional[tk.Misc] = None):
+    def __init__(self, results: List[tuple], db_dir: Optional[Path] = None, show_thumb: bool = False, master: Optional[tk.Misc] = None,
+                 db_root: Optional[Path] = None):
         self._owns_mainloop = master is None
         self.root = tk.Tk() if self._owns_mainloop else tk.Toplevel(master)
         self.root.title("识别结果  作者：Mr. Chen")
@@ -13,6 +86,7 @@ class ModernResultUI:
         self.root.configure(bg="#0000ff")
         
         self.db_dir = db_dir
+        self.db_root = db_root
         self.show_thumb = show_thumb
         self.images = [] # Keep references
 
@@ -48,21 +122,24 @@ class ModernResultUI:
         else:
             self.root.mainloop()
 
-    def create_buttons(self, results: List[Tuple[str, float]]):
-        for name, score in results:
-            text = f"{name}    {score:.3f}"
-            
+    def create_buttons(self, results: List[tuple]):
+        for result in results:
+            name, score = result[0], result[1]
+            # 跨库搜索的结果是 (名称, 分数, 库名)，缩略图从对应的库里取
+            db_name = result[2] if len(result) > 2 else None
+            if db_name is None:
+                text = f"{name}    {score:.3f}"
+                thumb_dir = self.db_dir
+            else:
+                text = f"{name}  [{db_name}]    {score:.3f}"
+                thumb_dir = self.db_root / db_name if self.db_root else None
+
             image = None
-            if self.show_thumb and self.db_dir:
-                try:
-                    img_path = self.db_dir / "stickers" / name
-                    if img_path.exists():
-                        pil_img = Image.open(img_path)
-                        pil_img.thumbnail((48, 48))
-                        image = ImageTk.PhotoImage(pil_img)
-                        self.images.append(image)
-                except Exception:
-                    pass
+            if self.show_thumb and thumb_dir:
+                pil_img = load_thumbnail(thumb_dir, name)
+                if pil_img is not None:
+                    image = ImageTk.PhotoImage(pil_img)
+                    self.images.append(image)
 
             btn = tk.Button(
                 self.buttons_frame,
@@ -82,6 +159,28 @@ class ModernResultUI:
             btn.pack(fill=tk.X, pady=4)
             btn.bind("<Enter>", lambda e, b=btn: b.configure(bg="#e6f0ff"))
             btn.bind("<Leave>", lambda e, b=btn: b.configure(bg="#ffffff"))
+            if thumb_dir:
+                self.create_member_buttons(groups.members(thumb_dir, name))
+
+    def create_member_buttons(self, members: List[str]):
+        """索引里只有组代表，同组的其它名字列在代表下面，同样点击复制"""
+        for member in members[:MAX_MEMBERS_SHOWN]:
+            btn = tk.Button(
+                self.buttons_frame,
+                text=f"└ {member}",
+                anchor="w",
+                padx=30,
+                pady=2,
+                bg="#f7f7fa",
+                fg="#666666",
+                relief="flat",
+                font=("Segoe UI", 9),
+                command=lambda n=member: self.copy_to_clipboard(n)
+            )
+            btn.pack(fill=tk.X, pady=1)
+        if len(members) > MAX_MEMBERS_SHOWN:
+            tk.Label(self.buttons_frame, text=f"   另有 {len(members) - MAX_MEMBERS_SHOWN} 个相似贴纸",
+                     anchor="w", bg="#f0f0f5", fg="#999999", font=("Segoe UI", 9)).pack(fill=tk.X)
 
     def copy_to_clipboard(self, text: str):
         pyperclip.copy(text)
@@ -97,9 +196,11 @@ class ModernResultUI:
         y = (sh - h) // 3
         self.root.geometry(f"{w}x{h}+{x}+{y}")
 
-def show_result(results: List[Tuple[str, float]], db_dir: Optional[Path] = None, show_thumb: bool = False):
+def show_result(results: List[tuple], db_dir: Optional[Path] = None, show_thumb: bool = False,
+                db_root: Optional[Path] = None):
+    """results 为 (名称, 分数) 或跨库搜索的 (名称, 分数, 库名)；后者的缩略图在 db_root/库名 下找"""
     master = tk._default_root if tk._default_root is not None else None
-    ModernResultUI(results, db_dir=db_dir, show_thumb=show_thumb, master=master)
+    ModernResultUI(results, db_dir=db_dir, show_thumb=show_thumb, master=master, db_root=db_root)
 
 
 # 测试
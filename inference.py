@@ -0,0 +1,231 @@
+"""
+CPU 推理设置：bfloat16 autocast、channels_last 内存布局，以及查询/建库两种负载各自的线程预算。
+
+    settings = inference.tune(encoder, "ViT-B/32", "query")   # {"threads": 4, "bf16": False, ...}
+    inference.apply(encoder, settings)                        # 设置编码器选项，记在 encoder.inference_settings
+    with inference.workload(encoder.inference_settings):      # 这段时间内使用该线程预算
+        encoder.encode_image(x)
+
+查询是单张图、要低延迟，还要给剪贴板监听和 Tk 留出核心；建库是大批量、要吞吐。
+每台机器第一次用某个模型时跑一次微基准（先选线程数，再试 bf16 / channels_last），
+结果缓存在 models/inference.json，之后直接读取。bf16 只有在 CPU 原生支持、
+并且与 fp32 特征的余弦相似度不低于 BF16_MIN_COSINE 时才会被选中。
+
+torch.set_num_threads 是整个进程共用的：同一个进程里既有查询又在建库时，两边的设置会互相覆盖，
+所以线程数不在加载模型时设一次，而是每次前向都用 workload() 包起来，结束后恢复原值
+（两个线程真正同时编码时仍以后设置的为准）。onnx 后端不用 torch 的线程池，
+线程数在 apply 时传给 onnxruntime 的 SessionOptions.intra_op_num_threads。
+
+    python inference.py tune ViT-B/32 --force
+"""
+import os
+import json
+import time
+import platform
+import argparse
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+from paths import get_project_root
+
+CACHE_NAME = "inference.json"
+WORKLOADS = ("query", "build")
+# 微基准的批大小：查询一张图，建库用小一点的批次代替 BATCH_SIZE，控制调优耗时
+BENCH_BATCH = {"query": 1, "build": 8}
+BENCH_ROUNDS = 3
+BF16_MIN_COSINE = 0.99
+# STICKER_AUTOTUNE=0 时不跑微基准，直接使用默认设置
+AUTOTUNE = os.environ.get("STICKER_AUTOTUNE", "1") != "0"
+
+_lock = threading.Lock()
+_interop_set = False
+
+
+def _cores() -> int:
+    return os.cpu_count() or 1
+
+
+def default_settings(workload: str) -> dict:
+    """不调优时的线程预算：查询留一半核心给监听线程和界面，建库留两个给解码线程"""
+    cores = _cores()
+    threads = max(1, min(4, cores // 2)) if workload == "query" else max(1, cores - 2)
+    return {"threads": threads, "bf16": False, "channels_last": False}
+
+
+def thread_candidates(workload: str) -> List[int]:
+    # 建库时解码线程同时在跑，微基准测不到这部分争抢，所以不试占满全部核心
+    cores = _cores()
+    if workload == "query":
+        candidates = [1, 2, 4, cores // 2]
+    else:
+        candidates = [cores // 2, cores - 2]
+    return sorted({c for c in candidates if 1 <= c <= cores}) or [1]
+
+
+def bf16_supported() -> bool:
+    # 没有 AVX512-BF16 / AMX 时 autocast 只是软件模拟，比 fp32 还慢
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def set_interop_threads(n: int = 1):
+    """CLIP 前向没有可以并行的独立算子，inter-op 线程只会多占核心；只能在第一次并行计算前设置"""
+    global _interop_set
+    if _interop_set:
+        return
+    _interop_set = True
+    try:
+        torch.set_num_interop_threads(n)
+    except RuntimeError:
+        pass
+
+
+def apply(encoder, settings: dict):
+    """
+    bf16 / channels_last 只对 CPU 上的 eager 编码器有效；onnx 编码器的线程数直接设进会话。
+    用 torch 线程池的编码器把设置记在 encoder.inference_settings，供 workload() 使用
+    """
+    if hasattr(encoder, "set_options"):
+        encoder.set_options(settings.get("bf16", False), settings.get("channels_last", False))
+    if hasattr(encoder, "set_threads"):
+        encoder.set_threads(settings["threads"])
+    encoder.inference_settings = settings if getattr(encoder, "torch_threads", True) else None
+
+
+@contextmanager
+def workload(settings: Optional[dict]):
+    """在这段代码里把进程的 intra-op 线程数设为 settings 的预算，结束后恢复；settings 为空时不做任何事"""
+    if settings is None:
+        yield
+        return
+    set_interop_threads()
+    previous = torch.get_num_threads()
+    if previous != settings["threads"]:
+        torch.set_num_threads(settings["threads"])
+    try:
+        yield
+    finally:
+        if torch.get_num_threads() != previous:
+            torch.set_num_threads(previous)
+
+
+def _cache_key(model_name: str, encoder) -> str:
+    backend = type(encoder).__name__
+    return "|".join([platform.machine(), platform.processor() or "?", str(_cores()), torch.__version__,
+                     model_name, backend])
+
+
+def _load_cache(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: Path, cache: dict):
+    os.makedirs(path.parent, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+
+
+def _time(encoder, x: torch.Tensor, settings: dict, rounds: int = BENCH_ROUNDS) -> float:
+    apply(encoder, settings)
+    torch.set_num_threads(settings["threads"])
+    encoder.encode_image(x)  # 第一次调用包含内存分配和算子初始化，不计时
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        encoder.encode_image(x)
+    return (time.perf_counter() - t0) / rounds
+
+
+def benchmark(encoder, workload: str) -> dict:
+    """
+    分两步：先用 fp32 选线程数，再在最快的线程数上试 bf16 / channels_last 的各种组合
+    （每个组合都从 fp32 基线出发，互不叠加），取最快的。返回选中的设置，附带 ms_per_batch 和各候选的耗时
+    """
+    side = getattr(encoder, "input_resolution", 224)
+    x = torch.randn(BENCH_BATCH[workload], 3, side, side)
+    previous = torch.get_num_threads()
+    trials: Dict[str, float] = {}
+    try:
+        best, best_time = None, float("inf")
+        for threads in thread_candidates(workload):
+            settings = {"threads": threads, "bf16": False, "channels_last": False}
+            elapsed = _time(encoder, x, settings)
+            trials[f"threads={threads}"] = elapsed * 1000
+            if elapsed < best_time:
+                best, best_time = settings, elapsed
+
+        baseline = best
+        options = [{"channels_last": True}]
+        if hasattr(encoder, "set_options") and bf16_supported():
+            apply(encoder, baseline)
+            reference = encoder.encode_image(x)
+            apply(encoder, {**baseline, "bf16": True})
+            drift = torch.nn.functional.cosine_similarity(encoder.encode_image(x), reference).min().item()
+            trials["bf16_min_cosine"] = drift
+            if drift >= BF16_MIN_COSINE:
+                options += [{"bf16": True}, {"bf16": True, "channels_last": True}]
+        if hasattr(encoder, "set_options"):
+            for option in options:
+                settings = {**baseline, **option}
+                elapsed = _time(encoder, x, settings)
+                trials[",".join(f"{k}={v}" for k, v in settings.items())] = elapsed * 1000
+                if elapsed < best_time:
+                    best, best_time = settings, elapsed
+    finally:
+        apply(encoder, {"bf16": False, "channels_last": False})
+        torch.set_num_threads(previous)
+    return {**best, "ms_per_batch": best_time * 1000, "batch": BENCH_BATCH[workload], "trials": trials}
+
+
+def tune(encoder, model_name: str, workload: str, model_dir: Optional[Path] = None, force: bool = False) -> dict:
+    """
+    取这台机器上 (模型, 后端, 负载) 的最佳设置：有缓存直接用，否则跑一次微基准并写入缓存。
+    GPU 上、onnx 后端（线程由 onnxruntime 自己管理）或关闭调优时返回默认设置
+    """
+    if workload not in WORKLOADS:
+        raise ValueError(f"Unknown workload: {workload}")
+    if getattr(encoder, "device", "cpu") != "cpu" or not getattr(encoder, "torch_threads", True) or not AUTOTUNE:
+        return default_settings(workload)
+    path = Path(model_dir or get_project_root() / "models") / CACHE_NAME
+    key = _cache_key(model_name, encoder)
+    with _lock:
+        cache = _load_cache(path)
+        cached = cache.get(key, {}).get(workload)
+        if cached is not None and not force:
+            return cached
+        t0 = time.time()
+        result = benchmark(encoder, workload)
+        print(f"[inference] {model_name} {workload}: threads={result['threads']} bf16={result['bf16']} "
+              f"channels_last={result['channels_last']} ({result['ms_per_batch']:.1f} ms per batch of "
+              f"{result['batch']}, tuned in {time.time() - t0:.1f}s)")
+        cache = _load_cache(path)
+        cache.setdefault(key, {})[workload] = result
+        _save_cache(path, cache)
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在这台机器上为 CLIP 推理选择线程数 / bf16 / channels_last")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_tune = sub.add_parser("tune", help="跑微基准并写入 models/inference.json")
+    p_tune.add_argument("model_name", nargs="?", default="ViT-B/32")
+    p_tune.add_argument("--backend", default="eager", choices=("eager", "torchscript", "onnx"))
+    p_tune.add_argument("--int8", action="store_true")
+    p_tune.add_argument("--force", action="store_true", help="忽略缓存重新测")
+    args = parser.parse_args()
+
+    from encoders import load_encoder
+    model_dir = get_project_root() / "models"
+    encoder = load_encoder(args.model_name, "cpu", args.backend, args.int8, model_dir)
+    for name in WORKLOADS:
+        print(json.dumps({name: tune(encoder, args.model_name, name, model_dir, force=args.force)},
+                         ensure_ascii=False, indent=2))
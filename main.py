@@ -1,16 +1,24 @@
-import io, os, queue, threading, time, tempfile
+import os, queue, threading, time
+_STARTUP_T0 = time.perf_counter()
 import sys
+import json
 import ctypes
 from ctypes import wintypes
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 from pathlib import Path
-from PIL import Image, ImageGrab
-import torch
 
-from gui_result import show_result
-from search import find_sticker, switch_database
-from build_index import build_index_gui
+# torch / faiss / clip 导入要好几秒：search、build_index、clipboard_source 都在用到时
+# 才在后台线程里导入，控制面板先显示出来
+from gui_result import release_thumbs, show_result, sticker_dir
+
+SETTINGS_NAME = "settings.json"  # 记住上次使用的数据库，下次启动时在后台预加载
+
+def log_startup(phase: str, started: float) -> float:
+    """打印启动阶段耗时和距进程启动的累计时间，返回当前时间作为下一阶段的起点"""
+    now = time.perf_counter()
+    print(f"[startup] {phase}: {(now - started) * 1000:.0f} ms (t+{now - _STARTUP_T0:.2f}s)")
+    return now
 
 def get_console_window():
     kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
@@ -90,22 +98,80 @@ def check_license_or_exit() -> str:
     messagebox.showerror("授权错误", "未知授权状态")
     sys.exit(1)
 
-tmp_img = str(Path(tempfile.gettempdir()) / "pic_recognize_tmp.png")
+def load_settings() -> dict:
+    try:
+        with open(resource_path(SETTINGS_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_settings(**updates):
+    settings = load_settings()
+    settings.update(updates)
+    try:
+        with open(resource_path(SETTINGS_NAME), "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"[startup] Failed to save settings: {e}")
+
 stop_flag = threading.Event()
 pause_flag = threading.Event()
-results_queue: "queue.Queue[list[tuple[str, float]]]" = queue.Queue()
+results_queue: "queue.Queue[tuple[list[tuple[str, float]], float]]" = queue.Queue()  # (结果, 检测到新图片的时间)
 search_lock = threading.Lock()
 DB_DIR: Path = None
+SEARCH_ALL = False  # 跨库搜索：databases/ 下所有库一起查
+SEARCH_REGIONS = False  # 多区域识别：一张截图里有多个贴纸时分区域识别（只对当前库）
 
-#检测设备
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+#检测设备：在后台预热线程里导入 torch 后才知道，之前为 None
+DEVICE: str = None
 GPU_NAME = None
-if DEVICE == "cuda":
-    GPU_NAME = torch.cuda.get_device_name(0)
-    print("正在使用NVIDIA CUDA加速")   
-    print(f"使用的GPU: {GPU_NAME}")
-else:
-    print("正在使用CPU处理")
+
+def detect_device():
+    global DEVICE, GPU_NAME
+    import torch
+    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+    if DEVICE == "cuda":
+        GPU_NAME = torch.cuda.get_device_name(0)
+        print("正在使用NVIDIA CUDA加速")
+        print(f"使用的GPU: {GPU_NAME}")
+    else:
+        print("正在使用CPU处理")
+
+def warm_up(ui: "ControlPanelUI"):
+    """
+    后台预热：导入 torch 检测设备 → 导入 search → 加载上次使用的数据库和模型 → 跑一次前向。
+    界面此时已经可以操作，预热期间到来的识别请求会在 search_lock 上等待
+    """
+    global DB_DIR
+    t = time.perf_counter()
+    detect_device()
+    t = log_startup("import torch + detect device", t)
+    ui.root.after(0, ui._refresh_device_ui)
+    import search
+    t = log_startup("import search (faiss, clip)", t)
+
+    db_dir = DB_DIR
+    if db_dir is None:
+        return
+    try:
+        with search_lock:
+            # 用户在预热完成前已经手动切换了数据库，不再覆盖
+            if search.CURRENT_DB is not None:
+                return
+            search.switch_database(db_dir)
+            t = log_startup(f"load database {db_dir.name} + model", t)
+            search.warm_up()
+        log_startup("model warm-up", t)
+        ui.root.after(0, lambda: ui.status_var.set(f"当前数据库：{db_dir.name}"))
+    except Exception as e:
+        print(f"[startup] Failed to load {db_dir}: {e}")
+        # except 结束后 e 会被解绑，回调里只能用提前格式化好的文字
+        msg = f"加载数据库失败：{e}"
+        if DB_DIR == db_dir:
+            DB_DIR = None
+        ui.root.after(0, ui._refresh_db_ui)
+        ui.root.after(0, lambda: ui.status_var.set(msg))
+        ui.root.after(0, ui._auto_open_db_selector)
 
 
 # 新建数据库流程
@@ -124,46 +190,60 @@ def create_new_db_from_gui(root, callback):
         return
 
     def build_task():
+        global DB_DIR
+        from build_index import build_index_gui
+        from search import release_resources
+        previous_db = DB_DIR
+        with search_lock:
+            if previous_db is not None and previous_db.name == db_name:
+                DB_DIR = None
+            # 重建前关闭这个库的 mmap（包括常驻缓存中的索引和缩略图包），否则 Windows 上无法覆盖这些文件
+            release_resources(resource_path("databases") / db_name)
+            release_thumbs(resource_path("databases") / db_name)
         try:
             db_dir = build_index_gui(Path(sticker_dir), db_name, device=DEVICE)
             root.after(0, lambda: callback(db_dir))
         except Exception as e:
+            if DB_DIR is None:
+                DB_DIR = previous_db
             root.after(0, lambda: messagebox.showerror("错误", f"建库失败：{e}", parent=root))
 
     threading.Thread(target=build_task, daemon=True).start()
 
 # 剪贴板监听线程
 def clipboard_watcher():
-    last_hash = None
-    while not stop_flag.is_set():
-        if pause_flag.is_set():
-            time.sleep(0.2)
-            continue
-        try:
-            img = ImageGrab.grabclipboard()
-            if isinstance(img, Image.Image):
-                buf = io.BytesIO()
-                img.save(buf, format='PNG')
-                h = hash(buf.getvalue())
-                if h != last_hash:
-                    last_hash = h
-                    img.save(tmp_img, 'PNG')
-                    if DB_DIR is not None:
-                        with search_lock:
-                            matches = find_sticker(tmp_img, DB_DIR)
-                        results_queue.put(matches)
-            time.sleep(1)
-        except Exception:
-            pass
+    from clipboard_source import default_source, watch_clipboard
+    from regions import merge_results
+    from search import find_sticker, find_sticker_all, find_sticker_regions, list_databases
+
+    def on_image(img, fingerprint):
+        # 直接在内存中识别，不再编码 PNG 和写临时文件；指纹同时用作查询缓存的 key
+        if SEARCH_ALL:
+            detected = time.perf_counter()
+            with search_lock:
+                matches = find_sticker_all(img, db_dirs=list_databases(resource_path("databases")))
+            results_queue.put((matches, detected))
+        elif DB_DIR is not None and SEARCH_REGIONS:
+            detected = time.perf_counter()
+            with search_lock:
+                # 每个区域取最好的一个，合并成一个结果列表
+                matches = merge_results(find_sticker_regions(img, DB_DIR))
+            results_queue.put((matches, detected))
+        elif DB_DIR is not None:
+            detected = time.perf_counter()
+            with search_lock:
+                matches = find_sticker(img, DB_DIR, fingerprint=fingerprint)
+            results_queue.put((matches, detected))
+    watch_clipboard(default_source(), on_image, stop_flag, pause_flag)
 
 def open_folder():
     global DB_DIR
     if DB_DIR is None:
         messagebox.showerror("错误", "未选择数据库！")
         return
-    sticker_dir = DB_DIR / "stickers"
-    if sticker_dir.exists():
-        os.startfile(sticker_dir)
+    folder = sticker_dir(DB_DIR)
+    if folder.exists():
+        os.startfile(folder)
     else:
         messagebox.showerror("错误", "贴纸文件夹不存在！")
 
@@ -222,7 +302,10 @@ class ControlPanelUI:
 
         self._refresh_db_ui()
         self._refresh_listener_ui()
+        self._refresh_device_ui()
         self._center_window(min_w=420)
+        if DB_DIR is not None:
+            self.status_var.set(f"正在加载数据库：{DB_DIR.name} ...")
 
         self.root.after(200, self._poll_results)
         self.root.after(300, self._auto_open_db_selector)
@@ -343,6 +426,34 @@ class ControlPanelUI:
         )
         cb.pack(anchor="w", pady=(8, 0))
 
+        self.search_all_var = tk.BooleanVar(value=SEARCH_ALL)
+        tk.Checkbutton(
+            parent,
+            text="在全部数据库中搜索",
+            variable=self.search_all_var,
+            command=self._toggle_search_all,
+            bg=self.bg,
+            fg=self.text,
+            activebackground=self.bg,
+            activeforeground=self.text,
+            font=("Segoe UI", 10),
+            selectcolor="white"
+        ).pack(anchor="w", pady=(4, 0))
+
+        self.search_regions_var = tk.BooleanVar(value=SEARCH_REGIONS)
+        tk.Checkbutton(
+            parent,
+            text="截图里有多个贴纸时分区域识别",
+            variable=self.search_regions_var,
+            command=self._toggle_search_regions,
+            bg=self.bg,
+            fg=self.text,
+            activebackground=self.bg,
+            activeforeground=self.text,
+            font=("Segoe UI", 10),
+            selectcolor="white"
+        ).pack(anchor="w", pady=(4, 0))
+
         self.status_var = tk.StringVar(value="")
         tk.Label(parent, textvariable=self.status_var, font=("Segoe UI", 10), bg=self.bg, fg=self.subtext).pack(
             anchor="w", pady=(10, 0)
@@ -378,6 +489,11 @@ class ControlPanelUI:
         self.pause_btn.bind("<Enter>", lambda e: self.pause_btn.configure(bg="#e6f0ff"))
         self.pause_btn.bind("<Leave>", lambda e: self.pause_btn.configure(bg="#ffffff"))
 
+        # 最近一次识别各阶段的耗时（timing.py），关闭计时后不显示
+        self.timing_var = tk.StringVar(value="")
+        tk.Label(parent, textvariable=self.timing_var, font=("Segoe UI", 9), bg=self.bg, fg=self.subtext,
+                 justify="left").pack(anchor="w", pady=(8, 0))
+
     def _build_device_section(self, parent):
         self._build_section_title(parent, "⚛️计算设备")
 
@@ -387,15 +503,10 @@ class ControlPanelUI:
         info_frame = tk.Frame(row, bg=self.bg)
         info_frame.pack(side="left")
 
-        if DEVICE == "cuda":
-            primary = "NVIDIA CUDA 加速"
-            secondary = GPU_NAME or "GPU"
-        else:
-            primary = "正在使用CPU 处理"
-            secondary = "🙂"
-
-        tk.Label(info_frame, text=primary, font=("Segoe UI", 11), bg=self.bg, fg=self.text).pack(anchor="w")
-        tk.Label(info_frame, text=secondary, font=("Segoe UI", 10), bg=self.bg, fg=self.subtext).pack(anchor="w", pady=(4, 0))
+        self.device_primary_var = tk.StringVar()
+        self.device_secondary_var = tk.StringVar()
+        tk.Label(info_frame, textvariable=self.device_primary_var, font=("Segoe UI", 11), bg=self.bg, fg=self.text).pack(anchor="w")
+        tk.Label(info_frame, textvariable=self.device_secondary_var, font=("Segoe UI", 10), bg=self.bg, fg=self.subtext).pack(anchor="w", pady=(4, 0))
 
         self.console_visible = True
         def toggle_console_click():
@@ -437,10 +548,17 @@ class ControlPanelUI:
         quit_btn.bind("<Leave>", lambda e: quit_btn.configure(bg="#D32F2F"))
 
     def _poll_results(self):
+        import timing
         try:
             while True:
-                results = results_queue.get_nowait()
-                show_result(results, db_dir=DB_DIR, show_thumb=self.show_thumb_var.get())
+                results, detected = results_queue.get_nowait()
+                with timing.stage("show_result"):
+                    show_result(results, db_dir=DB_DIR, show_thumb=self.show_thumb_var.get(),
+                                db_root=resource_path("databases"))
+                if timing.ENABLED:
+                    # 从检测到剪贴板变化到结果窗口建好，包括等锁、识别和这里的轮询间隔
+                    timing.record("end_to_end", time.perf_counter() - detected)
+                    self._refresh_timing_ui()
         except queue.Empty:
             pass
         if not stop_flag.is_set():
@@ -465,6 +583,39 @@ class ControlPanelUI:
             if hasattr(self, "open_folder_btn"):
                 self.open_folder_btn.configure(state="normal")
 
+    def _refresh_device_ui(self):
+        if DEVICE is None:
+            self.device_primary_var.set("正在检测计算设备 ...")
+            self.device_secondary_var.set("")
+        elif DEVICE == "cuda":
+            self.device_primary_var.set("NVIDIA CUDA 加速")
+            self.device_secondary_var.set(GPU_NAME or "GPU")
+        else:
+            self.device_primary_var.set("正在使用CPU 处理")
+            self.device_secondary_var.set("🙂")
+
+    def _toggle_search_all(self):
+        global SEARCH_ALL
+        SEARCH_ALL = self.search_all_var.get()
+
+    def _toggle_search_regions(self):
+        global SEARCH_REGIONS
+        SEARCH_REGIONS = self.search_regions_var.get()
+
+    def _refresh_timing_ui(self):
+        import timing
+        parts = []
+        for name, label in (("grab", "取图"), ("preprocess", "预处理"), ("encode", "编码"),
+                            ("search", "搜索"), ("show_result", "显示")):
+            snap = timing.snapshot(name)
+            if snap is not None:
+                parts.append(f"{label} {snap['last_ms']:.0f}")
+        text = "上次识别 (ms)：" + " · ".join(parts)
+        total = timing.snapshot("end_to_end")
+        if total is not None:
+            text += f"\n端到端 {total['last_ms']:.0f} ms，p95 {total['p95_ms']:.0f} ms（最近 {total['count']} 次）"
+        self.timing_var.set(text)
+
     def _refresh_listener_ui(self):
         if pause_flag.is_set():
             self.listener_dot.configure(fg="#9e9e9e")
@@ -491,9 +642,11 @@ class ControlPanelUI:
             self.status_var.set(f"正在加载数据库：{db_dir.name} ...")
 
             def task():
+                from search import switch_database
                 try:
                     with search_lock:
                         switch_database(db_dir)
+                    save_settings(last_db=db_dir.name)
                     self.root.after(0, lambda: self.status_var.set(f"当前数据库：{db_dir.name}"))
                 except Exception as e:
                     self.root.after(
@@ -534,9 +687,11 @@ class ControlPanelUI:
             self.status_var.set(f"正在切换到数据库：{db_name} ...")
 
             def task():
+                from search import switch_database
                 try:
                     with search_lock:
                         switch_database(target_dir)
+                    save_settings(last_db=db_name)
                     def done():
                         global DB_DIR
                         DB_DIR = target_dir
@@ -629,9 +784,23 @@ class ControlPanelUI:
         self.root.destroy()
 
 def main():
+    global DB_DIR
+    t = log_startup("imports", _STARTUP_T0)
     expire_date = check_license_or_exit()
+    t = log_startup("license check", t)
+
+    last_db = load_settings().get("last_db")
+    # 不导入 stickers_db（会拉进 faiss），直接看文件：单文件库或旧布局
+    last_dir = resource_path("databases") / last_db if last_db else None
+    if last_dir and ((last_dir / "stickers.db").exists() or (last_dir / "stickers.faiss").exists()):
+        DB_DIR = last_dir
+
     threading.Thread(target=clipboard_watcher, daemon=True).start()
-    ControlPanelUI(expire_date).run()
+    ui = ControlPanelUI(expire_date)
+    t = log_startup("control panel", t)
+    threading.Thread(target=warm_up, args=(ui,), daemon=True).start()
+    ui.root.after_idle(lambda: log_startup("first frame", t))
+    ui.run()
 
 if __name__ == "__main__":
     main()
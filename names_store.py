@@ -0,0 +1,69 @@
+"""
+紧凑的名称存储 stickers.names，替代整体解析 stickers.json：
+
+    8 字节魔数 b"STKNAME1" | uint64 条数 n | (n+1) 个 uint64 偏移 | UTF-8 数据
+
+第 i 个名字是 data[offsets[i]:offsets[i+1]]，空串表示该向量 ID 已删除。
+读取时整个文件 mmap，只在取 topk 结果时解码用到的几个名字。
+同样的字节也作为名称段嵌在单文件库 stickers.db 里（见 stickers_db.py），NameStore 从 offset 处读取。
+"""
+import mmap
+import struct
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+MAGIC = b"STKNAME1"
+_HEADER = struct.Struct("<8sQ")
+
+
+def encode_names(names: Sequence[Optional[str]]) -> bytes:
+    encoded = [(name or "").encode("utf-8") for name in names]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+    if encoded:
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return _HEADER.pack(MAGIC, len(encoded)) + offsets.tobytes() + b"".join(encoded)
+
+
+def write_names(path: Path, names: Sequence[Optional[str]]):
+    with open(path, "wb") as f:
+        f.write(encode_names(names))
+
+
+class NameStore:
+    """按向量 ID 懒解码的只读名称表，支持 len() 和 store[i]；offset 为名称段在文件里的起始位置"""
+    def __init__(self, path: Path, offset: int = 0):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(self._mm, offset)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a names file: {self.path}")
+        self._count = count
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=offset + _HEADER.size)
+        self._data_start = offset + _HEADER.size + (count + 1) * 8
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        start = self._data_start + int(self._offsets[i])
+        end = self._data_start + int(self._offsets[i + 1])
+        if start == end:
+            return None
+        return self._mm[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def close(self):
+        # Windows 上映射中的文件不能被覆盖，重建前需要先关闭
+        self._offsets = None
+        self._mm.close()
@@ -0,0 +1,24 @@
+"""
+各模块共用的路径约定，只依赖标准库，GUI 启动和命令行工具导入它都不会拉进 torch / faiss。
+"""
+import sys
+import json
+from pathlib import Path
+
+IMAGE_EXTS = {".png", ".jpg", ".jpeg"}
+
+
+def get_project_root() -> Path:
+    if getattr(sys, "frozen", False):
+        return Path(sys.executable).resolve().parent
+    return Path(__file__).resolve().parent
+
+
+def sticker_dir(db_dir: Path) -> Path:
+    """库的贴纸文件夹：原地建库（ingest="inplace"）时是建库记录的源文件夹，否则是库目录下的 stickers"""
+    try:
+        with open(db_dir / "stickers.meta.json", "r", encoding="utf-8") as f:
+            source = json.load(f).get("sticker_dir")
+    except (OSError, ValueError):
+        source = None
+    return Path(source) if source else db_dir / "stickers"
@@ -0,0 +1,103 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+class _Entry:
+    __slots__ = ("feats", "results", "scope", "nbytes")
+
+    def __init__(self, feats: np.ndarray):
+        self.feats = feats
+        self.results: dict = {}  # topk -> [(name, score), ...]，只对 scope 对应的索引和搜索参数有效
+        self.scope: Hashable = None
+        self.nbytes = feats.nbytes + 64
+
+    def drop_results(self) -> int:
+        size = sum(sys.getsizeof(name) + 32 for results in self.results.values() for name, _ in results)
+        self.results.clear()
+        self.nbytes -= size
+        return size
+
+
+class QueryCache:
+    """
+    查询缓存：图片指纹 -> 归一化特征 + 当前数据库的 topk 结果。
+    按 LRU 淘汰，同时受条数和字节数限制；切换数据库时只清结果，特征按模型名区分可以继续用。
+    结果带一个 scope（调用方给出的库文件签名和搜索参数），scope 变了就当作没有结果，只复用特征
+    """
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0          # 直接命中结果
+        self.feature_hits = 0  # 命中特征，只需要重新搜索
+        self.misses = 0
+
+    def lookup(self, key: Hashable, topk: int, scope: Hashable = None
+               ) -> Tuple[Optional[np.ndarray], Optional[List[Tuple[str, float]]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            results = entry.results.get(topk) if entry.scope == scope else None
+            if results is not None:
+                self.hits += 1
+                return entry.feats, list(results)
+            self.feature_hits += 1
+            return entry.feats, None
+
+    def put(self, key: Hashable, feats: np.ndarray, topk: int, results: List[Tuple[str, float]],
+            scope: Hashable = None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(feats)
+                self._entries[key] = entry
+                self._bytes += entry.nbytes
+            else:
+                self._entries.move_to_end(key)
+            if entry.scope != scope:
+                # 旧索引或旧搜索参数下的结果不会再命中
+                self._bytes -= entry.drop_results()
+                entry.scope = scope
+            if topk not in entry.results:
+                size = sum(sys.getsizeof(name) + 32 for name, _ in results)
+                entry.results[topk] = list(results)
+                entry.nbytes += size
+                self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+
+    def clear_results(self):
+        """索引变了（切换数据库）：丢掉所有结果，保留特征"""
+        with self._lock:
+            for entry in self._entries.values():
+                self._bytes -= entry.drop_results()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.feature_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "feature_hits": self.feature_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.feature_hits) / total if total else 0.0,
+            }
@@ -0,0 +1,125 @@
+"""
+一张截图里有多个贴纸（比如聊天记录截图）时的候选区域切分。
+切出的区域由 search.find_sticker_regions 一次批量编码、一次检索：
+
+    boxes = propose_regions(img)                    # [(x0, y0, x1, y1), ...]，第一个总是整张图
+    search.find_sticker_regions(img, db_dir)        # [(box, [(名称, 分数), ...]), ...]
+
+切分方式：
+  "components"  前景掩码（与边框背景色差超过阈值）上做递归 XY 切分：沿整行/整列都是背景的空隙切开，
+                等价于按留白分隔的连通块，只用 numpy，在缩小后的图上几毫秒完成
+  "grid"        固定 rows x cols 网格，适合没有留白的拼图
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+Box = Tuple[int, int, int, int]
+
+REGION_MODES = ("components", "grid")
+ANALYSIS_SIDE = 256     # 在长边缩到这个尺寸的图上找区域
+BG_THRESHOLD = 24       # 与背景色的最大通道差超过它算前景
+MIN_GAP = 2             # 缩小图上至少这么宽的空白才算分隔
+MIN_REGION_SIDE = 32    # 原图上短边小于它的区域（文字行、小图标）丢弃
+MAX_REGIONS = 16        # 包括整张图在内最多这么多个区域
+PAD_RATIO = 0.04        # 区域向外扩一点，避免裁掉贴纸描边
+MAX_DEPTH = 8
+
+
+def _foreground_mask(small: np.ndarray) -> np.ndarray:
+    # 背景色取四条边像素的中位数，截图的背景通常是纯色
+    border = np.concatenate([small[0], small[-1], small[:, 0], small[:, -1]])
+    bg = np.median(border, axis=0)
+    return np.abs(small.astype(np.int16) - bg).max(axis=2) > BG_THRESHOLD
+
+
+def _runs(profile: np.ndarray, min_gap: int = MIN_GAP) -> List[Tuple[int, int]]:
+    """一维占用剖面里被不少于 min_gap 的空白隔开的非空段 [start, end)"""
+    filled = np.flatnonzero(profile)
+    if not len(filled):
+        return []
+    breaks = np.flatnonzero(np.diff(filled) > min_gap)
+    starts = np.concatenate([filled[:1], filled[breaks + 1]])
+    ends = np.concatenate([filled[breaks], filled[-1:]]) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def _xy_cut(mask: np.ndarray, x0: int, y0: int, depth: int, out: List[Box]):
+    """先按空白行切，切不动再按空白列切，直到每块在两个方向上都连续"""
+    rows = _runs(mask.any(axis=1))
+    cols = _runs(mask.any(axis=0))
+    if not rows or not cols:
+        return
+    if depth >= MAX_DEPTH or (len(rows) == 1 and len(cols) == 1):
+        out.append((x0 + cols[0][0], y0 + rows[0][0], x0 + cols[-1][1], y0 + rows[-1][1]))
+        return
+    if len(rows) > 1:
+        for a, b in rows:
+            _xy_cut(mask[a:b], x0, y0 + a, depth + 1, out)
+    else:
+        for a, b in cols:
+            _xy_cut(mask[:, a:b], x0 + a, y0, depth + 1, out)
+
+
+def _component_boxes(img: Image.Image) -> List[Box]:
+    scale = min(1.0, ANALYSIS_SIDE / max(img.size))
+    small = img.convert("RGB")
+    if scale < 1.0:
+        small = small.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))),
+                             Image.BILINEAR)
+    boxes: List[Box] = []
+    _xy_cut(_foreground_mask(np.asarray(small)), 0, 0, 0, boxes)
+    return [(int(x0 / scale), int(y0 / scale), int(np.ceil(x1 / scale)), int(np.ceil(y1 / scale)))
+            for x0, y0, x1, y1 in boxes]
+
+
+def _grid_boxes(img: Image.Image, rows: int, cols: int) -> List[Box]:
+    xs = np.linspace(0, img.width, cols + 1).round().astype(int)
+    ys = np.linspace(0, img.height, rows + 1).round().astype(int)
+    return [(int(xs[c]), int(ys[r]), int(xs[c + 1]), int(ys[r + 1])) for r in range(rows) for c in range(cols)]
+
+
+def _pad(box: Box, width: int, height: int) -> Box:
+    x0, y0, x1, y1 = box
+    px, py = int((x1 - x0) * PAD_RATIO), int((y1 - y0) * PAD_RATIO)
+    return max(0, x0 - px), max(0, y0 - py), min(width, x1 + px), min(height, y1 + py)
+
+
+def propose_regions(img: Image.Image, mode: str = "components", max_regions: int = MAX_REGIONS,
+                    grid: Tuple[int, int] = (2, 2), min_side: int = MIN_REGION_SIDE) -> List[Box]:
+    """
+    返回候选区域 (x0, y0, x1, y1)，第一个总是整张图（只有一个贴纸时照常命中），
+    其余按面积从大到小，太小的和几乎等于整张图的丢弃
+    """
+    if mode not in REGION_MODES:
+        raise ValueError(f"Unknown region mode: {mode}")
+    width, height = img.size
+    full: Box = (0, 0, width, height)
+    boxes = _component_boxes(img) if mode == "components" else _grid_boxes(img, *grid)
+    regions = [full]
+    for box in sorted(boxes, key=lambda b: (b[2] - b[0]) * (b[3] - b[1]), reverse=True):
+        x0, y0, x1, y1 = _pad(box, width, height)
+        if min(x1 - x0, y1 - y0) < min_side:
+            continue
+        if (x1 - x0) * (y1 - y0) > 0.9 * width * height:
+            continue
+        regions.append((x0, y0, x1, y1))
+        if len(regions) >= max_regions:
+            break
+    return regions
+
+
+def crop_regions(img: Image.Image, boxes: Sequence[Box]) -> List[Image.Image]:
+    return [img if box == (0, 0, img.width, img.height) else img.crop(box) for box in boxes]
+
+
+def merge_results(region_results: Sequence[Tuple[Box, List[Tuple[str, float]]]], topk: int = 5,
+                  per_region: int = 1) -> List[Tuple[str, float]]:
+    """把各区域的前 per_region 个结果合成一个列表：同名取最高分，按分数排序取前 topk"""
+    best: Dict[str, float] = {}
+    for _, results in region_results:
+        for name, score in results[:per_region]:
+            if score > best.get(name, -1.0):
+                best[name] = score
+    return sorted(best.items(), key=lambda x: x[1], reverse=True)[:topk]
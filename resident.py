@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Hashable, Iterable, List, Optional, Tuple
+
+
+class ResidentCache:
+    """
+    常驻对象（已加载的数据库、模型）的 LRU，按估算的内存占用控制总量。
+    超出预算时从最久未使用的开始淘汰，正在使用的 key（protect）不会被淘汰。
+    被淘汰的对象如果有 close() 会被调用，并记录淘汰原因；
+    这个模块自己不打印，需要日志的调用方传入 on_evict(key, 字节数, 原因)。
+    """
+    def __init__(self, budget_bytes: int, on_evict: Optional[Callable[[Hashable, int, str], None]] = None):
+        self.budget_bytes = budget_bytes
+        self.on_evict = on_evict
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[Hashable, Tuple[object, int]]" = OrderedDict()
+        self.evictions: deque = deque(maxlen=50)  # (时间, key, 字节数, 原因)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._entries.values())
+
+    def get(self, key: Hashable):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value, nbytes: int, protect: Iterable[Hashable] = ()):
+        with self._lock:
+            if key in self._entries:
+                self.pop(key, "replaced")
+            self._entries[key] = (value, nbytes)
+            self.trim(protect=set(protect) | {key})
+
+    def pop(self, key: Hashable, reason: str):
+        with self._lock:
+            item = self._entries.pop(key, None)
+        if item is None:
+            return
+        value, nbytes = item
+        self.evictions.append((time.time(), key, nbytes, reason))
+        if self.on_evict is not None:
+            self.on_evict(key, nbytes, reason)
+        close = getattr(value, "close", None)
+        if close is not None:
+            close()
+
+    def trim(self, protect: Iterable[Hashable] = ()):
+        """淘汰到预算以内；预算改小后也可以手动调用"""
+        protect = set(protect)
+        with self._lock:
+            while self.total_bytes > self.budget_bytes:
+                victim = next((k for k in self._entries if k not in protect), None)
+                if victim is None:
+                    break
+                over = f"resident {self.total_bytes / 2**20:.0f} MB > budget {self.budget_bytes / 2**20:.0f} MB"
+                self.pop(victim, f"least recently used, {over}")
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "budget_mb": self.budget_bytes / 2**20,
+                "resident_mb": self.total_bytes / 2**20,
+                "entries": [(k, nbytes / 2**20) for k, (_, nbytes) in self._entries.items()],
+                "recent_evictions": [(k, nbytes / 2**20, reason) for _, k, nbytes, reason in self.evictions],
+            }
@@ -1,81 +1,432 @@
 from pathlib import Path
+import os
 import json
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import torch
 import faiss
 import numpy as np
 from PIL import Image
-import clip
 
-import sys
+
+import fast_preprocess
+import inference
+import regions
+import stickers_db
+import timing
+from encoders import BACKENDS, backend_label, load_encoder
+from names_store import NameStore
+from paths import get_project_root
+from fingerprint import image_fingerprint
+from query_cache import QueryCache
+from resident import ResidentCache
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+QUERY_BATCH_SIZE = 32
+MEMORY_BUDGET_MB = 4096  # 常驻数据库和模型的总内存预算
+# 跨库搜索时并行查询分片的线程数（faiss 搜索期间释放 GIL）
+SHARD_WORKERS = max(1, min(4, os.cpu_count() or 1))
+# 图像编码器后端：eager / torchscript / onnx，INT8 为动态 int8 量化（见 encoders.py）
+BACKEND = "eager"
+INT8 = False
+
+# 查询可以是文件路径、PIL 图片或 HxW(x3) 的 uint8 数组
+Query = Union[str, Path, Image.Image, np.ndarray]
 
 MODEL = None
 PREPROCESS = None
 CURRENT_MODEL_NAME = None
 INDEX = None
-NAMES: List[str] = []
-
-def get_project_root() -> Path:
-    if getattr(sys, "frozen", False):
-        return Path(sys.executable).resolve().parent
-    return Path(__file__).resolve().parent
-
-def load_resources(db_dir: Path):
-    global MODEL, PREPROCESS, INDEX, NAMES, CURRENT_MODEL_NAME
-    
-    index_path = db_dir / "stickers.faiss"
-    with open(index_path, "rb") as f:
-        INDEX = faiss.deserialize_index(np.frombuffer(f.read(), dtype=np.uint8))
-
-    # 根据索引维度自动选择模型
-    dim = INDEX.d
-    if dim == 768:
-        model_name = "ViT-L/14"
-    elif dim == 512:
-        model_name = "ViT-B/32"
-    else:
-        # 默认回退
-        model_name = "ViT-B/32"
-        print(f"Warning: Unknown index dimension {dim}, defaulting to ViT-B/32")
-
-    if MODEL is None or PREPROCESS is None or CURRENT_MODEL_NAME != model_name:
-        print(f"[search] Loading model {model_name} on {DEVICE} (Index dim: {dim})...")
-        model_dir = get_project_root() / "models"
-        import os
-        os.makedirs(model_dir, exist_ok=True)
-        MODEL, PREPROCESS = clip.load(model_name, device=DEVICE, download_root=str(model_dir))
-        MODEL.eval()
-        CURRENT_MODEL_NAME = model_name
-
-    names_path = db_dir / "stickers.json"
-    with open(names_path, "r", encoding="utf-8") as f:
-        NAMES = json.load(f)
+INDEX_META: dict = {}
+SEARCH_PARAMS: dict = {}  # 当前生效的搜索参数（nprobe / efSearch / rerank）
+CURRENT_DB = None
+NAMES = []  # 按向量 ID 存放的 NameStore（旧库为 list），增量建库删除的 ID 为 None
+QUERY_CACHE = QueryCache()  # 指纹 -> 特征/结果，反复复制同一张贴纸时跳过 CLIP 前向
+
+def load_meta(db_dir: Path) -> dict:
+    meta_path = db_dir / "stickers.meta.json"
+    if not meta_path.exists():
+        return {}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _apply_search_params(index, meta: dict, applied: dict, nprobe: Optional[int], ef_search: Optional[int],
+                         rerank: Optional[int] = None):
+    index_type = meta.get("index_type", "flat")
+    space = faiss.ParameterSpace()
+    if nprobe is not None and index_type in ("ivf_flat", "ivf_pq"):
+        space.set_index_parameter(index, "nprobe", int(nprobe))
+        applied["nprobe"] = int(nprobe)
+    if ef_search is not None and index_type == "hnsw":
+        space.set_index_parameter(index, "efSearch", int(ef_search))
+        applied["efSearch"] = int(ef_search)
+    if rerank is not None and index_type == "pca_refine":
+        # 精排倍数和 topk 有关，搜索时由 _search_index 换算
+        applied["rerank"] = int(rerank)
+
+def set_search_params(nprobe: Optional[int] = None, ef_search: Optional[int] = None, rerank: Optional[int] = None):
+    """
+    调整当前索引的搜索参数，IVF 用 nprobe，HNSW 用 efSearch，
+    两阶段索引（pca_refine）用 rerank（粗排候选数 N），其余类型忽略
+    """
+    _apply_search_params(INDEX, INDEX_META, SEARCH_PARAMS, nprobe, ef_search, rerank)
+
+def _search_index(index, params: dict, feats: np.ndarray, k: int):
+    """两阶段索引每次按 k 换算精排倍数：粗排取 rerank 个候选，再用原始向量精确重排"""
+    rerank = params.get("rerank")
+    if rerank:
+        faiss.ParameterSpace().set_index_parameter(index, "k_factor_rf", max(1.0, rerank / k))
+    return index.search(feats, k)
+
+def load_names(db_dir: Path):
+    names_path = db_dir / "stickers.names"
+    if names_path.exists():
+        return NameStore(names_path)
+    with open(db_dir / "stickers.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _file_signature(db_dir: Path) -> tuple:
+    sig = []
+    for fn in (stickers_db.DB_NAME, "stickers.faiss", "stickers.names", "stickers.json", "stickers.meta.json"):
+        try:
+            st = (db_dir / fn).stat()
+            sig.append((fn, st.st_mtime_ns, st.st_size))
+        except OSError:
+            pass
+    return tuple(sig)
+
+class LoadedDatabase:
+    """
+    一个已加载的数据库：索引、名称表、元数据和它自己的搜索参数。
+    优先打开单文件的 stickers.db（模型、索引类型等都在文件头里），没有时读旧布局
+    """
+    def __init__(self, db_dir: Path):
+        self.db_dir = db_dir
+        self.signature = _file_signature(db_dir)
+        db = stickers_db.open_database(db_dir)
+        if db is not None:
+            self.index = db.read_index()
+            self.meta = db.meta
+            self.names = db.open_names()
+            self.model_name = db.model_name
+        else:
+            self.index = stickers_db.read_index(db_dir / "stickers.faiss")
+            self.meta = load_meta(db_dir)
+            self.names = load_names(db_dir)
+            # 优先使用建库时记录的模型，旧库根据索引维度自动选择
+            self.model_name = self.meta.get("model_name") or stickers_db.guess_model_name(self.index.d)
+        self.search_params: dict = {}
+        # 估算常驻内存：mmap 的部分也按文件大小计入，访问后会进入页缓存
+        self.nbytes = sum(size for _, _, size in self.signature)
+
+    def ensure_search_params(self):
+        """还没设置过搜索参数时使用建库时记录的默认值"""
+        if not self.search_params:
+            params = self.meta.get("params", {})
+            _apply_search_params(self.index, self.meta, self.search_params,
+                                 params.get("nprobe"), params.get("efSearch"), params.get("rerank"))
+
+    def close(self):
+        if isinstance(self.names, NameStore):
+            self.names.close()
+        self.index = None
+        self.names = []
+
+class LoadedModel:
+    def __init__(self, model_name: str, backend: str = "eager", int8: bool = False):
+        print(f"[search] Loading model {model_name} ({backend_label(backend, int8)}) on {DEVICE}...")
+        self.model = load_encoder(model_name, DEVICE, backend, int8, get_project_root() / "models")
+        self.preprocess = self.model.preprocess
+        self.nbytes = self.model.nbytes
+        # 单张查询的线程数 / bf16 / channels_last，第一次在这台机器上用这个模型时跑微基准选出；
+        # 线程数在每次编码时由 inference.workload 设置（见 _encode_with）
+        inference.apply(self.model, inference.tune(self.model, model_name, "query", get_project_root() / "models"))
+
+def _log_eviction(key: tuple, nbytes: int, reason: str):
+    print(f"[search] Evicted {key[0]} {key[1]} ({nbytes / 2**20:.1f} MB): {reason}")
+
+# 最近用过的数据库和模型常驻内存，切回时不用重新读盘/加载模型
+RESIDENT = ResidentCache(MEMORY_BUDGET_MB << 20, on_evict=_log_eviction)
+
+def set_memory_budget(mb: int):
+    RESIDENT.budget_bytes = mb << 20
+    RESIDENT.trim(protect=_active_keys())
+
+def resident_stats() -> dict:
+    return RESIDENT.stats()
+
+def _db_key(db_dir: Path) -> tuple:
+    return ("db", str(Path(db_dir).resolve()))
+
+def _model_key(model_name: str) -> tuple:
+    return ("model", f"{model_name} ({backend_label(BACKEND, INT8)})")
+
+def _active_keys() -> set:
+    keys = set()
+    if CURRENT_DB is not None:
+        keys.add(_db_key(CURRENT_DB.db_dir))
+    if CURRENT_MODEL_NAME is not None:
+        keys.add(_model_key(CURRENT_MODEL_NAME))
+    return keys
+
+def get_database(db_dir: Path, protect: Sequence[tuple] = ()) -> LoadedDatabase:
+    """取常驻的数据库，不在缓存里或磁盘上的文件已经变了就重新加载"""
+    key = _db_key(db_dir)
+    db = RESIDENT.get(key)
+    stale_current = False
+    if db is not None and db.signature != _file_signature(db_dir):
+        stale_current = db is CURRENT_DB
+        RESIDENT.pop(key, "files changed on disk")
+        db = None
+    if db is None:
+        db = LoadedDatabase(db_dir)
+        RESIDENT.put(key, db, db.nbytes, protect=_active_keys() | set(protect))
+    if stale_current:
+        # 淘汰时关闭了 INDEX/NAMES 指向的名称表：把全局变量换绑到新加载的库，保留已调的搜索参数
+        load_resources(db_dir, SEARCH_PARAMS.get("nprobe"), SEARCH_PARAMS.get("efSearch"),
+                       SEARCH_PARAMS.get("rerank"))
+    return db
+
+def get_model(model_name: str, protect: Sequence[tuple] = ()) -> LoadedModel:
+    key = _model_key(model_name)
+    model = RESIDENT.get(key)
+    if model is None:
+        model = LoadedModel(model_name, BACKEND, INT8)
+        RESIDENT.put(key, model, model.nbytes, protect=_active_keys() | set(protect))
+    return model
+
+def set_backend(backend: str, int8: bool = False):
+    """
+    切换图像编码器后端。导出的模型缓存在 models/ 下，第一次使用时自动导出；
+    不同后端的特征有细微差别，查询缓存随之清空
+    """
+    global BACKEND, INT8, MODEL, PREPROCESS, CURRENT_MODEL_NAME
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if backend == "eager" and int8:
+        raise ValueError("int8 quantization requires the torchscript or onnx backend")
+    if (backend, int8) == (BACKEND, INT8):
+        return
+    BACKEND, INT8 = backend, int8
+    MODEL = PREPROCESS = CURRENT_MODEL_NAME = None
+    QUERY_CACHE.clear()
+    if CURRENT_DB is not None:
+        load_resources(CURRENT_DB.db_dir)
+
+def release_resources(db_dir: Optional[Path] = None):
+    """
+    释放当前索引和名称表；给出 db_dir 时同时把这个库移出常驻缓存（关闭 mmap），
+    重建数据库前需要调用，否则 Windows 上无法覆盖映射中的文件
+    """
+    global INDEX, NAMES, CURRENT_DB
+    if db_dir is not None:
+        if CURRENT_DB is not None and _db_key(CURRENT_DB.db_dir) == _db_key(db_dir):
+            CURRENT_DB = None
+        RESIDENT.pop(_db_key(db_dir), "released for rebuild")
+    if CURRENT_DB is None:
+        INDEX = None
+        NAMES = []
+
+def load_resources(db_dir: Path, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                   rerank: Optional[int] = None):
+    global MODEL, PREPROCESS, INDEX, NAMES, CURRENT_MODEL_NAME, INDEX_META, SEARCH_PARAMS, CURRENT_DB
+
+    db = get_database(db_dir)
+    CURRENT_DB = db
+    INDEX, NAMES, INDEX_META, SEARCH_PARAMS = db.index, db.names, db.meta, db.search_params
+    params = INDEX_META.get("params", {})
+    if nprobe is not None or ef_search is not None or rerank is not None or not SEARCH_PARAMS:
+        set_search_params(nprobe if nprobe is not None else params.get("nprobe"),
+                          ef_search if ef_search is not None else params.get("efSearch"),
+                          rerank if rerank is not None else params.get("rerank"))
+
+    if MODEL is None or PREPROCESS is None or CURRENT_MODEL_NAME != db.model_name:
+        loaded = get_model(db.model_name)
+        MODEL, PREPROCESS = loaded.model, loaded.preprocess
+        CURRENT_MODEL_NAME = db.model_name
+    # 切换后上一个库不再受保护，超预算时可以淘汰
+    RESIDENT.trim(protect=_active_keys())
+    print(f"[search] Using {db_dir} (dim: {INDEX.d}, type: {INDEX_META.get('index_type', 'flat')} "
+          f"{SEARCH_PARAMS}, model: {CURRENT_MODEL_NAME} {backend_label(BACKEND, INT8)})")
+
+def _as_image(query: Query, model=None) -> Image.Image:
+    """给出 model 时文件路径按它的快速预处理打开（JPEG 缩小解码）；多区域识别需要原始分辨率，不传"""
+    if isinstance(query, Image.Image):
+        return query
+    if isinstance(query, np.ndarray):
+        return Image.fromarray(query)
+    fast = fast_preprocess.for_encoder(model)
+    return fast.open(query) if fast is not None else Image.open(query)
+
+def _encode_with(model, preprocess, imgs: Sequence[Image.Image]):
+    fast = fast_preprocess.for_encoder(model)
+    with timing.stage("preprocess"):
+        if fast is not None:
+            x = fast.collate([fast(img) for img in imgs])
+        else:
+            x = torch.stack([preprocess(img.convert("RGB")) for img in imgs])
+    with timing.stage("encode"), inference.workload(getattr(model, "inference_settings", None)):
+        feats = model.encode_image(x)
+        feats = feats / feats.norm(dim=1, keepdim=True)
+        return feats.cpu().numpy().astype("float32")
+
+def encode_images(imgs: Sequence[Image.Image]):
+    """一次前向编码多张图片，返回 (n, dim) 的归一化特征"""
+    return _encode_with(MODEL, PREPROCESS, imgs)
 
 def encode_image(img: Image.Image):
-    x = PREPROCESS(img.convert("RGB")).unsqueeze(0).to(DEVICE)
-    with torch.no_grad():
-        feats = MODEL.encode_image(x)
-    feats = feats / feats.norm(dim=1, keepdim=True)
-    return feats.cpu().numpy().astype("float32")
+    return encode_images([img])
+
+def warm_up():
+    """用一张空白图跑一次前向，把首次推理的开销（内存分配、算子初始化）提前付掉"""
+    if MODEL is not None:
+        encode_images([Image.new("RGB", (64, 64))])
+
+def _to_results(distances, indices, names=None) -> List[Tuple[str, float]]:
+    names = NAMES if names is None else names
+    results = [(names[idx], 1.0/(1.0+float(d))) for d, idx in zip(distances, indices)
+               if idx >= 0 and names[idx] is not None]
+    results.sort(key=lambda x: x[1], reverse=True)
+    return results
 
 def switch_database(db_dir: Path):
-    """安全切换到新数据库，重新加载索引和名称"""
-    global INDEX, NAMES
-    INDEX = None
-    NAMES = []
+    """切换数据库：最近用过的库和模型直接从常驻缓存取，不重新读盘"""
+    QUERY_CACHE.clear_results()
     load_resources(db_dir)
 
 
-def find_sticker(image_path: str, db_dir: Path, topk: int = 5) -> List[Tuple[str, float]]:
+def find_sticker(query: Query, db_dir: Path, topk: int = 5, fingerprint: Optional[str] = None,
+                 use_cache: bool = True) -> List[Tuple[str, float]]:
+    """
+    query 可以直接传 PIL 图片或像素数组，剪贴板图片不需要先落盘。
+    fingerprint 为调用方已经算好的 image_fingerprint，用于查询缓存
+    """
     if INDEX is None or not NAMES:
         load_resources(db_dir)
-    img = Image.open(image_path)
-    feats = encode_image(img)
-    k = min(topk, len(NAMES))
-    distances, indices = INDEX.search(feats, k)
-    results = [(NAMES[idx], 1.0/(1.0+float(d))) for d, idx in zip(distances[0], indices[0])]
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results
+    with timing.stage("query"):
+        img = _as_image(query, MODEL)
+        feats = None
+        if use_cache:
+            if fingerprint is None:
+                with timing.stage("fingerprint"):
+                    fingerprint = image_fingerprint(img)
+            key, scope = (CURRENT_MODEL_NAME, fingerprint), _results_scope()
+            feats, results = QUERY_CACHE.lookup(key, topk, scope)
+            if results is not None:
+                return results
+        if feats is None:
+            feats = encode_image(img)
+        k = min(topk, INDEX.ntotal)
+        with timing.stage("search"):
+            distances, indices = _search_index(INDEX, SEARCH_PARAMS, feats, k)
+            results = _to_results(distances[0], indices[0])
+        if use_cache:
+            QUERY_CACHE.put(key, feats, topk, results, scope)
+        return results
+
+def _results_scope() -> tuple:
+    """缓存结果的有效范围：当前库、它加载时的文件签名和搜索参数，库被重建或调了参数后旧结果不再命中"""
+    if CURRENT_DB is None:
+        return ()
+    return (str(CURRENT_DB.db_dir), CURRENT_DB.signature, tuple(sorted(SEARCH_PARAMS.items())))
+
+def cache_stats() -> dict:
+    return QUERY_CACHE.stats()
+
+def find_stickers_batch(queries: Sequence[Query], db_dir: Path, topk: int = 5,
+                        batch_size: int = QUERY_BATCH_SIZE) -> List[List[Tuple[str, float]]]:
+    """
+    批量识别：每 batch_size 张图做一次 encode 和一次 INDEX.search，
+    返回与 queries 一一对应的 (名称, 分数) 列表
+    """
+    if INDEX is None or not NAMES:
+        load_resources(db_dir)
+    k = min(topk, INDEX.ntotal)
+    all_results: List[List[Tuple[str, float]]] = []
+    for i in range(0, len(queries), batch_size):
+        feats = encode_images([_as_image(q, MODEL) for q in queries[i:i+batch_size]])
+        with timing.stage("search"):
+            distances, indices = _search_index(INDEX, SEARCH_PARAMS, feats, k)
+            all_results.extend(_to_results(d, idx) for d, idx in zip(distances, indices))
+    return all_results
+
+def find_sticker_regions(query: Query, db_dir: Path, topk: int = 5, mode: str = "components",
+                         max_regions: int = regions.MAX_REGIONS
+                         ) -> List[Tuple[regions.Box, List[Tuple[str, float]]]]:
+    """
+    多区域识别：截图按 regions.propose_regions 切成候选区域，所有裁剪图按 QUERY_BATCH_SIZE 分批编码
+    （区域数不超过一批时就是一次前向），再做一次 INDEX.search。
+    返回每个区域的 (框, topk 结果)，第一个区域是整张图
+    """
+    if INDEX is None or not NAMES:
+        load_resources(db_dir)
+    with timing.stage("query_regions"):
+        img = _as_image(query)
+        with timing.stage("regions"):
+            boxes = regions.propose_regions(img, mode, max_regions)
+        crops = regions.crop_regions(img, boxes)
+        feats = np.concatenate([encode_images(crops[i:i+QUERY_BATCH_SIZE])
+                                for i in range(0, len(crops), QUERY_BATCH_SIZE)])
+        k = min(topk, INDEX.ntotal)
+        with timing.stage("search"):
+            distances, indices = _search_index(INDEX, SEARCH_PARAMS, feats, k)
+        return [(box, _to_results(d, idx)) for box, d, idx in zip(boxes, distances, indices)]
+
+def list_databases(db_root: Optional[Path] = None) -> List[Path]:
+    """databases/ 下所有已建好的库"""
+    db_root = db_root or get_project_root() / "databases"
+    if not db_root.exists():
+        return []
+    return sorted(d for d in db_root.iterdir() if stickers_db.database_exists(d))
+
+_SHARD_POOL: Optional[ThreadPoolExecutor] = None
+
+def _search_shard(db: LoadedDatabase, feats, topk: int) -> List[Tuple[str, float, str]]:
+    k = min(topk, db.index.ntotal)
+    if k <= 0:
+        return []
+    distances, indices = _search_index(db.index, db.search_params, feats, k)
+    return [(name, score, db.db_dir.name) for name, score in _to_results(distances[0], indices[0], db.names)]
+
+def find_sticker_all(query: Query, topk: int = 5,
+                     db_dirs: Optional[Sequence[Path]] = None) -> List[Tuple[str, float, str]]:
+    """
+    跨库搜索：databases/ 下每个库作为一个分片，同一模型的库只编码一次查询图，
+    各分片在线程池里并行搜索，合并成全局 topk，结果为 (名称, 分数, 库名)。
+    不同模型的库分数都来自归一化特征的 L2 距离，可以直接比较但不完全等价
+    """
+    global _SHARD_POOL
+    db_dirs = list(db_dirs) if db_dirs is not None else list_databases()
+    if not db_dirs:
+        return []
+    shard_keys = [_db_key(d) for d in db_dirs]
+    with timing.stage("query_all"):
+        img = _as_image(query)
+        dbs = [get_database(d, protect=shard_keys) for d in db_dirs]
+        by_model: Dict[str, List[LoadedDatabase]] = {}
+        for db in dbs:
+            db.ensure_search_params()
+            by_model.setdefault(db.model_name, []).append(db)
+
+        if _SHARD_POOL is None:
+            _SHARD_POOL = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+        futures = []
+        for model_name, shards in by_model.items():
+            loaded = get_model(model_name, protect=shard_keys)
+            feats = _encode_with(loaded.model, loaded.preprocess, [img])
+            futures.extend(_SHARD_POOL.submit(_search_shard, db, feats, topk) for db in shards)
+        with timing.stage("search"):
+            merged = [r for f in futures for r in f.result()]
+    # 查询结束后这些库不再受保护，超预算时按 LRU 淘汰
+    RESIDENT.trim(protect=_active_keys())
+    merged.sort(key=lambda x: x[1], reverse=True)
+    return merged[:topk]
+
+def timing_stats() -> dict:
+    """各阶段（grab / fingerprint / preprocess / encode / search / query / show_result ...）的滚动延迟统计"""
+    return timing.stats()
+
+def set_timing(enabled: Optional[bool] = None, log: Optional[bool] = None):
+    """开关分阶段计时；log=True 时每次记录打印一行 JSON"""
+    timing.configure(enabled, log)
@@ -0,0 +1,284 @@
+"""
+无界面的本地识别服务：模型和索引只在这个进程里加载一次，
+并发请求在 max_wait 毫秒内攒成一个批次，一次 encode + 一次 INDEX.search。
+
+    python server.py --db 我的贴纸库 --port 8765
+    curl --data-binary @a.png "http://127.0.0.1:8765/search?topk=5"
+    curl http://127.0.0.1:8765/stats
+    curl --data-binary @chat.png "http://127.0.0.1:8765/search?regions=components"  # 一张截图里的多个贴纸
+
+Linux/macOS 上也可以用 --unix /tmp/sticker.sock 监听 Unix socket：
+    curl --unix-socket /tmp/sticker.sock --data-binary @a.png http://localhost/search
+"""
+import io
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import socketserver
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+import groups
+import search
+import stickers_db
+from regions import REGION_MODES
+
+
+class MicroBatcher:
+    """
+    请求队列 + 单个推理线程。拿到第一个请求后最多再等 max_wait_ms 或攒够 max_batch 个，
+    按数据库分组后调用 find_stickers_batch。模型和索引只在推理线程里使用，不需要加锁。
+    """
+    def __init__(self, max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self._done_times: deque = deque(maxlen=10000)
+        self._latencies: deque = deque(maxlen=1000)
+        self._batch_sizes: deque = deque(maxlen=1000)
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, db_dir: Path, img: Image.Image, topk: int, regions: Optional[str] = None) -> Future:
+        """regions 为切分方式（见 regions.py）时结果是 [(框, [(名称, 分数), ...]), ...]"""
+        future: Future = Future()
+        self._queue.put((db_dir, img, topk, future, time.perf_counter(), regions))
+        return future
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            by_db = {}
+            for item in batch:
+                by_db.setdefault(item[0], []).append(item)
+            for db_dir, items in by_db.items():
+                self._run_group(db_dir, items)
+            with self._lock:
+                self.batches += 1
+                self._batch_sizes.append(len(batch))
+
+    def _run_group(self, db_dir: Path, items: list):
+        try:
+            if search.CURRENT_DB is None or search.CURRENT_DB.db_dir != db_dir:
+                search.switch_database(db_dir)
+            results = [None] * len(items)
+            plain = [i for i, item in enumerate(items) if item[5] is None]
+            if plain:
+                topk = max(items[i][2] for i in plain)
+                batch = search.find_stickers_batch([items[i][1] for i in plain], db_dir, topk=topk,
+                                                   batch_size=self.max_batch)
+                for i, res in zip(plain, batch):
+                    results[i] = res[:items[i][2]]
+            # 多区域查询本身就是一批裁剪图，单独做
+            for i, item in enumerate(items):
+                if item[5] is not None:
+                    results[i] = search.find_sticker_regions(item[1], db_dir, topk=item[2], mode=item[5])
+        except Exception as e:
+            with self._lock:
+                self.errors += len(items)
+            for item in items:
+                item[3].set_exception(e)
+            return
+        now = time.perf_counter()
+        with self._lock:
+            for item, res in zip(items, results):
+                self.requests += 1
+                self._done_times.append(now)
+                self._latencies.append(now - item[4])
+        for item, res in zip(items, results):
+            item[3].set_result(res)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.perf_counter()
+            recent = sum(1 for t in self._done_times if now - t <= 10.0)
+            latencies = sorted(self._latencies)
+            sizes = list(self._batch_sizes)
+
+            def pct(p):
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+            return {
+                "uptime_s": time.time() - self._started,
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": self.batches,
+                "queue_depth": self._queue.qsize(),
+                "throughput_qps_10s": recent / 10.0,
+                "avg_batch_size": sum(sizes) / len(sizes) if sizes else 0.0,
+                "max_batch_size": max(sizes) if sizes else 0,
+                "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+def resolve_db(name: str) -> Path:
+    """只允许 databases/ 下的库名，防止路径穿越"""
+    if not name or Path(name).name != name or name in (".", ".."):
+        raise ValueError(f"Invalid database name: {name!r}")
+    db_dir = search.get_project_root() / "databases" / name
+    if not stickers_db.database_exists(db_dir):
+        raise ValueError(f"Database not found: {name}")
+    return db_dir
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    server_version = "StickerSearch/1.0"
+    batcher: MicroBatcher = None
+    default_db: str = None
+
+    def _send_json(self, code: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"ok": True})
+        elif path == "/stats":
+            self._send_json(200, {
+                "server": self.batcher.stats(),
+                "query_cache": search.cache_stats(),
+                "resident": search.resident_stats(),
+                "stages": search.timing_stats(),
+            })
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/search":
+            self._send_json(404, {"error": "not found"})
+            return
+        query = parse_qs(url.query)
+        try:
+            db_dir = resolve_db(query.get("db", [self.default_db])[0])
+            topk = query.get("topk", ["5"])[0]
+            if not topk.isdigit() or int(topk) < 1:
+                raise ValueError(f"topk must be a positive integer, got {topk!r}")
+            topk = int(topk)
+            region_mode = query.get("regions", [None])[0]
+            if region_mode is not None and region_mode not in REGION_MODES:
+                raise ValueError(f"Unknown region mode: {region_mode}")
+            length = int(self.headers.get("Content-Length", 0))
+            # 解码在各自的请求线程里完成，推理线程只做 encode + search
+            img = Image.open(io.BytesIO(self.rfile.read(length)))
+            img.load()
+        except Exception as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        try:
+            results = self.batcher.submit(db_dir, img, topk, region_mode).result()
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        if region_mode is not None:
+            self._send_json(200, {"regions": [{"box": list(box), "results": [[name, score] for name, score in res]}
+                                              for box, res in results]})
+            return
+        # 索引里只有组代表，同组的其它名字（重复/近似重复）放在 members 里
+        members = {name: groups.members(db_dir, name) for name, _ in results}
+        self._send_json(200, {"results": [[name, score] for name, score in results],
+                              "members": {name: m for name, m in members.items() if m}})
+
+    def address_string(self):
+        # Unix socket 的 client_address 是空字符串
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHTTPServer(ThreadingHTTPServer):
+    # 默认 listen backlog 只有 5，并发客户端多时会被直接重置连接
+    request_queue_size = 128
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地贴纸识别服务（HTTP / Unix socket）")
+    parser.add_argument("--db", required=True, help="默认数据库名（databases/ 下的目录名）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="改为监听这个 Unix socket 路径")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--backend", default="eager", choices=search.BACKENDS, help="图像编码器后端")
+    parser.add_argument("--int8", action="store_true", help="动态 int8 量化（torchscript/onnx）")
+    args = parser.parse_args()
+
+    db_dir = resolve_db(args.db)
+    search.set_backend(args.backend, args.int8)
+    search.switch_database(db_dir)
+
+    SearchHandler.batcher = MicroBatcher(args.max_batch, args.max_wait_ms)
+    SearchHandler.default_db = args.db
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        httpd = UnixHTTPServer(args.unix, SearchHandler)
+        print(f"[server] Listening on unix:{args.unix}")
+    else:
+        httpd = LocalHTTPServer((args.host, args.port), SearchHandler)
+        print(f"[server] Listening on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        SearchHandler.batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+单文件数据库 stickers.db：索引、名称表和元数据放在一个带版本号的容器里，整体原子替换，
+不会出现 stickers.faiss 和名称表一新一旧的情况。
+
+    faiss 序列化的索引（从偏移 0 开始，faiss 可以直接 mmap 这个文件）
+    名称段（与 stickers.names 相同：b"STKNAME1" | 条数 | 偏移表 | UTF-8 数据）
+    元数据段（UTF-8 JSON：format_version / model_name / metric / index_type / params / dim / count ...）
+    64 字节尾部：b"STKDBEND" | uint32 版本 | uint32 维度 | uint64 条数 | uint64 索引长度 |
+                 uint64 名称段偏移 | uint64 名称段长度 | uint64 元数据偏移 | uint32 元数据长度 | uint32 CRC32
+
+尾部放在文件末尾（类似 zip / parquet），打开时只读尾部和几 KB 的元数据，名称段 mmap，
+与库大小无关；CRC32 覆盖前三段，打开时只核对文件长度，完整校验用 verify。
+写入时先写 stickers.db.tmp、fsync，再 os.replace。
+
+    python stickers_db.py convert 我的贴纸库     # 旧的 stickers.faiss + stickers.json/names 转成 stickers.db
+    python stickers_db.py convert --all
+    python stickers_db.py info 我的贴纸库
+    python stickers_db.py verify 我的贴纸库
+"""
+import os
+import sys
+import json
+import zlib
+import struct
+import argparse
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from names_store import NameStore, encode_names
+from paths import get_project_root
+
+DB_NAME = "stickers.db"
+FORMAT_VERSION = 1
+MAGIC = b"STKDBEND"
+# 旧布局的文件，转换后删除
+LEGACY_FILES = ("stickers.faiss", "stickers.json", "stickers.names")
+_FOOTER = struct.Struct("<8sIIQQQQQII")
+# IndexFlatCodes 的向量直接映射文件，不再读进内存复制；老版本 faiss 没有这个标志
+MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+_CHUNK = 1 << 24
+
+
+def metric_name(index) -> str:
+    return "inner_product" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2"
+
+
+def guess_model_name(dim: int) -> str:
+    """没有记录模型的旧库按维度猜：768 为 ViT-L/14，其余按 ViT-B/32"""
+    if dim == 768:
+        return "ViT-L/14"
+    if dim != 512:
+        print(f"Warning: Unknown index dimension {dim}, defaulting to ViT-B/32")
+    return "ViT-B/32"
+
+
+def read_index(path: Path, length: int = -1, mmap: bool = True):
+    """
+    读取从文件开头起 length 字节的索引（-1 为整个文件）。mmap=True 时让 faiss 直接映射文件（搜索端）；
+    faiss 打不开的路径（如 Windows 下的中文路径）和需要修改索引时（增量建库）读入后再反序列化
+    """
+    if mmap:
+        try:
+            return faiss.read_index(str(path), MMAP_FLAG)
+        except RuntimeError:
+            pass
+    with open(path, "rb") as f:
+        return faiss.deserialize_index(np.frombuffer(f.read(length), dtype=np.uint8))
+
+
+def database_exists(db_dir: Path) -> bool:
+    """单文件库或旧布局（stickers.faiss）都算"""
+    return (db_dir / DB_NAME).exists() or (db_dir / "stickers.faiss").exists()
+
+
+def write_database(db_dir: Path, index, names: Sequence[Optional[str]], meta: dict) -> Path:
+    """
+    写出 stickers.db：meta 至少包含 model_name / index_type / params，
+    维度、条数、度量和格式版本由这里补上。写完 fsync 再替换，读取端看到的总是完整的文件
+    """
+    path = db_dir / DB_NAME
+    tmp_path = Path(str(path) + ".tmp")
+    header = {**meta, "format_version": FORMAT_VERSION, "metric": metric_name(index),
+              "dim": int(index.d), "count": int(index.ntotal), "names": len(names)}
+    sections = [faiss.serialize_index(index), encode_names(names),
+                json.dumps(header, ensure_ascii=False).encode("utf-8")]
+    crc = 0
+    with open(tmp_path, "wb") as f:
+        for data in sections:
+            f.write(data)
+            crc = zlib.crc32(data, crc)
+        index_len, names_len, meta_len = (len(data) for data in sections)
+        f.write(_FOOTER.pack(MAGIC, FORMAT_VERSION, int(index.d), int(index.ntotal), index_len,
+                             index_len, names_len, index_len + names_len, meta_len, crc))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def remove_legacy(db_dir: Path):
+    """stickers.db 写好之后删除旧布局的索引和名称表（stickers.meta.json 仍保留给建库端）"""
+    for fn in LEGACY_FILES:
+        try:
+            os.remove(db_dir / fn)
+        except FileNotFoundError:
+            pass
+
+
+class DatabaseFile:
+    """打开 stickers.db：只读尾部和元数据段，索引和名称表按需读取"""
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < _FOOTER.size:
+                raise ValueError(f"Not a sticker database: {self.path}")
+            f.seek(size - _FOOTER.size)
+            (magic, version, self.dim, self.count, self.index_len, self.names_offset, self.names_len,
+             self.meta_offset, meta_len, self.checksum) = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Not a sticker database: {self.path}")
+            if version > FORMAT_VERSION:
+                raise ValueError(f"{self.path} uses format version {version}, this program reads up to "
+                                 f"{FORMAT_VERSION}")
+            self.version = version
+            self.data_len = self.meta_offset + meta_len
+            if self.data_len + _FOOTER.size != size:
+                raise ValueError(f"Truncated or corrupted database: {self.path}")
+            f.seek(self.meta_offset)
+            self.meta = json.loads(f.read(meta_len).decode("utf-8"))
+
+    @property
+    def model_name(self) -> str:
+        return self.meta["model_name"]
+
+    def read_index(self, mmap: bool = True):
+        return read_index(self.path, self.index_len, mmap)
+
+    def open_names(self) -> NameStore:
+        return NameStore(self.path, self.names_offset)
+
+    def verify(self) -> bool:
+        """完整读一遍文件核对 CRC32"""
+        crc = 0
+        with open(self.path, "rb") as f:
+            remaining = self.data_len
+            while remaining:
+                data = f.read(min(_CHUNK, remaining))
+                if not data:
+                    return False
+                crc = zlib.crc32(data, crc)
+                remaining -= len(data)
+        return crc == self.checksum
+
+    def info(self) -> dict:
+        return {"path": str(self.path), "format_version": self.version, "model_name": self.model_name,
+                "metric": self.meta.get("metric"), "index_type": self.meta.get("index_type"),
+                "dim": self.dim, "count": self.count, "names": self.meta.get("names"),
+                "index_bytes": self.index_len, "names_bytes": self.names_len, "checksum": f"{self.checksum:08x}"}
+
+
+def open_database(db_dir: Path) -> Optional[DatabaseFile]:
+    path = db_dir / DB_NAME
+    if not path.exists():
+        return None
+    return DatabaseFile(path)
+
+
+def load_index(db_dir: Path):
+    """读入可修改的索引（不 mmap）：优先 stickers.db，其次旧布局的 stickers.faiss；都没有时返回 None"""
+    db = open_database(db_dir)
+    if db is not None:
+        return db.read_index(mmap=False)
+    index_path = db_dir / "stickers.faiss"
+    if not index_path.exists():
+        return None
+    return read_index(index_path, mmap=False)
+
+
+def _load_legacy_names(db_dir: Path) -> List[Optional[str]]:
+    names_path = db_dir / "stickers.names"
+    if names_path.exists():
+        store = NameStore(names_path)
+        names = list(store)
+        store.close()
+        return names
+    with open(db_dir / "stickers.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def convert(db_dir: Path, remove: bool = True) -> Path:
+    """
+    旧布局转 stickers.db：索引原样搬过去，名称表取 stickers.names（没有时取 stickers.json），
+    元数据取 stickers.meta.json；旧库没有记录模型的，按维度猜一次并写进文件头，之后不再猜
+    """
+    db = open_database(db_dir)
+    if db is not None:
+        print(f"[stickers_db] {db_dir} is already a single-file database")
+        return db.path
+    index = load_index(db_dir)
+    if index is None:
+        raise RuntimeError(f"No index found in {db_dir}.")
+    meta = {}
+    meta_path = db_dir / "stickers.meta.json"
+    if meta_path.exists():
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    meta.setdefault("model_name", guess_model_name(index.d))
+    meta.setdefault("index_type", "flat")
+    meta.setdefault("params", {})
+    path = write_database(db_dir, index, _load_legacy_names(db_dir), meta)
+    if not DatabaseFile(path).verify():
+        raise RuntimeError(f"Checksum mismatch after writing {path}")
+    if remove:
+        remove_legacy(db_dir)
+    print(f"[stickers_db] Converted {db_dir} ({index.ntotal} vectors, {meta['model_name']})")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="单文件数据库 stickers.db 的转换和检查")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="旧布局（stickers.faiss + 名称表）转成 stickers.db")
+    p_convert.add_argument("db_name", nargs="?")
+    p_convert.add_argument("--all", action="store_true", help="转换 databases/ 下所有旧布局的库")
+    p_convert.add_argument("--keep", action="store_true", help="保留旧文件")
+    p_info = sub.add_parser("info", help="显示文件头")
+    p_info.add_argument("db_name")
+    p_verify = sub.add_parser("verify", help="完整校验 CRC32")
+    p_verify.add_argument("db_name")
+    args = parser.parse_args()
+
+    db_root = get_project_root() / "databases"
+    if args.command == "convert":
+        if args.all:
+            targets = sorted(d for d in db_root.iterdir() if (d / "stickers.faiss").exists()) \
+                if db_root.exists() else []
+        elif args.db_name:
+            targets = [db_root / args.db_name]
+        else:
+            parser.error("convert needs a database name or --all")
+        for db_dir in targets:
+            convert(db_dir, remove=not args.keep)
+    else:
+        db = open_database(db_root / args.db_name)
+        if db is None:
+            raise SystemExit(f"No {DB_NAME} in {db_root / args.db_name}")
+        if args.command == "info":
+            print(json.dumps(db.info(), ensure_ascii=False, indent=2))
+        else:
+            ok = db.verify()
+            print(f"{db.path}: {'OK' if ok else 'CHECKSUM MISMATCH'}")
+            sys.exit(0 if ok else 1)
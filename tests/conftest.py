@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# 模块都在仓库根目录，直接导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import build_index  # noqa: E402
+import inference  # noqa: E402
+import search  # noqa: E402
+from fakes import N_IMAGES, SCAN_CHUNK, FakeEncoder, make_corpus  # noqa: E402
+from query_cache import QueryCache  # noqa: E402
+from resident import ResidentCache  # noqa: E402
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """
+    临时的项目根目录和一份合成贴纸（N_IMAGES 张，建库按 SCAN_CHUNK 分轮、每批 4 张）。
+    search 的全局状态（当前库、模型、缓存）每个测试重新开始
+    """
+    src = tmp_path / "src"
+    make_corpus(src, N_IMAGES)
+    for module in (build_index, search):
+        monkeypatch.setattr(module, "get_project_root", lambda: tmp_path)
+    monkeypatch.setattr(build_index, "SCAN_CHUNK", SCAN_CHUNK)
+    monkeypatch.setattr(build_index, "BATCH_SIZE", 4)
+    # AUTOTUNE 在导入 inference 时就读好了环境变量，这里直接关掉微基准
+    monkeypatch.setattr(inference, "AUTOTUNE", False)
+    for name in ("MODEL", "PREPROCESS", "CURRENT_MODEL_NAME", "INDEX", "CURRENT_DB"):
+        monkeypatch.setattr(search, name, None)
+    monkeypatch.setattr(search, "NAMES", [])
+    monkeypatch.setattr(search, "INDEX_META", {})
+    monkeypatch.setattr(search, "SEARCH_PARAMS", {})
+    monkeypatch.setattr(search, "QUERY_CACHE", QueryCache())
+    monkeypatch.setattr(search, "RESIDENT", ResidentCache(search.MEMORY_BUDGET_MB << 20, search._log_eviction))
+    return tmp_path, src
+
+
+@pytest.fixture
+def build(monkeypatch):
+    """build(src, db_name, encoder=None, **kwargs)：用假编码器建库，返回库目录；搜索端也用同一种编码器"""
+    monkeypatch.setattr(search, "load_encoder", lambda *args, **kwargs: FakeEncoder())
+
+    def run(src, db_name, encoder=None, **kwargs):
+        encoder = encoder or FakeEncoder()
+        monkeypatch.setattr(build_index, "load_encoder", lambda *args, **kwargs: encoder)
+        return build_index.build_index_gui(src, db_name, device="cpu", workers=1, prefetch=1, **kwargs)
+    return run
@@ -0,0 +1,47 @@
+"""
+测试用的替身：固定随机投影的编码器和合成贴纸，不需要下载 CLIP
+"""
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from fast_preprocess import BatchPreprocess
+
+# project 夹具里的贴纸张数和建库的扫描轮次：24 张图分成三轮检查点
+N_IMAGES = 24
+SCAN_CHUNK = 8
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeEncoder:
+    """固定种子的随机投影；encode_image 调用 fail_after 次之后抛出 Interrupted，模拟建库中途被杀掉"""
+    device = "cpu"
+    torch_threads = False
+    nbytes = 0
+
+    def __init__(self, fail_after=None):
+        self.batch_preprocess = self.preprocess = BatchPreprocess(16)
+        self.weight = torch.randn(3 * 16 * 16, 32, generator=torch.Generator().manual_seed(0))
+        self.fail_after = fail_after
+        self.encoded = 0
+        self.calls = 0
+
+    def encode_image(self, x):
+        if self.fail_after is not None and self.encoded >= self.fail_after:
+            raise Interrupted()
+        self.encoded += len(x)
+        self.calls += 1
+        return x.flatten(1) @ self.weight
+
+
+def make_corpus(folder: Path, n: int, seed: int = 0):
+    """n 张 40x40 的随机噪声 PNG：s000.png, s001.png, ..."""
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        Image.fromarray(rng.integers(0, 256, (40, 40, 3), dtype=np.uint8)).save(folder / f"s{i:03d}.png")
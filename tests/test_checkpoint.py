@@ -0,0 +1,92 @@
+"""
+建库检查点：中断后续建只编码剩下的文件，结果与一次建完的库相同。编码器换成固定的随机投影，
+不需要下载 CLIP，也不需要界面：
+
+    python -m pytest tests/test_checkpoint.py
+"""
+import json
+
+import numpy as np
+import pytest
+
+import build_index
+import stickers_db
+from embeddings import EmbeddingStore
+from fakes import N_IMAGES, SCAN_CHUNK, FakeEncoder, Interrupted
+from thumbs import ThumbSpill
+
+
+def _vectors(db_dir):
+    db = stickers_db.open_database(db_dir)
+    names = db.open_names()
+    index = db.read_index(mmap=False)
+    try:
+        return {names[i]: index.reconstruct(i) for i in range(len(names)) if names[i] is not None}
+    finally:
+        names.close()
+
+
+def test_resume_after_interrupt(project, build):
+    root, src = project
+    db_dir = root / "databases" / "resume"
+
+    # 第一轮 8 张编码完、写了检查点，第二轮编码到一半被中断
+    with pytest.raises(Interrupted):
+        build(src, "resume", FakeEncoder(fail_after=SCAN_CHUNK + 4))
+    checkpoint = build_index._load_checkpoint(db_dir, "ViT-B/32")
+    assert checkpoint is not None and checkpoint["fresh"]
+    assert len(checkpoint["files"]) == SCAN_CHUNK
+    assert not (db_dir / stickers_db.DB_NAME).exists()
+
+    # 续建只编码剩下的文件，完成后检查点和缩略图暂存文件都删掉
+    encoder = FakeEncoder()
+    build(src, "resume", encoder)
+    assert encoder.encoded == N_IMAGES - SCAN_CHUNK
+    assert not (db_dir / build_index.CHECKPOINT_NAME).exists()
+    assert not (db_dir / build_index.THUMBS_SPILL_NAME).exists()
+    assert stickers_db.open_database(db_dir).verify()
+
+    build(src, "full", FakeEncoder())
+    resumed, full = _vectors(db_dir), _vectors(root / "databases" / "full")
+    assert sorted(resumed) == sorted(full) == [f"s{i:03d}.png" for i in range(N_IMAGES)]
+    for name, vector in full.items():
+        np.testing.assert_allclose(resumed[name], vector, atol=1e-3)
+
+
+def test_partial_checkpoint_line_dropped(tmp_path):
+    # 进程在写最后一行时被杀掉：读回时丢弃半行，保留之前完整的进度
+    EmbeddingStore(tmp_path / "stickers.emb", "ViT-B/32", 32, 3).close()
+    path = tmp_path / build_index.CHECKPOINT_NAME
+    entry = {"sha1": "0", "mtime": 0, "size": 1}
+    build_index._append_checkpoint(path, {"model_name": "ViT-B/32", "fresh": True}, {"a.png": {**entry, "id": 0}}, 1)
+    build_index._append_checkpoint(path, None, {"b.png": {**entry, "id": 1}}, 2)
+    line = json.dumps({"next_id": 3, "files": {"c.png": {**entry, "id": 2}}})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[:len(line) // 2])
+
+    checkpoint = build_index._load_checkpoint(tmp_path, "ViT-B/32")
+    assert sorted(checkpoint["files"]) == ["a.png", "b.png"]
+    assert checkpoint["next_id"] == 2
+    assert build_index._load_checkpoint(tmp_path, "ViT-L/14") is None
+
+
+def test_thumb_spill_drops_partial_record(tmp_path):
+    path = tmp_path / build_index.THUMBS_SPILL_NAME
+    spill = ThumbSpill(path, reset=True)
+    spill.append("a.png", b"x" * 100)
+    spill.append("b.png", b"y" * 50)
+    spill.sync()
+    spill.close()
+    complete = path.stat().st_size
+    with open(path, "ab") as f:
+        f.write(b"\x05\x00\x00\x00\xe8\x03\x00\x00c.png" + b"z" * 10)
+
+    spill = ThumbSpill(path)
+    try:
+        assert len(spill) == 2 and "c.png" not in spill
+        assert spill.read("a.png") == b"x" * 100 and spill.read("b.png") == b"y" * 50
+        assert path.stat().st_size == complete
+        spill.append("c.png", b"z" * 20)
+        assert spill.read("c.png") == b"z" * 20
+    finally:
+        spill.close()
@@ -0,0 +1,57 @@
+"""
+只换索引类型或参数时，增量建库从 stickers.emb 重建索引，不重新编码。
+
+    python -m pytest tests/test_reindex.py
+"""
+import os
+
+import stickers_db
+from fakes import N_IMAGES, FakeEncoder
+
+
+def test_index_type_change_reuses_embeddings(project, build):
+    root, src = project
+    db_dir = build(src, "db")
+    assert stickers_db.open_database(db_dir).meta["index_type"] == "flat"
+
+    encoder = FakeEncoder()
+    build(src, "db", encoder, index_type="hnsw", index_params={"efSearch": 16})
+    meta = stickers_db.open_database(db_dir).meta
+    assert encoder.encoded == 0
+    assert meta["index_type"] == "hnsw" and meta["params"]["efSearch"] == 16
+    assert meta["count"] == N_IMAGES and meta["recall"]
+
+    # 只改参数：沿用 hnsw 和其余参数
+    build(src, "db", encoder, index_params={"efSearch": 32})
+    meta = stickers_db.open_database(db_dir).meta
+    assert encoder.encoded == 0
+    assert meta["index_type"] == "hnsw" and meta["params"]["efSearch"] == 32 and meta["params"]["M"] == 32
+
+
+def test_index_change_with_new_files_encodes_only_them(project, build):
+    root, src = project
+    db_dir = build(src, "db")
+    os.remove(src / "s001.png")
+    (src / "s000.png").rename(src / "renamed.png")
+
+    encoder = FakeEncoder()
+    build(src, "db", encoder, index_type="hnsw")
+    assert encoder.encoded == 0
+    db = stickers_db.open_database(db_dir)
+    names = db.open_names()
+    try:
+        assert sorted(n for n in names if n) == sorted(["renamed.png"] + [f"s{i:03d}.png" for i in range(2, N_IMAGES)])
+    finally:
+        names.close()
+    assert db.count == N_IMAGES - 1
+
+
+def test_index_change_without_embeddings_reencodes(project, build):
+    root, src = project
+    db_dir = build(src, "db")
+    os.remove(db_dir / "stickers.emb")
+
+    encoder = FakeEncoder()
+    build(src, "db", encoder, index_type="hnsw")
+    assert encoder.encoded == N_IMAGES
+    assert stickers_db.open_database(db_dir).meta["index_type"] == "hnsw"
@@ -0,0 +1,30 @@
+"""
+常驻缓存按预算淘汰：受保护的 key 不淘汰，淘汰时调用 close() 并通知调用方，模块本身不打印。
+
+    python -m pytest tests/test_resident.py
+"""
+from resident import ResidentCache
+
+
+class Closable:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_evicts_least_recently_used_and_reports(capsys):
+    evicted = []
+    cache = ResidentCache(100, on_evict=lambda key, nbytes, reason: evicted.append((key, nbytes)))
+    a, b, c = Closable(), Closable(), Closable()
+    cache.put("a", a, 40)
+    cache.put("b", b, 40)
+    cache.get("a")
+    cache.put("c", c, 40)
+    assert cache.keys() == ["a", "c"]
+    assert evicted == [("b", 40)] and b.closed and not a.closed
+
+    cache.budget_bytes = 30
+    cache.trim(protect={"a"})
+    assert cache.keys() == ["a"] and c.closed
+    assert capsys.readouterr().out == ""
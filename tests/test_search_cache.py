@@ -0,0 +1,65 @@
+"""
+查询缓存的结果只对加载时的库文件和搜索参数有效：库被重建、调了搜索参数之后，
+同一张图不能再拿到旧的 topk。
+
+    python -m pytest tests/test_search_cache.py
+"""
+import os
+
+from PIL import Image
+
+import search
+
+
+def _query(src, name):
+    with Image.open(src / name) as img:
+        return img.convert("RGB")
+
+
+def test_rebuild_in_app_invalidates_results(project, build):
+    # 界面里重建：先 release_resources，再建库，下次查询重新加载
+    root, src = project
+    db_dir = build(src, "db")
+    img = _query(src, "s000.png")
+    assert search.find_sticker(img, db_dir)[0][0] == "s000.png"
+
+    search.release_resources(db_dir)
+    os.remove(src / "s000.png")
+    build(src, "db")
+    names = [name for name, _ in search.find_sticker(img, db_dir)]
+    assert "s000.png" not in names
+    assert search.cache_stats()["hits"] == 0 and search.cache_stats()["feature_hits"] == 1
+
+
+def test_rebuild_outside_invalidates_results(project, build):
+    # 命令行在别的进程里重建：跨库搜索发现文件变了，重新加载当前库
+    root, src = project
+    db_dir = build(src, "db")
+    img = _query(src, "s000.png")
+    assert search.find_sticker(img, db_dir)[0][0] == "s000.png"
+    assert search.find_sticker(img, db_dir)[0][0] == "s000.png"
+    assert search.cache_stats()["hits"] == 1
+
+    os.remove(src / "s000.png")
+    build(src, "db")
+    assert search.find_sticker_all(img, db_dirs=[db_dir])[0][0] != "s000.png"
+    names = [name for name, _ in search.find_sticker(img, db_dir)]
+    assert "s000.png" not in names
+    assert search.cache_stats()["hits"] == 1
+
+
+def test_search_params_invalidate_results(project, build):
+    root, src = project
+    db_dir = build(src, "db", index_type="hnsw")
+    img = _query(src, "s003.png")
+    search.find_sticker(img, db_dir)
+    search.find_sticker(img, db_dir)
+    assert search.cache_stats()["hits"] == 1
+
+    search.set_search_params(ef_search=8)
+    assert search.find_sticker(img, db_dir)[0][0] == "s003.png"
+    stats = search.cache_stats()
+    assert (stats["hits"], stats["feature_hits"]) == (1, 1)
+    # 参数没变时新结果照常命中
+    search.find_sticker(img, db_dir)
+    assert search.cache_stats()["hits"] == 2
@@ -0,0 +1,117 @@
+"""
+本地识别服务：/search 的参数校验、库名的路径穿越防护，以及并发请求合成一次 find_stickers_batch。
+编码器用 fakes.FakeEncoder，不需要下载 CLIP：
+
+    python -m pytest tests/test_server.py
+"""
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import search
+import server
+
+
+@pytest.fixture
+def service(project, build, monkeypatch):
+    """在随机端口上起服务，默认库为 db；返回 (base_url, 贴纸源目录, batcher)"""
+    root, src = project
+    db_dir = build(src, "db")
+    search.switch_database(db_dir)
+    batcher = server.MicroBatcher(max_batch=32, max_wait_ms=300)
+    monkeypatch.setattr(server.SearchHandler, "batcher", batcher)
+    monkeypatch.setattr(server.SearchHandler, "default_db", "db")
+    httpd = server.LocalHTTPServer(("127.0.0.1", 0), server.SearchHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", src, batcher
+    httpd.shutdown()
+    httpd.server_close()
+    batcher.stop()
+
+
+def _post(url: str, body: bytes):
+    """返回 (状态码, JSON)"""
+    request = urllib.request.Request(url, data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _png(src, name) -> bytes:
+    return (src / name).read_bytes()
+
+
+@pytest.mark.parametrize("topk", ["0", "-3", "abc", "1.5", "%2B2"])
+def test_bad_topk_is_rejected(service, topk):
+    base, src, _ = service
+    code, payload = _post(f"{base}/search?topk={topk}", _png(src, "s000.png"))
+    assert code == 400 and "topk" in payload["error"]
+
+
+def test_bad_request_body_and_mode(service):
+    base, src, _ = service
+    assert _post(f"{base}/search", b"not an image")[0] == 400
+    assert _post(f"{base}/search?regions=bogus", _png(src, "s000.png"))[0] == 400
+
+
+def test_valid_search(service):
+    base, src, _ = service
+    code, payload = _post(f"{base}/search?topk=2", _png(src, "s004.png"))
+    assert code == 200
+    assert len(payload["results"]) == 2 and payload["results"][0][0] == "s004.png"
+
+
+@pytest.mark.parametrize("name", ["..", ".", "../db", "db/../db", "/etc", "..%2Fsrc", "%2Fetc", "missing"])
+def test_database_name_traversal_is_rejected(service, name):
+    base, src, _ = service
+    code, payload = _post(f"{base}/search?db={name}", _png(src, "s000.png"))
+    assert code == 400
+
+
+def test_resolve_db(project, build):
+    root, src = project
+    build(src, "db")
+    assert server.resolve_db("db") == root / "databases" / "db"
+    # src 在项目根目录下但不在 databases/ 里
+    for name in ("", "..", "../src", "db/..", str(root / "databases" / "db")):
+        with pytest.raises(ValueError):
+            server.resolve_db(name)
+
+
+def test_concurrent_requests_share_one_batch(service, monkeypatch):
+    base, src, batcher = service
+    calls = []
+    find_stickers_batch = search.find_stickers_batch
+
+    def spy(queries, db_dir, topk=5, batch_size=search.QUERY_BATCH_SIZE):
+        calls.append((len(queries), topk))
+        return find_stickers_batch(queries, db_dir, topk=topk, batch_size=batch_size)
+    monkeypatch.setattr(search, "find_stickers_batch", spy)
+
+    names = [f"s{i:03d}.png" for i in range(8)]
+    responses = {}
+    barrier = threading.Barrier(len(names))
+
+    def request(i, name):
+        barrier.wait()
+        responses[name] = _post(f"{base}/search?topk={1 + i % 3}", _png(src, name))
+
+    threads = [threading.Thread(target=request, args=(i, name)) for i, name in enumerate(names)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == [(len(names), 3)]
+    for i, name in enumerate(names):
+        code, payload = responses[name]
+        assert code == 200
+        assert len(payload["results"]) == 1 + i % 3 and payload["results"][0][0] == name
+    stats = batcher.stats()
+    assert (stats["batches"], stats["requests"], stats["max_batch_size"]) == (1, len(names), len(names))
@@ -0,0 +1,74 @@
+"""
+stickers.db 容器的写入 / 打开 / 校验，不需要模型和界面：
+
+    python -m pytest tests/test_stickers_db.py
+"""
+import faiss
+import numpy as np
+import pytest
+
+import stickers_db
+
+NAMES = ["a.png", None, "子文件夹/猫.jpg", "d.gif"]
+
+
+def _write(db_dir, dim=16):
+    vectors = np.random.default_rng(0).standard_normal((len(NAMES), dim)).astype("float32")
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(dim)
+    index.add(vectors)
+    meta = {"model_name": "ViT-B/32", "index_type": "flat", "params": {}}
+    return stickers_db.write_database(db_dir, index, NAMES, meta), vectors
+
+
+def test_round_trip(tmp_path):
+    path, vectors = _write(tmp_path)
+    assert not (tmp_path / "stickers.db.tmp").exists()
+    db = stickers_db.open_database(tmp_path)
+    assert db.path == path
+    assert db.verify()
+    assert (db.version, db.dim, db.count) == (stickers_db.FORMAT_VERSION, 16, len(NAMES))
+    assert db.model_name == "ViT-B/32"
+    assert db.meta["metric"] == "inner_product" and db.meta["names"] == len(NAMES)
+
+    for mmap in (True, False):
+        index = db.read_index(mmap=mmap)
+        assert index.ntotal == len(NAMES)
+        _, ids = index.search(vectors, 1)
+        assert ids[:, 0].tolist() == list(range(len(NAMES)))
+
+    names = db.open_names()
+    try:
+        assert list(names) == NAMES
+        assert names[-2] == "子文件夹/猫.jpg"
+    finally:
+        names.close()
+
+
+def test_truncated_file_rejected(tmp_path):
+    path, _ = _write(tmp_path)
+    data = path.read_bytes()
+    for size in (len(data) - 1, len(data) - stickers_db._FOOTER.size // 2, 10):
+        path.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            stickers_db.open_database(tmp_path)
+
+
+def test_corrupted_byte_fails_verify(tmp_path):
+    path, _ = _write(tmp_path)
+    data = bytearray(path.read_bytes())
+    data[len(data) // 3] ^= 0xFF
+    path.write_bytes(bytes(data))
+    db = stickers_db.open_database(tmp_path)
+    assert not db.verify()
+
+
+def test_newer_format_rejected(tmp_path):
+    path, _ = _write(tmp_path)
+    data = bytearray(path.read_bytes())
+    # 尾部魔数之后紧跟 uint32 版本号
+    offset = len(data) - stickers_db._FOOTER.size + len(stickers_db.MAGIC)
+    data[offset:offset + 4] = (stickers_db.FORMAT_VERSION + 1).to_bytes(4, "little")
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="format version"):
+        stickers_db.open_database(tmp_path)
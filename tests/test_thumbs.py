@@ -0,0 +1,28 @@
+"""
+结果弹窗的缩略图：库被重建后，同一个名字要显示新图，而不是进程内 LRU 里的旧图。
+
+    python -m pytest tests/test_thumbs.py
+"""
+import os
+import shutil
+
+import numpy as np
+
+import gui_result
+
+
+def _pixels(db_dir, name):
+    return np.asarray(gui_result.load_thumbnail(db_dir, name).convert("RGB"))
+
+
+def test_rebuild_replaces_cached_thumbnail(project, build):
+    root, src = project
+    db_dir = build(src, "db")
+    before = _pixels(db_dir, "s000.png")
+
+    shutil.copy(src / "s005.png", src / "s000.png")
+    os.utime(src / "s000.png", ns=(1, 1))
+    build(src, "db")
+    after = _pixels(db_dir, "s000.png")
+    assert not np.array_equal(before, after)
+    assert np.array_equal(after, _pixels(db_dir, "s005.png"))
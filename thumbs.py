@@ -0,0 +1,203 @@
+"""
+结果窗口用的缩略图包 stickers.thumbs，弹窗时不再打开原图：
+
+    8 字节魔数 b"STKTHMB1" | uint64 条数 n | uint32 缩略图边长 | uint32 保留
+    (n+1) 个 uint64 名称偏移 | (n+1) 个 uint64 数据偏移 | 名称 UTF-8 | PNG 数据
+
+条目按名称的 UTF-8 字节排序，读取时整个文件 mmap，按名称二分查找，不需要先建字典。
+
+建库时新生成的缩略图先追加到 ThumbSpill（stickers.thumbs.pending），
+建完再和旧包按名称归并写出新包，内存占用与库大小无关；中断后续建也能复用已生成的部分。
+"""
+import io
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+MAGIC = b"STKTHMB1"
+THUMB_SIZE = 48
+_HEADER = struct.Struct("<8sQII")
+_RECORD = struct.Struct("<II")
+
+
+def make_thumbnail(img: Image.Image, size: int = THUMB_SIZE) -> bytes:
+    """缩到 size x size 以内并编码为 PNG（保留透明通道）"""
+    thumb = img.copy()
+    thumb.thumbnail((size, size))
+    if thumb.mode not in ("RGB", "RGBA", "L", "LA"):
+        thumb = thumb.convert("RGBA")
+    buf = io.BytesIO()
+    thumb.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def write_thumbs(path: Path, names: Sequence[str], sizes: Sequence[int], read: Callable[[str], bytes],
+                 size: int = THUMB_SIZE, release: Optional[Callable[[], None]] = None):
+    """
+    names 须按 UTF-8 字节排序，sizes 为对应的数据长度，数据通过 read(name) 逐条取出写入，
+    不需要把所有缩略图放在内存里。写到临时文件再替换，读取端看到的总是完整的文件；
+    release 在替换前调用，用来关闭还映射着旧文件的 ThumbPack
+    """
+    encoded = [name.encode("utf-8") for name in names]
+    name_offsets = np.zeros(len(names) + 1, dtype="<u8")
+    data_offsets = np.zeros(len(names) + 1, dtype="<u8")
+    if names:
+        np.cumsum([len(n) for n in encoded], out=name_offsets[1:])
+        np.cumsum(sizes, out=data_offsets[1:])
+    tmp_path = Path(str(path) + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(names), size, 0))
+        f.write(name_offsets.tobytes())
+        f.write(data_offsets.tobytes())
+        f.write(b"".join(encoded))
+        for name in names:
+            f.write(read(name))
+    if release is not None:
+        release()
+    os.replace(tmp_path, path)
+
+
+class ThumbPack:
+    """只读缩略图包，get_bytes(name) 返回 PNG 数据，get(name) 返回解码后的小图"""
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, size, _ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a thumbnail pack: {self.path}")
+        self.count = count
+        self.size = size
+        offset = _HEADER.size
+        self._name_offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=offset)
+        offset += (count + 1) * 8
+        self._data_offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=offset)
+        self._names_start = offset + (count + 1) * 8
+        self._data_start = self._names_start + int(self._name_offsets[-1])
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _name(self, i: int) -> bytes:
+        return self._mm[self._names_start + int(self._name_offsets[i]):
+                        self._names_start + int(self._name_offsets[i + 1])]
+
+    def _data(self, i: int) -> bytes:
+        return self._mm[self._data_start + int(self._data_offsets[i]):
+                        self._data_start + int(self._data_offsets[i + 1])]
+
+    def find(self, name: str) -> int:
+        """二分查找名称，返回条目下标，不存在时返回 -1"""
+        key = name.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._name(lo) == key:
+            return lo
+        return -1
+
+    def data_size(self, i: int) -> int:
+        return int(self._data_offsets[i + 1] - self._data_offsets[i])
+
+    def get_bytes(self, name: str) -> Optional[bytes]:
+        i = self.find(name)
+        return self._data(i) if i >= 0 else None
+
+    def get(self, name: str) -> Optional[Image.Image]:
+        data = self.get_bytes(name)
+        if data is None:
+            return None
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for i in range(self.count):
+            yield self._name(i).decode("utf-8"), self._data(i)
+
+    def close(self):
+        # Windows 上映射中的文件不能被替换，重建前需要先关闭
+        self._name_offsets = self._data_offsets = None
+        self._mm.close()
+
+
+def open_pack(path: Path, size: int = THUMB_SIZE) -> Optional[ThumbPack]:
+    """打开已有的包用于增量复用；文件不存在、损坏或边长不同时返回 None"""
+    try:
+        pack = ThumbPack(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if pack.size != size:
+        pack.close()
+        return None
+    return pack
+
+
+class ThumbSpill:
+    """
+    建库过程中新生成的缩略图的追加文件：每条为 uint32 名称长度 | uint32 数据长度 | 名称 | 数据。
+    内存里只保留 名称 -> (偏移, 长度)；reset=False 时读回已有记录（中断后续建），末尾不完整的记录丢弃
+    """
+    def __init__(self, path: Path, reset: bool = False):
+        self.path = Path(path)
+        self._index: Dict[str, Tuple[int, int]] = {}
+        if reset or not self.path.exists():
+            open(self.path, "wb").close()
+        self._f = open(self.path, "r+b")
+        file_size = os.fstat(self._f.fileno()).st_size
+        end = 0
+        while True:
+            head = self._f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                break
+            name_len, data_len = _RECORD.unpack(head)
+            name = self._f.read(name_len)
+            offset = self._f.tell()
+            if len(name) < name_len or self._f.seek(data_len, 1) > file_size:
+                break
+            self._index[name.decode("utf-8")] = (offset, data_len)
+            end = offset + data_len
+        self._f.truncate(end)
+        self._f.seek(end)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def append(self, name: str, data: bytes):
+        encoded = name.encode("utf-8")
+        self._f.write(_RECORD.pack(len(encoded), len(data)) + encoded)
+        self._index[name] = (self._f.tell(), len(data))
+        self._f.write(data)
+
+    def data_size(self, name: str) -> int:
+        return self._index[name][1]
+
+    def read(self, name: str) -> bytes:
+        offset, length = self._index[name]
+        end = self._f.tell()
+        self._f.seek(offset)
+        data = self._f.read(length)
+        self._f.seek(end)
+        return data
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self, remove: bool = False):
+        self._f.close()
+        if remove:
+            os.remove(self.path)
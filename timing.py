@@ -0,0 +1,133 @@
+"""
+查询路径的分阶段计时：每个阶段保留最近 WINDOW 个样本，查看时再算分位数和直方图。
+
+    with timing.stage("encode"):
+        ...
+    timing.stats()  # {"encode": {"count": ..., "p50_ms": ..., "histogram": {...}}, ...}
+
+ENABLED=False（或启动时设环境变量 STICKER_TIMING=0，运行中用 configure）时
+stage() 直接返回共享的空上下文，开销只有一次函数调用。
+LOG=True（或环境变量 STICKER_TIMING_LOG=1）时每次记录额外打印一行 JSON：
+    [timing] {"stage": "encode", "ms": 12.31, "ts": 1760000000.123}
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+# STICKER_TIMING=0 时查询和建库都不记录各阶段耗时
+ENABLED = os.environ.get("STICKER_TIMING", "1") != "0"
+LOG = os.environ.get("STICKER_TIMING_LOG") == "1"
+WINDOW = 512  # 每个阶段保留的最近样本数
+# 直方图桶的上界（毫秒），最后一个桶收所有更慢的样本
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class RollingHistogram:
+    """最近 window 个样本（毫秒）的环形缓冲，累计次数和总时长不受窗口限制"""
+    def __init__(self, window: int = WINDOW):
+        self.samples: deque = deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+
+    def add(self, ms: float):
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        self.last_ms = ms
+
+    def snapshot(self) -> dict:
+        window = np.fromiter(self.samples, dtype=np.float64, count=len(self.samples))
+        if not len(window):
+            return {"count": self.count}
+        p50, p95, p99 = np.percentile(window, (50, 95, 99))
+        counts = np.bincount(np.searchsorted(BUCKETS_MS, window), minlength=len(BUCKETS_MS) + 1)
+        labels = [f"<={b}ms" for b in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "last_ms": self.last_ms,
+            "mean_ms": self.total_ms / self.count,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(window.max()),
+            "histogram": {label: int(c) for label, c in zip(labels, counts) if c},
+        }
+
+
+_lock = threading.Lock()
+_stages: Dict[str, RollingHistogram] = {}
+
+
+def record(name: str, seconds: float):
+    ms = seconds * 1000
+    with _lock:
+        hist = _stages.get(name)
+        if hist is None:
+            hist = _stages[name] = RollingHistogram()
+        hist.add(ms)
+    if LOG:
+        print("[timing] " + json.dumps({"stage": name, "ms": round(ms, 3), "ts": round(time.time(), 3)}))
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def stage(name: str):
+    """计时上下文；关闭时返回不做任何事的共享对象"""
+    return _Span(name) if ENABLED else _NULL_SPAN
+
+
+def configure(enabled: Optional[bool] = None, log: Optional[bool] = None):
+    global ENABLED, LOG
+    if enabled is not None:
+        ENABLED = enabled
+    if log is not None:
+        LOG = log
+
+
+def stats() -> Dict[str, dict]:
+    with _lock:
+        return {name: hist.snapshot() for name, hist in _stages.items()}
+
+
+def snapshot(name: str) -> Optional[dict]:
+    """单个阶段的统计，还没有样本时返回 None"""
+    with _lock:
+        hist = _stages.get(name)
+        return hist.snapshot() if hist is not None and hist.count else None
+
+
+def reset():
+    with _lock:
+        _stages.clear()